@@ -0,0 +1,171 @@
+"""Hydratation d'une page de messages: requêtes séparées contre message_hydrator.
+
+Usage (base jetable: le script crée des utilisateurs, un salon, des messages,
+des réponses et des réactions):
+
+    python benchmarks/message_hydration.py --messages 20000
+    python benchmarks/message_hydration.py --database-url postgresql://... --messages 20000
+
+Ancien chemin: lignes de la page, parents en IN, réactions regroupées par
+GROUP BY/GROUP_CONCAT avec JOIN users, expéditeurs par user_cache, miniatures
+et messages vocaux (comme api_messages avant message_hydrator). Hydratation
+à froid: caches vidés avant chaque page; à chaud: pages déjà vues
+(historique relu, défilement).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMOJIS = ['👍', '❤️', '😂', '😮', '😢', '🔥']
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(name, latencies):
+    print(f"{name:<18} {len(latencies) / sum(latencies):>8.0f} pages/s   "
+          f"p50 {statistics.median(latencies) * 1000:.3f} ms / p99 {percentile(latencies, 99) * 1000:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="Base de test (défaut: SQLite temporaire)")
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--hot-pages', type=int, default=20, help="Pages distinctes du parcours à chaud")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='message_hydration_')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, ROOT)
+
+    import db_pool
+    import db_query
+    import init_and_migrate
+    import message_hydrator
+    import reaction_summaries
+    import user_cache
+
+    init_and_migrate.init_db_schema()
+
+    def connection():
+        return db_query.connect(db_pool.get_pool().connection())
+
+    rng = random.Random(42)
+    conn = connection()
+    user_ids = []
+    for i in range(args.users):
+        conn.execute("INSERT OR IGNORE INTO users (username, email, password) VALUES (?, ?, 'x')",
+                     (f"bench{i}", f"bench{i}@example.com"))
+        user_ids.append(conn.execute("SELECT id FROM users WHERE username = ?", (f"bench{i}",)).fetchone()['id'])
+    room_id = conn.execute("INSERT INTO rooms (name, creator_id) VALUES (?, ?)",
+                           (f"bench-{os.getpid()}", user_ids[0])).lastrowid
+
+    # Messages: 20 % de réponses, 30 % avec réactions (1 à 8 utilisateurs)
+    message_ids = []
+    for i in range(args.messages):
+        parent_id = rng.choice(message_ids[-200:]) if message_ids and rng.random() < 0.2 else None
+        message_ids.append(conn.execute("""
+            INSERT INTO messages (room_id, sender_id, content, parent_message_id) VALUES (?, ?, ?, ?)
+        """, (room_id, rng.choice(user_ids), f"message {i}", parent_id)).lastrowid)
+    reactions = []
+    for message_id in message_ids:
+        if rng.random() < 0.3:
+            for user_id in rng.sample(user_ids, rng.randint(1, 8)):
+                reactions.append((user_id, message_id, rng.choice(EMOJIS)))
+    conn.executemany("INSERT INTO reactions (user_id, message_id, emoji) VALUES (?, ?, ?)", reactions)
+    conn.execute("DELETE FROM reaction_summaries")
+    reaction_summaries.backfill(conn)
+    conn.commit()
+    print(f"{len(message_ids)} messages, {len(reactions)} réactions, pages de {args.page_size}")
+
+    def random_page(starts):
+        start = rng.choice(starts)
+        return message_ids[start:start + args.page_size]
+
+    all_starts = range(0, len(message_ids) - args.page_size)
+    hot_starts = [rng.choice(all_starts) for _ in range(args.hot_pages)]
+
+    def legacy(conn, ids):
+        placeholders = ','.join(['?'] * len(ids))
+        rows = conn.execute(f"""
+            SELECT m.id, m.sender_id, m.content, m.media_url, m.file_type, m.voice_message_url,
+                   m.parent_message_id, strftime('%d/%m/%Y %H:%M', m.timestamp) AS timestamp
+            FROM messages m WHERE m.id IN ({placeholders})
+        """, ids).fetchall()
+        parent_ids = [row['parent_message_id'] for row in rows if row['parent_message_id']]
+        parents = {}
+        if parent_ids:
+            parents = {row['id']: row for row in conn.execute(f"""
+                SELECT m.id, m.content, m.sender_id FROM messages m
+                WHERE m.id IN ({','.join(['?'] * len(parent_ids))})
+            """, parent_ids).fetchall()}
+        users = user_cache.get_user_summaries(
+            conn, [row['sender_id'] for row in rows] + [parent['sender_id'] for parent in parents.values()])
+        grouped = {}
+        for reaction in conn.execute(f"""
+            SELECT r.message_id, r.emoji, COUNT(*) AS count, GROUP_CONCAT(u.username, ', ') AS usernames
+            FROM reactions r JOIN users u ON r.user_id = u.id
+            WHERE r.message_id IN ({placeholders})
+            GROUP BY r.message_id, r.emoji
+        """, ids).fetchall():
+            grouped.setdefault(reaction['message_id'], []).append(
+                {'emoji': reaction['emoji'], 'count': reaction['count'], 'usernames': reaction['usernames']})
+        messages = []
+        for row in rows:
+            message = dict(row)
+            message['sender_username'] = users[row['sender_id']]['username']
+            message['reactions'] = grouped.get(row['id'], [])
+            parent = parents.get(row['parent_message_id'])
+            if parent:
+                message['parent_content'] = parent['content']
+                message['parent_username'] = users[parent['sender_id']]['username']
+            messages.append(message)
+        message_hydrator.apply_media_variants(conn, messages)
+        message_hydrator.apply_voice_notes(conn, messages)
+        return messages
+
+    def hydrate_cold(conn, ids):
+        message_hydrator.clear()
+        reaction_summaries._cache.clear()
+        return message_hydrator.hydrate(conn, ids)
+
+    def measure(name, hydrate, starts):
+        conn = connection()
+        hydrate(conn, random_page(starts))
+        latencies = []
+        for _ in range(args.pages):
+            ids = random_page(starts)
+            start = time.perf_counter()
+            hydrate(conn, ids)
+            latencies.append(time.perf_counter() - start)
+        conn.close()
+        report(name, latencies)
+
+    # Même contenu des deux côtés (les champs propres à chaque chemin mis à part)
+    sample = message_ids[:args.page_size]
+    expected = {m['id']: (m['content'], m.get('parent_content'), len(m['reactions'])) for m in legacy(conn, sample)}
+    hydrated = {m['id']: (m['content'], m.get('parent_content'), len(m.get('reactions', [])))
+                for m in message_hydrator.hydrate(conn, sample)}
+    conn.close()
+    if expected != hydrated:
+        print("⚠️ Résultats différents entre les deux chemins")
+        sys.exit(1)
+
+    measure('requêtes séparées', legacy, all_starts)
+    measure('hydratation froide', hydrate_cold, all_starts)
+    measure('hydratation chaude', message_hydrator.hydrate, hot_starts)
+    print('cache des messages:', message_hydrator.stats())
+
+
+if __name__ == '__main__':
+    main()
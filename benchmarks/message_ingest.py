@@ -0,0 +1,115 @@
+"""Débit d'insertion des messages: chemin direct contre écriture différée.
+
+Usage (base jetable: le script crée un utilisateur, un salon et des messages):
+
+    python benchmarks/message_ingest.py --messages 5000
+    python benchmarks/message_ingest.py --database-url postgresql://... --messages 5000
+
+Chemin direct: un INSERT + COMMIT par message, comme handle_send_message.
+Écriture différée: journal local + INSERT multi-lignes par lots
+(message_ingest.MessageIngest). Le chronomètre s'arrête quand tous les
+messages sont en base.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(name, count, elapsed, latencies):
+    print(f"{name:<16} {count / elapsed:>10.0f} msg/s   "
+          f"latence d'envoi p50 {statistics.median(latencies) * 1000:.3f} ms / "
+          f"p99 {percentile(latencies, 99) * 1000:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="Base de test (défaut: SQLite temporaire)")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--flush-interval', type=float, default=0.2)
+    parser.add_argument('--fsync', action='store_true', help="fsync du journal à chaque message")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='message_ingest_')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, ROOT)
+
+    import db_pool
+    import db_query
+    import init_and_migrate
+    import message_ingest
+
+    init_and_migrate.init_db_schema()
+
+    def connection():
+        return db_query.connect(db_pool.get_pool().connection())
+
+    conn = connection()
+    conn.execute("INSERT OR IGNORE INTO users (username, email, password) VALUES ('bench', 'bench@example.com', 'x')")
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'bench'").fetchone()['id']
+    room_id = conn.execute("INSERT INTO rooms (name, creator_id) VALUES ('bench', ?)", (user_id,)).lastrowid
+    conn.commit()
+    conn.close()
+
+    def count_messages():
+        with connection() as conn:
+            return conn.execute("SELECT COUNT(*) AS n FROM messages WHERE room_id = ?", (room_id,)).fetchone()['n']
+
+    # Chemin direct
+    latencies = []
+    start = time.perf_counter()
+    for i in range(args.messages):
+        sent = time.perf_counter()
+        conn = connection()
+        conn.execute("""
+            INSERT INTO messages (room_id, sender_id, content, media_url, file_type, voice_message_url, parent_message_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (room_id, user_id, f"direct {i}", None, None, None, None))
+        conn.commit()
+        conn.close()
+        latencies.append(time.perf_counter() - sent)
+    report('direct', args.messages, time.perf_counter() - start, latencies)
+
+    # Écriture différée
+    before = count_messages()
+    ingest = message_ingest.MessageIngest(journal_dir=os.path.join(workdir, 'journal'),
+                                          batch_size=args.batch_size,
+                                          flush_interval=args.flush_interval, fsync=args.fsync)
+
+    def start_daemon(target):
+        threading.Thread(target=target, daemon=True).start()
+
+    ingest.start(start_daemon)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(args.messages):
+        sent = time.perf_counter()
+        # Connexion de l'événement, comme handle_send_message
+        with connection() as conn:
+            ingest.submit(conn, room_id, user_id, f"write-behind {i}", None, None, None, None)
+        latencies.append(time.perf_counter() - sent)
+    ingest.close()
+    elapsed = time.perf_counter() - start
+    report('write-behind', args.messages, elapsed, latencies)
+
+    stats = ingest.stats()
+    persisted = count_messages() - before
+    print(f"lots: {stats['batches']} (taille moyenne {stats['avg_batch_size']}), "
+          f"messages en base: {persisted}/{args.messages}")
+    if persisted != args.messages:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Latence de la recherche plein texte des messages (message_search).
+
+Usage (base jetable: le script crée un utilisateur, des salons et des messages):
+
+    python benchmarks/message_search.py --messages 1000000
+    python benchmarks/message_search.py --database-url postgresql://... --messages 1000000
+
+Les messages sont tirés d'un vocabulaire à distribution de Zipf: quelques
+mots très fréquents, beaucoup de mots rares. Chaque requête (terme rare,
+terme courant, préfixe, plusieurs termes) est mesurée dans un salon et sur
+tous les salons de l'utilisateur; temps moyen par page (première et suivante).
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="Base de test (défaut: SQLite temporaire)")
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='message_search_')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, ROOT)
+
+    import db_pool
+    import db_query
+    import init_and_migrate
+    import message_ingest
+    import message_search
+
+    init_and_migrate.init_db_schema()
+    conn = db_query.connect(db_pool.get_pool().connection())
+    conn.execute("INSERT OR IGNORE INTO users (username, email, password) VALUES ('bench', 'bench@example.com', 'x')")
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'bench'").fetchone()['id']
+    room_ids = []
+    for i in range(args.rooms):
+        room_id = conn.execute("INSERT INTO rooms (name, creator_id) VALUES (?, ?)", (f'bench {i}', user_id)).lastrowid
+        conn.execute("INSERT INTO room_members (room_id, user_id) VALUES (?, ?)", (room_id, user_id))
+        room_ids.append(room_id)
+    conn.commit()
+
+    rng = random.Random(42)
+    # Mots distincts de 4 à 9 lettres: un préfixe ne couvre que quelques mots, comme en français
+    words = sorted({''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+                    for _ in range(args.vocabulary)})
+    rng.shuffle(words)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    start = time.perf_counter()
+    ids = message_ingest.reserve_message_ids(conn, args.messages)
+    for offset in range(0, args.messages, 1000):
+        records = []
+        for message_id in ids[offset:offset + 1000]:
+            records.append({
+                'id': message_id, 'room_id': rng.choice(room_ids), 'sender_id': user_id,
+                'content': ' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 20))),
+                'media_url': None, 'file_type': None, 'voice_message_url': None,
+                'parent_message_id': None, 'timestamp': '2025-01-01 12:00:00',
+            })
+        message_ingest.insert_messages(conn, records)
+        message_search.index_messages(conn, [(record['id'], record['room_id'], record['content']) for record in records])
+        conn.commit()
+    print(f"{args.messages} messages insérés et indexés en {time.perf_counter() - start:.1f} s")
+    # Statistiques du planificateur à jour, comme sur une base en service
+    conn.execute("ANALYZE")
+    conn.commit()
+
+    queries = {
+        'terme rare': words[-7],
+        'terme courant': words[0],
+        'préfixe': words[40][:3],
+        'deux termes': f"{words[3]} {words[40]}",
+    }
+    for label, text in queries.items():
+        terms = message_search.parse_query(text)
+        for scope, search in (('salon', lambda after: message_search.search_room(conn, room_ids[0], terms, 20, after)),
+                              ('global', lambda after: message_search.search_user_rooms(conn, user_id, terms, 20, after))):
+            timings = []
+            for _ in range(args.repeat):
+                began = time.perf_counter()
+                page = search(None)
+                pages = 1
+                if len(page) == 20:
+                    search((page[-1]['score'], page[-1]['id']))
+                    pages = 2
+                timings.append((time.perf_counter() - began) / pages)
+            print(f"{label:<14} {scope:<7} p50 {statistics.median(timings) * 1000:7.2f} ms   "
+                  f"p99 {percentile(timings, 99) * 1000:7.2f} ms")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
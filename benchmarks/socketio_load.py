@@ -0,0 +1,135 @@
+"""Profil de charge Socket.IO: N clients WebSocket connectés à un salon.
+
+Usage (serveur lancé séparément, ex: gunicorn -c gunicorn_config.py wsgi:application):
+
+    python benchmarks/socketio_load.py --url http://127.0.0.1:5000 --clients 1000 --messages 50
+
+Chaque client se connecte en WebSocket avec la session d'un compte de test,
+rejoint le salon, puis un émetteur envoie --messages messages. On mesure le
+temps de connexion, la latence de diffusion (envoi -> réception par tous les
+clients) et les pertes. Dépendances: python-socketio[asyncio_client], aiohttp.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+import socketio
+
+
+async def login_cookie(url, email, password, username):
+    async with aiohttp.ClientSession() as http:
+        async with http.post(f"{url}/register", allow_redirects=False,
+                             data={'username': username, 'email': email, 'password': password}):
+            pass
+        async with http.post(f"{url}/login", data={'email': email, 'password': password},
+                             allow_redirects=False) as resp:
+            cookie = resp.cookies.get('session')
+            if cookie is None:
+                raise RuntimeError("Connexion impossible: pas de cookie de session")
+            return f"session={cookie.value}"
+
+
+async def ensure_room(url, cookie, name):
+    async with aiohttp.ClientSession(headers={'Cookie': cookie}) as http:
+        async with http.post(f"{url}/create_room", data={'room_name': name}, allow_redirects=False) as resp:
+            location = resp.headers.get('Location', '')
+        if '/chat/' not in location:
+            async with http.get(f"{url}/api/rooms_light") as resp:
+                rooms = await resp.json()
+            for room in rooms:
+                if room['name'] == name[:20]:
+                    return room['id']
+            raise RuntimeError("Salon de test introuvable")
+        return int(location.rstrip('/').rsplit('/', 1)[1])
+
+
+async def join(url, cookie, room_id):
+    async with aiohttp.ClientSession(headers={'Cookie': cookie}) as http:
+        async with http.get(f"{url}/join_room/{room_id}", allow_redirects=False):
+            pass
+
+
+async def run(args):
+    cookies = []
+    for i in range(args.users):
+        cookies.append(await login_cookie(args.url, f"load{i}@example.com", 'load', f"load{i}"))
+    room_id = await ensure_room(args.url, cookies[0], args.room)
+    for cookie in cookies:
+        await join(args.url, cookie, room_id)
+
+    sent_at = {}
+    latencies = []
+    received = [0] * args.clients
+    done = asyncio.Event()
+    expected = args.clients * args.messages
+
+    def make_handler(index):
+        async def on_new_message(message):
+            key = message.get('content')
+            if key in sent_at:
+                latencies.append(time.perf_counter() - sent_at[key])
+                received[index] += 1
+                if len(latencies) >= expected:
+                    done.set()
+        return on_new_message
+
+    clients = []
+    connect_started = time.perf_counter()
+
+    async def connect_one(index):
+        client = socketio.AsyncClient(reconnection=False)
+        client.on('new_message', make_handler(index))
+        await client.connect(args.url, headers={'Cookie': cookies[index % len(cookies)]},
+                             transports=['websocket'], wait_timeout=30)
+        await client.emit('join_room', {'room_id': room_id})
+        clients.append(client)
+
+    for start in range(0, args.clients, args.batch):
+        await asyncio.gather(*(connect_one(i) for i in range(start, min(start + args.batch, args.clients))))
+    connect_time = time.perf_counter() - connect_started
+    print(f"✅ {len(clients)} clients connectés en {connect_time:.1f}s")
+
+    await asyncio.sleep(1)
+    sender = clients[0]
+    send_started = time.perf_counter()
+    for n in range(args.messages):
+        key = f"load-{n}-{time.time_ns()}"
+        sent_at[key] = time.perf_counter()
+        await sender.emit('send_message', {'room_id': room_id, 'content': key})
+        await asyncio.sleep(args.interval)
+
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - send_started
+
+    delivered = len(latencies)
+    print(f"📨 {delivered}/{expected} livraisons ({100.0 * delivered / expected:.1f}%) en {elapsed:.1f}s")
+    if latencies:
+        latencies.sort()
+        p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"⏱️ latence diffusion ms: p50={p(0.5):.0f} p95={p(0.95):.0f} p99={p(0.99):.0f} "
+              f"max={latencies[-1] * 1000:.0f} moyenne={statistics.mean(latencies) * 1000:.0f}")
+        print(f"🚀 débit livraisons: {delivered / elapsed:.0f}/s")
+
+    await asyncio.gather(*(c.disconnect() for c in clients), return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--users', type=int, default=10, help="comptes de test partagés entre les clients")
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.2, help="délai entre deux messages (s)")
+    parser.add_argument('--batch', type=int, default=50, help="connexions simultanées pendant la montée en charge")
+    parser.add_argument('--room', default='load-test')
+    parser.add_argument('--timeout', type=float, default=60)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Envoi de fichiers par morceaux, reprenable après une coupure (/api/uploads).
+
+/upload_file et /upload_voice reçoivent le fichier entier dans un seul corps
+multipart: le worker est occupé pendant tout le transfert et une coupure
+réseau oblige à tout renvoyer. Ici le client ouvre un envoi (nom, taille,
+type), envoie des morceaux bruts à la position attendue, chacun avec sa somme
+SHA-256 (en-tête X-Chunk-SHA256), puis termine l'envoi. Chaque morceau est
+lu par blocs et écrit directement à la suite du fichier partiel; un morceau
+interrompu ou dont la somme ne correspond pas est retiré. Après une coupure,
+le client demande la position déjà reçue et reprend à partir de là.
+
+L'état d'un envoi est sur disque (UPLOAD_SESSIONS_DIR: <id>.part et
+<id>.json), commun aux workers d'une même machine. Les envois abandonnés
+sont supprimés après UPLOAD_SESSION_TTL secondes sans nouveau morceau.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: pas de verrou entre processus
+    fcntl = None
+
+UPLOAD_SESSIONS_DIR = os.environ.get('UPLOAD_SESSIONS_DIR', 'upload_sessions')
+UPLOAD_SESSION_TTL = float(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))
+# Taille de morceau proposée au client, et maximum accepté
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+UPLOAD_CHUNK_MAX = int(os.environ.get('UPLOAD_CHUNK_MAX', 8 * 1024 * 1024))
+# Lecture du corps de la requête par blocs
+READ_BLOCK = 64 * 1024
+SWEEP_INTERVAL = 600
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    """Erreur renvoyée au client avec son code HTTP (et la position reçue)"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def _lock(part):
+    if fcntl is None:
+        return
+    try:
+        fcntl.flock(part.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        raise UploadError("Un morceau de cet envoi est déjà en cours d'écriture", 409)
+
+
+class UploadStore:
+    """Envois en cours, un fichier partiel et ses métadonnées par envoi"""
+
+    def __init__(self, root=UPLOAD_SESSIONS_DIR, ttl=UPLOAD_SESSION_TTL,
+                 chunk_size=UPLOAD_CHUNK_SIZE, chunk_max=UPLOAD_CHUNK_MAX):
+        self.root = root
+        self.ttl = ttl
+        self.chunk_size = min(chunk_size, chunk_max)
+        self.chunk_max = chunk_max
+        self._swept_at = 0
+
+    def _path(self, upload_id, suffix):
+        if not _UPLOAD_ID.match(upload_id or ''):
+            raise UploadError("Envoi introuvable", 404)
+        return os.path.join(self.root, f"{upload_id}.{suffix}")
+
+    def _load(self, upload_id, user_id):
+        try:
+            with open(self._path(upload_id, 'json')) as handle:
+                meta = json.load(handle)
+        except FileNotFoundError:
+            raise UploadError("Envoi introuvable ou expiré", 404)
+        if meta['user_id'] != user_id:
+            raise UploadError("Envoi introuvable", 404)
+        return meta
+
+    def create(self, user_id, kind, filename, size, mimetype, max_size):
+        """Ouvrir un envoi. Retourne son identifiant."""
+        if size <= 0 or size > max_size:
+            raise UploadError(f"Taille invalide (maximum {max_size // (1024 * 1024)} Mo)", 413)
+        os.makedirs(self.root, exist_ok=True)
+        self.sweep()
+        upload_id = uuid.uuid4().hex
+        open(self._path(upload_id, 'part'), 'xb').close()
+        with open(self._path(upload_id, 'json'), 'w') as handle:
+            json.dump({'user_id': user_id, 'kind': kind, 'filename': filename, 'size': size,
+                       'mimetype': mimetype, 'created_at': time.time()}, handle)
+        return upload_id
+
+    def status(self, upload_id, user_id):
+        """(métadonnées, position reçue)"""
+        meta = self._load(upload_id, user_id)
+        return meta, os.path.getsize(self._path(upload_id, 'part'))
+
+    def append(self, upload_id, user_id, offset, stream, checksum):
+        """Écrire un morceau à la position `offset`. Retourne la nouvelle position."""
+        meta = self._load(upload_id, user_id)
+        if not checksum:
+            raise UploadError("Somme de contrôle X-Chunk-SHA256 manquante")
+        with open(self._path(upload_id, 'part'), 'r+b') as part:
+            _lock(part)
+            received = os.fstat(part.fileno()).st_size
+            if offset != received:
+                raise UploadError("Position inattendue", 409, received)
+            part.seek(received)
+            digest = hashlib.sha256()
+            written = 0
+            try:
+                while True:
+                    block = stream.read(READ_BLOCK)
+                    if not block:
+                        break
+                    written += len(block)
+                    if written > self.chunk_max or received + written > meta['size']:
+                        raise UploadError("Morceau trop grand", 413, received)
+                    digest.update(block)
+                    part.write(block)
+                if digest.hexdigest() != checksum.strip().lower():
+                    raise UploadError("Somme de contrôle du morceau invalide", 422, received)
+            except BaseException:
+                # Morceau interrompu ou refusé: revenir à la dernière position valide
+                part.truncate(received)
+                raise
+        return received + written
+
+    def complete(self, upload_id, user_id, checksum=None):
+        """Vérifier que l'envoi est complet. Retourne (chemin du fichier reçu, métadonnées)."""
+        meta, received = self.status(upload_id, user_id)
+        path = self._path(upload_id, 'part')
+        if received != meta['size']:
+            raise UploadError("Envoi incomplet", 409, received)
+        if checksum:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as part:
+                for block in iter(lambda: part.read(READ_BLOCK), b''):
+                    digest.update(block)
+            if digest.hexdigest() != checksum.strip().lower():
+                raise UploadError("Somme de contrôle du fichier invalide", 422)
+        return path, meta
+
+    def discard(self, upload_id):
+        for suffix in ('part', 'json'):
+            try:
+                os.remove(self._path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def sweep(self):
+        """Supprimer les envois abandonnés (au plus une fois toutes les SWEEP_INTERVAL secondes)"""
+        now = time.time()
+        if now - self._swept_at < SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        upload_ids = {name.partition('.')[0] for name in os.listdir(self.root)}
+        for upload_id in filter(_UPLOAD_ID.match, upload_ids):
+            last_write = 0
+            for suffix in ('part', 'json'):
+                try:
+                    last_write = max(last_write, os.path.getmtime(self._path(upload_id, suffix)))
+                except FileNotFoundError:
+                    pass
+            if now - last_write > self.ttl:
+                self.discard(upload_id)
+
+
+uploads = UploadStore()
@@ -0,0 +1,190 @@
+"""Index des conversations privées (table `conversations`).
+
+Une ligne par participant et par interlocuteur: dernier message, aperçu,
+horodatage et compteur de non-lus. La boîte de réception devient une
+lecture d'intervalle sur idx_conversations_user au lieu d'un GROUP BY sur
+tout l'historique de private_messages.
+
+Lecture: last_read_message_id est le plus grand id lu par user_id parmi les
+messages reçus de other_user_id. Un message est lu si son id est inférieur
+ou égal à ce repère; la lecture avance le repère et remet le compteur à zéro
+en une mise à jour d'une ligne, au lieu de réécrire private_messages.is_read
+sur tout l'historique de la paire (colonne qui n'est plus tenue à jour).
+"""
+
+# Longueur de l'aperçu stocké (les pages tronquent encore à 30/50 caractères)
+PREVIEW_LENGTH = 200
+
+_UPSERT_SQL = """
+    INSERT INTO conversations (user_id, other_user_id, last_message_id, last_sender_id,
+                               last_preview, last_timestamp, unread_count)
+    VALUES (?, ?, ?, ?, ?, (SELECT timestamp FROM private_messages WHERE id = ?), ?)
+    ON CONFLICT (user_id, other_user_id) DO UPDATE SET
+        last_sender_id = CASE WHEN excluded.last_message_id > conversations.last_message_id
+                              THEN excluded.last_sender_id ELSE conversations.last_sender_id END,
+        last_preview = CASE WHEN excluded.last_message_id > conversations.last_message_id
+                            THEN excluded.last_preview ELSE conversations.last_preview END,
+        last_timestamp = CASE WHEN excluded.last_message_id > conversations.last_message_id
+                              THEN excluded.last_timestamp ELSE conversations.last_timestamp END,
+        last_message_id = CASE WHEN excluded.last_message_id > conversations.last_message_id
+                               THEN excluded.last_message_id ELSE conversations.last_message_id END,
+        unread_count = conversations.unread_count + excluded.unread_count
+"""
+
+
+def preview_of(content):
+    return content[:PREVIEW_LENGTH] if content else None
+
+
+def record_private_message(conn, message_id, sender_id, receiver_id, content):
+    """Mettre à jour les deux côtés de la conversation après un envoi"""
+    preview = preview_of(content)
+    conn.execute(_UPSERT_SQL, (sender_id, receiver_id, message_id, sender_id, preview, message_id, 0))
+    if receiver_id != sender_id:
+        conn.execute(_UPSERT_SQL, (receiver_id, sender_id, message_id, sender_id, preview, message_id, 1))
+
+
+def mark_read(conn, user_id, other_user_id, up_to=None):
+    """Avancer le repère de lecture jusqu'au message `up_to` (par défaut le dernier).
+
+    Retourne (nombre de non-lus effacés, nouveau repère), ou (0, None) si rien n'a changé.
+    """
+    # Ligne verrouillée avant la lecture et jusqu'au commit (PostgreSQL: FOR UPDATE,
+    # SQLite: verrou d'écriture pris par une mise à jour neutre): un envoi concurrent
+    # attend, et son unread_count + 1 n'est pas écrasé par la valeur calculée ici
+    select_sql = """
+        SELECT unread_count, last_message_id, last_read_message_id FROM conversations
+        WHERE user_id = ? AND other_user_id = ?
+    """
+    if getattr(conn, 'is_postgres', False):
+        select_sql += " FOR UPDATE"
+    else:
+        conn.execute("UPDATE conversations SET unread_count = unread_count WHERE user_id = ? AND other_user_id = ?",
+                     (user_id, other_user_id))
+    row = conn.execute(select_sql, (user_id, other_user_id)).fetchone()
+    if not row:
+        return 0, None
+    watermark = row['last_message_id'] if up_to is None else min(up_to, row['last_message_id'])
+    if watermark <= row['last_read_message_id']:
+        return 0, None
+
+    remaining = 0
+    if watermark < row['last_message_id'] and row['unread_count']:
+        # Les non-lus sont les plus récents: seuls unread_count messages reçus sont examinés
+        remaining = conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT id FROM private_messages
+                WHERE sender_id = ? AND receiver_id = ?
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            ) recent
+            WHERE id > ?
+        """, (other_user_id, user_id, row['unread_count'], watermark)).fetchone()[0]
+    conn.execute("""
+        UPDATE conversations SET last_read_message_id = ?, unread_count = ?
+        WHERE user_id = ? AND other_user_id = ?
+    """, (watermark, remaining, user_id, other_user_id))
+    return row['unread_count'] - remaining, watermark
+
+
+def read_watermark(conn, user_id, other_user_id):
+    """Dernier message de other_user_id lu par user_id (0 si aucun)"""
+    row = conn.execute("""
+        SELECT last_read_message_id FROM conversations WHERE user_id = ? AND other_user_id = ?
+    """, (user_id, other_user_id)).fetchone()
+    return row['last_read_message_id'] if row else 0
+
+
+def refresh_pair(conn, user_a, user_b):
+    """Recalculer le dernier message de la paire (après suppression d'un message)"""
+    last = conn.execute("""
+        SELECT id, sender_id, content FROM (
+            SELECT * FROM (SELECT id, sender_id, content, timestamp FROM private_messages
+                           WHERE sender_id = ? AND receiver_id = ?
+                           ORDER BY timestamp DESC, id DESC LIMIT 1) a
+            UNION ALL
+            SELECT * FROM (SELECT id, sender_id, content, timestamp FROM private_messages
+                           WHERE sender_id = ? AND receiver_id = ?
+                           ORDER BY timestamp DESC, id DESC LIMIT 1) b
+        ) last_messages
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 1
+    """, (user_a, user_b, user_b, user_a)).fetchone()
+
+    pairs = ((user_a, user_b), (user_b, user_a))
+    if not last:
+        for user_id, other_user_id in pairs:
+            conn.execute("DELETE FROM conversations WHERE user_id = ? AND other_user_id = ?",
+                         (user_id, other_user_id))
+        return
+
+    for user_id, other_user_id in pairs:
+        conn.execute("""
+            UPDATE conversations
+            SET last_message_id = ?, last_sender_id = ?, last_preview = ?,
+                last_timestamp = (SELECT timestamp FROM private_messages WHERE id = ?)
+            WHERE user_id = ? AND other_user_id = ?
+        """, (last['id'], last['sender_id'], preview_of(last['content']), last['id'], user_id, other_user_id))
+
+
+def decrement_unread(conn, user_id, other_user_id, message_id):
+    """Message reçu supprimé: retirer un non-lu s'il était après le repère. Retourne 1 ou 0."""
+    return conn.execute("""
+        UPDATE conversations SET unread_count = unread_count - 1
+        WHERE user_id = ? AND other_user_id = ? AND unread_count > 0 AND last_read_message_id < ?
+    """, (user_id, other_user_id, message_id)).rowcount
+
+
+def list_conversations(conn, user_id, limit=None):
+    """Conversations de l'utilisateur, la plus récente d'abord"""
+    sql = """
+        SELECT c.other_user_id, u.username AS other_username,
+               u.profile_picture_url AS other_profile_pic,
+               c.last_preview AS last_message, c.last_timestamp, c.unread_count
+        FROM conversations c
+        JOIN users u ON u.id = c.other_user_id
+        WHERE c.user_id = ?
+        ORDER BY c.last_timestamp DESC, c.last_message_id DESC
+    """
+    if limit:
+        return conn.execute(sql + " LIMIT ?", (user_id, limit)).fetchall()
+    return conn.execute(sql, (user_id,)).fetchall()
+
+
+# Reconstruction complète depuis private_messages (migration initiale): le repère de
+# lecture reprend le dernier message marqué is_read par l'ancien modèle
+BACKFILL_SQL = """
+    INSERT INTO conversations (user_id, other_user_id, last_message_id, last_sender_id,
+                               last_preview, last_timestamp, unread_count, last_read_message_id)
+    SELECT s.user_id, s.other_user_id, pm.id, pm.sender_id, SUBSTR(pm.content, 1, 200), pm.timestamp,
+           (SELECT COUNT(*) FROM private_messages unread
+            WHERE unread.receiver_id = s.user_id AND unread.sender_id = s.other_user_id
+              AND unread.id > s.read_id),
+           s.read_id
+    FROM (
+        SELECT user_id, other_user_id, MAX(id) AS last_id, COALESCE(MAX(read_id), 0) AS read_id FROM (
+            SELECT sender_id AS user_id, receiver_id AS other_user_id, id, NULL AS read_id FROM private_messages
+            UNION ALL
+            SELECT receiver_id AS user_id, sender_id AS other_user_id, id,
+                   CASE WHEN is_read THEN id END AS read_id
+            FROM private_messages
+        ) sides
+        GROUP BY user_id, other_user_id
+    ) s
+    JOIN private_messages pm ON pm.id = s.last_id
+"""
+
+# Colonne ajoutée à un index existant: repère repris de is_read, non-lus recomptés
+WATERMARK_MIGRATION_SQL = (
+    """
+    UPDATE conversations SET last_read_message_id = COALESCE(
+        (SELECT MAX(pm.id) FROM private_messages pm
+         WHERE pm.receiver_id = conversations.user_id AND pm.sender_id = conversations.other_user_id
+           AND pm.is_read), 0)
+    """,
+    """
+    UPDATE conversations SET unread_count = (
+        SELECT COUNT(*) FROM private_messages pm
+        WHERE pm.receiver_id = conversations.user_id AND pm.sender_id = conversations.other_user_id
+          AND pm.id > conversations.last_read_message_id)
+    """,
+)
@@ -0,0 +1,282 @@
+import os
+import sqlite3
+import threading
+import time
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
+
+# Dimensionnement du pool (surchargeable par variables d'environnement)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = float(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PING_INTERVAL = float(os.environ.get('DB_POOL_PING_INTERVAL', 30))
+
+
+def is_postgres(database_url=None):
+    url = database_url or DATABASE_URL
+    return url.startswith('postgresql://') or url.startswith('postgres://')
+
+
+class PoolTimeout(Exception):
+    """Aucune connexion libérée avant l'expiration du délai d'attente"""
+
+
+class _PoolEntry:
+    __slots__ = ('raw', 'created_at', 'last_used', 'state')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # État lié à la connexion physique (ex: requêtes préparées)
+        self.state = {}
+
+
+class PooledConnection:
+    """Connexion empruntée au pool: close() la rend au pool au lieu de la fermer"""
+
+    def __init__(self, pool, entry, owned=True):
+        self._pool = pool
+        self._entry = entry
+        # owned=False: la connexion appartient au contexte Flask, close() ne fait rien
+        self._owned = owned
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get('_entry')
+        if entry is None:
+            raise AttributeError(f"Connexion déjà rendue au pool ({name})")
+        return getattr(entry.raw, name)
+
+    @property
+    def raw(self):
+        return self._entry.raw
+
+    @property
+    def state(self):
+        return self._entry.state
+
+    @property
+    def is_postgres(self):
+        return self._pool.is_postgres
+
+    def close(self):
+        if self._owned and self._entry is not None:
+            self._pool.release(self._entry)
+            self._entry = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Pool borné de connexions PostgreSQL/SQLite avec contrôle de santé"""
+
+    def __init__(self, database_url=DATABASE_URL, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 recycle=DB_POOL_RECYCLE, ping_interval=DB_POOL_PING_INTERVAL):
+        self.database_url = database_url
+        self.is_postgres = is_postgres(database_url)
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        # threading est résolu à la création du pool: après gevent.monkey.patch_all()
+        # la Condition est coopérative et l'attente ne bloque que le greenlet courant.
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._waiters = 0
+
+        # Métriques
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        if not self.is_postgres:
+            print("⚠️ Utilisation de SQLite - données non persistantes en production!")
+
+    def _connect(self):
+        if self.is_postgres:
+            import psycopg2
+            try:
+                # autocommit désactivé: commit()/rollback() délimitent les transactions
+                # des routes comme sous SQLite
+                return psycopg2.connect(self.database_url)
+            except psycopg2.Error as e:
+                print(f"❌ Erreur de connexion PostgreSQL: {e}")
+                raise
+        conn = sqlite3.connect(self.database_url.replace('sqlite:///', ''), check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _is_healthy(self, entry):
+        now = time.monotonic()
+        if self.recycle and now - entry.created_at > self.recycle:
+            return False
+        raw = entry.raw
+        if self.is_postgres and raw.closed:
+            return False
+        if now - entry.last_used < self.ping_interval:
+            return True
+        try:
+            cursor = raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, entry):
+        try:
+            entry.raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def acquire(self):
+        """Emprunter une connexion (attend si le pool est plein)"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            entry = None
+            create = False
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"Pool saturé ({self.max_size} connexions en cours d'utilisation)")
+                    self._waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    entry = _PoolEntry(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(entry):
+                self._discard(entry)
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return entry
+
+    def release(self, entry):
+        """Rendre une connexion au pool"""
+        raw = entry.raw
+        try:
+            if self.is_postgres and raw.closed:
+                self._discard(entry)
+                return
+            # Abandonner toute écriture non validée (et la transaction de lecture
+            # ouverte sous PostgreSQL), comme le faisait close()
+            raw.rollback()
+        except Exception:
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def connection(self):
+        """Connexion hors contexte Flask: close() la rend au pool"""
+        return PooledConnection(self, self.acquire())
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for entry in idle:
+            try:
+                entry.raw.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'backend': 'postgresql' if self.is_postgres else 'sqlite',
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': idle,
+                'in_use': self._size - idle,
+                'waiters': self._waiters,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'avg_checkout_ms': round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                'max_checkout_ms': round(self._wait_max * 1000, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Pool partagé du processus, créé à la première utilisation"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_db_connection():
+    """Connexion pour la requête (ou l'événement Socket.IO) en cours.
+
+    Dans un contexte d'application Flask la connexion est empruntée une seule
+    fois et rendue par teardown_appcontext; close() y est donc sans effet.
+    Hors contexte (scripts, migrations) close() rend la connexion au pool.
+    """
+    from flask import g, has_app_context
+
+    pool = get_pool()
+    if not has_app_context():
+        return pool.connection()
+
+    entry = g.get('_db_pool_entry')
+    if entry is None:
+        entry = pool.acquire()
+        g._db_pool_entry = entry
+    return PooledConnection(pool, entry, owned=False)
+
+
+def release_app_connection(exc=None):
+    from flask import g
+
+    entry = g.pop('_db_pool_entry', None)
+    if entry is not None:
+        get_pool().release(entry)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_app_connection)
@@ -0,0 +1,443 @@
+"""Couche de requêtes indépendante du dialecte.
+
+Les routes écrivent leur SQL dans le dialecte SQLite (placeholders `?`,
+`INSERT OR IGNORE`, `strftime`, `GROUP_CONCAT`, `datetime('now', ...)`).
+Sur PostgreSQL chaque requête est traduite une seule fois (cache), préparée
+côté serveur sur chaque connexion et renvoie des lignes qui se comportent
+comme sqlite3.Row. Derrière un pooler en mode transaction (port 6543 de
+Supabase, ou DB_PREPARED_STATEMENTS=0), les requêtes sont envoyées sans
+préparation.
+"""
+import datetime
+import decimal
+import hashlib
+import os
+import re
+import sqlite3
+from functools import lru_cache
+from urllib.parse import urlparse
+
+try:
+    import psycopg2
+    import psycopg2.errorcodes
+    import psycopg2.extensions
+    # Tuple utilisable directement dans `except IntegrityError:`
+    IntegrityError = (sqlite3.IntegrityError, psycopg2.IntegrityError)
+except ImportError:
+    psycopg2 = None
+    IntegrityError = (sqlite3.IntegrityError,)
+
+SQLITE = 'sqlite'
+POSTGRESQL = 'postgresql'
+
+# Clés de conflit utilisées pour traduire INSERT OR REPLACE en ON CONFLICT
+CONFLICT_KEYS = {
+    'user_activity': ('user_id',),
+    'friend_requests': ('sender_id', 'receiver_id'),
+    'friends': ('user_id', 'friend_id'),
+    'room_members': ('room_id', 'user_id'),
+    'user_profile_likes': ('liker_user_id', 'liked_user_id'),
+    'media_variants': ('source',),
+    'voice_notes': ('source',),
+}
+
+# Tables sans colonne id: pas de RETURNING id automatique
+TABLES_WITHOUT_ID = {'user_activity', 'room_activity', 'media_objects', 'media_variants', 'voice_notes',
+                     'room_daily_stats', 'sender_daily_stats', 'user_daily_stats', 'user_badges',
+                     'reaction_summaries', 'presence_sessions'}
+
+# Colonnes BOOLEAN sous PostgreSQL comparées à 0/1 dans le SQL SQLite
+BOOLEAN_COLUMNS = ('is_private', 'is_read', 'is_pinned', 'is_online', 'notification_sound')
+
+# Nombre maximum de requêtes préparées par connexion
+MAX_PREPARED_PER_CONNECTION = 256
+
+# Pooler Supabase en mode transaction (pgbouncer): chaque transaction peut passer par une
+# autre connexion serveur, où les requêtes préparées de la session n'existent pas
+TRANSACTION_POOLER_PORT = 6543
+
+
+def _default_prepared_statements():
+    try:
+        port = urlparse(os.environ.get('DATABASE_URL', '')).port
+    except ValueError:
+        port = None
+    return '0' if port == TRANSACTION_POOLER_PORT else '1'
+
+
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', _default_prepared_statements()) == '1'
+
+_STRFTIME_TOKENS = {
+    '%d': 'DD', '%m': 'MM', '%Y': 'YYYY', '%H': 'HH24', '%M': 'MI', '%S': 'SS', '%j': 'DDD', '%w': 'D',
+}
+
+_INSERT_OR_REPLACE = re.compile(
+    r"INSERT\s+OR\s+REPLACE\s+INTO\s+(\w+)\s*\(([^)]*)\)\s*VALUES\s*\((.*)\)\s*$",
+    re.IGNORECASE | re.DOTALL)
+_INSERT_OR_IGNORE = re.compile(r"INSERT\s+OR\s+IGNORE\s+INTO", re.IGNORECASE)
+_INSERT_TABLE = re.compile(r"^\s*INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+_INDEXED_BY = re.compile(r"\s+INDEXED\s+BY\s+\w+", re.IGNORECASE)
+_STRFTIME = re.compile(r"strftime\(\s*'([^']*)'\s*,\s*([^()]+?)\s*\)", re.IGNORECASE)
+_GROUP_CONCAT = re.compile(r"GROUP_CONCAT\(\s*([^(),]+?)\s*(?:,\s*('[^']*'))?\s*\)", re.IGNORECASE)
+_DATETIME_NOW = re.compile(r"datetime\(\s*'now'\s*(?:,\s*'([+-]?\d+)\s+(\w+)')?\s*\)", re.IGNORECASE)
+_DATE_NOW = re.compile(r"DATE\(\s*'now'\s*\)", re.IGNORECASE)
+_BOOLEAN_LITERAL = re.compile(
+    r"\b(%s)\s*(=|!=|<>)\s*([01])\b" % '|'.join(BOOLEAN_COLUMNS), re.IGNORECASE)
+
+
+class Statement:
+    """Requête compilée pour un dialecte"""
+    __slots__ = ('sql', 'text', 'prepared_text', 'param_count', 'returning_id', 'name')
+
+    def __init__(self, sql, text, prepared_text, param_count, returning_id):
+        self.sql = sql
+        self.text = text
+        self.prepared_text = prepared_text
+        self.param_count = param_count
+        self.returning_id = returning_id
+        self.name = 'q_' + hashlib.md5(prepared_text.encode('utf-8')).hexdigest()[:16]
+
+
+def _split_literals(sql):
+    """Découpe le SQL en (est_littéral, morceau) pour ne pas toucher aux chaînes"""
+    parts = []
+    buf = []
+    in_literal = False
+    i = 0
+    while i < len(sql):
+        ch = sql[i]
+        if ch == "'":
+            if in_literal and i + 1 < len(sql) and sql[i + 1] == "'":
+                buf.append("''")
+                i += 2
+                continue
+            if in_literal:
+                buf.append(ch)
+                parts.append((True, ''.join(buf)))
+                buf = []
+            else:
+                if buf:
+                    parts.append((False, ''.join(buf)))
+                buf = [ch]
+            in_literal = not in_literal
+        else:
+            buf.append(ch)
+        i += 1
+    if buf:
+        parts.append((in_literal, ''.join(buf)))
+    return parts
+
+
+def _strftime_to_char(match):
+    fmt = match.group(1)
+    for token, replacement in _STRFTIME_TOKENS.items():
+        fmt = fmt.replace(token, replacement)
+    return f"to_char({match.group(2)}, '{fmt}')"
+
+
+def _group_concat_to_string_agg(match):
+    separator = match.group(2) or "','"
+    return f"STRING_AGG(({match.group(1)})::text, {separator})"
+
+
+def _datetime_now_to_interval(match):
+    if not match.group(1):
+        return "CURRENT_TIMESTAMP"
+    return f"(CURRENT_TIMESTAMP + INTERVAL '{match.group(1)} {match.group(2)}')"
+
+
+def _insert_or_replace_to_upsert(sql):
+    match = _INSERT_OR_REPLACE.search(sql)
+    if not match:
+        return sql
+    table, columns, values = match.group(1), match.group(2), match.group(3)
+    keys = CONFLICT_KEYS.get(table.lower())
+    if not keys:
+        raise ValueError(f"INSERT OR REPLACE sans clé de conflit connue pour la table {table}")
+    column_names = [c.strip() for c in columns.split(',')]
+    updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in column_names if c not in keys)
+    action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    return (f"INSERT INTO {table} ({columns}) VALUES ({values}) "
+            f"ON CONFLICT ({', '.join(keys)}) {action}")
+
+
+def _translate_postgres(sql):
+    sql = sql.strip().rstrip(';')
+    sql = _INDEXED_BY.sub('', sql)
+    sql = _STRFTIME.sub(_strftime_to_char, sql)
+    sql = _GROUP_CONCAT.sub(_group_concat_to_string_agg, sql)
+    sql = _DATETIME_NOW.sub(_datetime_now_to_interval, sql)
+    sql = _DATE_NOW.sub('CURRENT_DATE', sql)
+    sql = _BOOLEAN_LITERAL.sub(lambda m: f"{m.group(1)} {m.group(2)} {'TRUE' if m.group(3) == '1' else 'FALSE'}", sql)
+    if _INSERT_OR_IGNORE.search(sql):
+        sql = _INSERT_OR_IGNORE.sub('INSERT INTO', sql) + ' ON CONFLICT DO NOTHING'
+    sql = _insert_or_replace_to_upsert(sql)
+
+    returning_id = False
+    insert = _INSERT_TABLE.match(sql)
+    if insert and insert.group(1).lower() not in TABLES_WITHOUT_ID and 'RETURNING' not in sql.upper():
+        sql += ' RETURNING id'
+        returning_id = True
+    return sql, returning_id
+
+
+@lru_cache(maxsize=1024)
+def compile_sql(sql, dialect):
+    """Traduire (une seule fois) une requête SQLite vers le dialecte demandé"""
+    if dialect == SQLITE:
+        return Statement(sql, sql, sql, sql.count('?'), False)
+
+    translated, returning_id = _translate_postgres(sql)
+    text_parts = []
+    prepared_parts = []
+    count = 0
+    for is_literal, chunk in _split_literals(translated):
+        if is_literal:
+            text_parts.append(chunk.replace('%', '%%'))
+            prepared_parts.append(chunk)
+            continue
+        text_chunk = []
+        prepared_chunk = []
+        for ch in chunk:
+            if ch == '?':
+                count += 1
+                text_chunk.append('%s')
+                prepared_chunk.append(f'${count}')
+            elif ch == '%':
+                text_chunk.append('%%')
+                prepared_chunk.append(ch)
+            else:
+                text_chunk.append(ch)
+                prepared_chunk.append(ch)
+        text_parts.append(''.join(text_chunk))
+        prepared_parts.append(''.join(prepared_chunk))
+
+    prepared_text = ''.join(prepared_parts)
+    # Sans paramètres psycopg2 n'interprète pas les %: on garde le texte brut
+    text = ''.join(text_parts) if count else prepared_text
+    return Statement(sql, text, prepared_text, count, returning_id)
+
+
+def _normalize(value):
+    # Mêmes représentations que SQLite pour que les routes restent inchangées
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+class Row:
+    """Ligne accessible par index ou par nom, comme sqlite3.Row"""
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return self._values[key]
+        try:
+            return self._values[self._index[key]]
+        except KeyError:
+            return self._values[self._index[key.lower()]]
+
+    def keys(self):
+        return list(self._index)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._index == other._index and self._values == other._values
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._values)
+
+    def __repr__(self):
+        return f"<Row {dict(zip(self._index, self._values))}>"
+
+
+class Cursor:
+    """Curseur PostgreSQL avec l'interface utilisée par les routes"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+        self._index = None
+        self._pending = None
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        statement = compile_sql(sql, POSTGRESQL)
+        self._connection._run(self._cursor, statement, tuple(params))
+        self._index = None
+        self._pending = None
+        self.lastrowid = None
+        if statement.returning_id:
+            row = self._cursor.fetchone() if self._cursor.description else None
+            self.lastrowid = row[0] if row else None
+            self._pending = [row] if row else []
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        statement = compile_sql(sql, POSTGRESQL)
+        self._cursor.executemany(statement.text, [tuple(p) for p in seq_of_params])
+        self._index = None
+        self._pending = None
+        return self
+
+    def _row_index(self):
+        if self._index is None:
+            self._index = {col[0].lower(): i for i, col in enumerate(self._cursor.description or ())}
+        return self._index
+
+    def _wrap(self, values):
+        return Row(self._row_index(), tuple(_normalize(v) for v in values))
+
+    def fetchone(self):
+        if self._pending is not None:
+            values = self._pending.pop(0) if self._pending else None
+        elif self._cursor.description is None:
+            return None
+        else:
+            values = self._cursor.fetchone()
+        return self._wrap(values) if values is not None else None
+
+    def fetchall(self):
+        if self._pending is not None:
+            rows, self._pending = self._pending, []
+        elif self._cursor.description is None:
+            return []
+        else:
+            rows = self._cursor.fetchall()
+        return [self._wrap(values) for values in rows]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    """Connexion PostgreSQL du pool exposée avec l'API de sqlite3.Connection"""
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    @property
+    def raw(self):
+        return self._handle.raw
+
+    @property
+    def is_postgres(self):
+        return True
+
+    def _prepared(self):
+        return self._handle.state.setdefault('prepared', {})
+
+    def _run(self, cursor, statement, params):
+        state = self._handle.state
+        if not DB_PREPARED_STATEMENTS or state.get('unprepared'):
+            self._execute_text(cursor, statement, params)
+            return
+
+        prepared = self._prepared()
+        status = prepared.get(statement.name)
+        if status is None:
+            if len(prepared) >= MAX_PREPARED_PER_CONNECTION:
+                cursor.execute("DEALLOCATE ALL")
+                prepared.clear()
+            # Point de sauvegarde: un PREPARE refusé n'annule pas la transaction en cours
+            cursor.execute("SAVEPOINT db_query_prepare")
+            try:
+                cursor.execute(f"PREPARE {statement.name} AS {statement.prepared_text}")
+                status = True
+            except psycopg2.Error:
+                # Types de paramètres non déductibles: exécution directe
+                cursor.execute("ROLLBACK TO SAVEPOINT db_query_prepare")
+                status = False
+            cursor.execute("RELEASE SAVEPOINT db_query_prepare")
+            prepared[statement.name] = status
+
+        if not status:
+            self._execute_text(cursor, statement, params)
+            return
+
+        idle = self.raw.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            if statement.param_count:
+                placeholders = ', '.join(['%s'] * statement.param_count)
+                cursor.execute(f"EXECUTE {statement.name} ({placeholders})", params)
+            else:
+                cursor.execute(f"EXECUTE {statement.name}")
+        except psycopg2.Error as e:
+            if e.pgcode != psycopg2.errorcodes.INVALID_SQL_STATEMENT_NAME:
+                raise
+            # Connexion serveur différente de celle du PREPARE (pooler en mode transaction):
+            # plus de requêtes préparées sur cette connexion
+            prepared.clear()
+            state['unprepared'] = True
+            if not idle:
+                # Transaction déjà commencée et maintenant annulée: rien à rejouer ici
+                raise
+            self.raw.rollback()
+            self._execute_text(cursor, statement, params)
+
+    def _execute_text(self, cursor, statement, params):
+        if statement.param_count:
+            cursor.execute(statement.text, params)
+        else:
+            cursor.execute(statement.text)
+
+    def cursor(self):
+        return Cursor(self)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self._handle.commit()
+
+    def rollback(self):
+        self._handle.rollback()
+
+    def close(self):
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def dialect_of(handle):
+    return POSTGRESQL if getattr(handle, 'is_postgres', False) else SQLITE
+
+
+def connect(handle):
+    """Adapter une connexion du pool: SQLite est natif, PostgreSQL est enveloppé"""
+    if dialect_of(handle) == POSTGRESQL:
+        return Connection(handle)
+    return handle
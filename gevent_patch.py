@@ -0,0 +1,55 @@
+"""Mode asynchrone gevent: patch coopératif de la stdlib et du pilote PostgreSQL.
+
+Doit être importé avant Flask, Flask-SocketIO et db_pool (voir wsgi.py),
+sinon les verrous et sockets créés à l'import restent bloquants.
+"""
+import os
+
+# 'gevent' (défaut en production) ou 'threading' pour désactiver le patch
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'gevent')
+
+_patched = False
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """Attente coopérative des E/S psycopg2 (rend la main au hub gevent)"""
+    import psycopg2
+    from psycopg2 import extensions
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Résultat de poll inattendu: {state!r}")
+
+
+def patch():
+    """Activer le mode gevent (idempotent). Retourne True si le patch est actif."""
+    global _patched
+    if _patched:
+        return True
+    if ASYNC_MODE != 'gevent':
+        return False
+
+    try:
+        from gevent import monkey
+    except ImportError:
+        print("⚠️ gevent non installé - serveur en mode threading")
+        return False
+
+    monkey.patch_all()
+
+    try:
+        from psycopg2 import extensions
+        extensions.set_wait_callback(gevent_wait_callback)
+    except ImportError:
+        pass
+
+    _patched = True
+    return True
@@ -1,13 +1,19 @@
-
 import os
 
-# Configuration Gunicorn simplifiée pour Render
+# Configuration Gunicorn pour Render
 bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
-workers = 1
-worker_class = "sync"
+
+# Worker gevent + WebSocket: chaque client Socket.IO est un greenlet, un seul
+# processus sert des milliers de connexions (voir LOAD_PROFILE.md).
+# Plus d'un worker nécessite SOCKETIO_MESSAGE_QUEUE et des sessions collantes.
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker')
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
 timeout = 120
+graceful_timeout = 30
 keepalive = 2
-max_requests = 1000
+# Recycler un worker coupe toutes ses connexions WebSocket: désactivé par défaut
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
 max_requests_jitter = 50
 preload_app = True
 
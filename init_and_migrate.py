@@ -1,30 +1,36 @@
-import sqlite3
 import os
-
-DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
-
-def get_db_connection():
-    if DATABASE_URL.startswith('postgresql://') or DATABASE_URL.startswith('postgres://'):
-        try:
-            import psycopg2
-            import psycopg2.extras
-            conn = psycopg2.connect(DATABASE_URL)
-            conn.autocommit = True
-            return conn
-        except psycopg2.Error as e:
-            print(f"❌ Erreur de connexion PostgreSQL: {e}")
-            print("📝 Vérifiez que DATABASE_URL est correctement configuré")
-            raise
+import sys
+
+import conversation_index
+import db_pool
+import db_query
+import message_search
+import message_stats
+import notification_badges
+import profile_likes
+import reaction_summaries
+import room_activity
+import room_directory
+from db_pool import DATABASE_URL, get_db_connection
+
+
+def existing_tables(cursor, is_postgres):
+    """Tables déjà présentes (avant les CREATE TABLE IF NOT EXISTS)"""
+    if is_postgres:
+        cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()")
     else:
-        print("⚠️ Utilisation de SQLite - données non persistantes en production!")
-        conn = sqlite3.connect(DATABASE_URL.replace('sqlite:///', ''))
-        return conn
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return {row[0] for row in cursor.fetchall()}
+
 
 def init_db_schema():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    is_postgres = DATABASE_URL.startswith('postgresql://') or DATABASE_URL.startswith('postgres://')
+    is_postgres = db_pool.is_postgres()
+    # Les compteurs dénormalisés ne sont remplis depuis l'historique qu'à la création de
+    # leur table: d'autres processus les incrémentent déjà lors des démarrages suivants
+    tables = existing_tables(cursor, is_postgres)
 
     if is_postgres:
         # Schémas PostgreSQL
@@ -41,9 +47,11 @@ def init_db_schema():
                 bio TEXT DEFAULT '',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 theme_preference VARCHAR(10) DEFAULT 'light',
-                notification_sound BOOLEAN DEFAULT TRUE
+                notification_sound BOOLEAN DEFAULT TRUE,
+                likes_count INTEGER NOT NULL DEFAULT 0
             )
         """)
+        cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0")
 
         # Table ROOMS
         cursor.execute("""
@@ -55,9 +63,11 @@ def init_db_schema():
                 creator_id INTEGER REFERENCES users(id),
                 room_code VARCHAR(50) UNIQUE,
                 max_members INTEGER DEFAULT 100,
+                member_count INTEGER NOT NULL DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        cursor.execute("ALTER TABLE rooms ADD COLUMN IF NOT EXISTS member_count INTEGER NOT NULL DEFAULT 0")
 
         # Table ROOM_MEMBERS
         cursor.execute("""
@@ -102,6 +112,13 @@ def init_db_schema():
             )
         """)
 
+        # Recherche plein texte: tsvector généré et maintenu par PostgreSQL
+        for table in ('messages', 'private_messages'):
+            cursor.execute(f"""
+                ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS ({message_search.POSTGRES_SEARCH_VECTOR}) STORED
+            """)
+
         # Table REACTIONS
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS reactions (
@@ -159,6 +176,132 @@ def init_db_schema():
             )
         """)
 
+        # Table PRESENCE_SESSIONS (processus connaissant un socket de l'utilisateur, voir presence.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS presence_sessions (
+                user_id INTEGER NOT NULL,
+                node_id VARCHAR(32) NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, node_id)
+            )
+        """)
+
+        # Table CONVERSATIONS (index de la boîte de réception)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id),
+                other_user_id INTEGER NOT NULL REFERENCES users(id),
+                last_message_id INTEGER NOT NULL,
+                last_sender_id INTEGER,
+                last_preview TEXT,
+                last_timestamp TIMESTAMP,
+                unread_count INTEGER NOT NULL DEFAULT 0,
+                last_read_message_id INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (user_id, other_user_id)
+            )
+        """)
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'conversations' AND column_name = 'last_read_message_id'
+        """)
+        if not cursor.fetchone():
+            cursor.execute("ALTER TABLE conversations ADD COLUMN last_read_message_id INTEGER NOT NULL DEFAULT 0")
+            for statement in conversation_index.WATERMARK_MIGRATION_SQL:
+                cursor.execute(statement)
+
+        # Table ROOM_ACTIVITY (messages par salon et par heure)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS room_activity (
+                room_id INTEGER NOT NULL REFERENCES rooms(id),
+                bucket INTEGER NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (room_id, bucket)
+            )
+        """)
+
+        # Table USER_BADGES (pastilles de notification, voir notification_badges.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_badges (
+                user_id INTEGER PRIMARY KEY,
+                friend_requests INTEGER NOT NULL DEFAULT 0,
+                unread_messages INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+        # Table REACTION_SUMMARIES (réactions regroupées par message, voir reaction_summaries.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reaction_summaries (
+                is_private BOOLEAN NOT NULL,
+                message_id INTEGER NOT NULL,
+                summary TEXT NOT NULL DEFAULT '{}',
+                PRIMARY KEY (is_private, message_id)
+            )
+        """)
+
+        # Tables des compteurs journaliers de messages (voir message_stats.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS room_daily_stats (
+                room_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (room_id, day)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sender_daily_stats (
+                room_id INTEGER NOT NULL,
+                sender_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (room_id, sender_id, day)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_daily_stats (
+                user_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                room_messages INTEGER NOT NULL DEFAULT 0,
+                private_messages INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            )
+        """)
+
+        # Table MEDIA_OBJECTS (fichiers de chat adressés par contenu, voir media_store.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_objects (
+                hash CHAR(64) PRIMARY KEY,
+                name VARCHAR(80) NOT NULL,
+                size BIGINT NOT NULL,
+                mimetype VARCHAR(255),
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                updated_at BIGINT NOT NULL
+            )
+        """)
+
+        # Table MEDIA_VARIANTS (miniatures et aperçus des images, voir media_variants.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_variants (
+                source VARCHAR(255) PRIMARY KEY,
+                thumbnail_url VARCHAR(255) NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                placeholder TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Table VOICE_NOTES (messages vocaux convertis en Ogg/Opus, voir voice_transcoder.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS voice_notes (
+                source VARCHAR(255) PRIMARY KEY,
+                url VARCHAR(255) NOT NULL,
+                duration_ms INTEGER NOT NULL,
+                waveform TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
         # Index PostgreSQL
         indexes_postgres = [
             "CREATE INDEX IF NOT EXISTS idx_messages_room_timestamp ON messages(room_id, timestamp DESC)",
@@ -166,15 +309,31 @@ def init_db_schema():
             "CREATE INDEX IF NOT EXISTS idx_reactions_message ON reactions(message_id)",
             "CREATE INDEX IF NOT EXISTS idx_reactions_private ON reactions(private_message_id)",
             "CREATE INDEX IF NOT EXISTS idx_room_members ON room_members(room_id, user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_user_activity ON user_activity(user_id, is_online)"
+            "CREATE INDEX IF NOT EXISTS idx_room_members_user ON room_members(user_id, room_id)",
+            "CREATE INDEX IF NOT EXISTS idx_rooms_public ON rooms(is_private, created_at DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_user_activity ON user_activity(user_id, is_online)",
+            "CREATE INDEX IF NOT EXISTS idx_presence_sessions_node ON presence_sessions(node_id)",
+            "CREATE INDEX IF NOT EXISTS idx_presence_sessions_updated ON presence_sessions(updated_at)",
+            "CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user_id, last_timestamp DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_user_profile_likes_liked ON user_profile_likes(liked_user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_media_objects_unreferenced ON media_objects(updated_at) WHERE ref_count <= 0",
+            "CREATE INDEX IF NOT EXISTS idx_messages_voice ON messages(voice_message_url) WHERE voice_message_url IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS idx_room_daily_stats_day ON room_daily_stats(day)",
+            "CREATE INDEX IF NOT EXISTS idx_private_messages_voice ON private_messages(voice_message_url) WHERE voice_message_url IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search_vector)",
+            "CREATE INDEX IF NOT EXISTS idx_private_messages_search ON private_messages USING GIN (search_vector)"
         ]
 
         for index_sql in indexes_postgres:
+            # Point de sauvegarde: un échec n'annule pas le reste de la migration
+            cursor.execute("SAVEPOINT create_index")
             try:
                 cursor.execute(index_sql)
                 print(f"  ✅ Index PostgreSQL créé")
             except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT create_index")
                 print(f"  ⚠️ Index déjà existant: {e}")
+            cursor.execute("RELEASE SAVEPOINT create_index")
 
     else:
         # Schémas SQLite (code existant)
@@ -191,7 +350,8 @@ def init_db_schema():
                 bio TEXT DEFAULT '',
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 theme_preference TEXT DEFAULT 'light',
-                notification_sound BOOLEAN DEFAULT 1
+                notification_sound BOOLEAN DEFAULT 1,
+                likes_count INTEGER NOT NULL DEFAULT 0
             )
         """)
 
@@ -205,6 +365,7 @@ def init_db_schema():
                 creator_id INTEGER,
                 room_code TEXT UNIQUE,
                 max_members INTEGER DEFAULT 100,
+                member_count INTEGER NOT NULL DEFAULT 0,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (creator_id) REFERENCES users (id)
             )
@@ -326,6 +487,127 @@ def init_db_schema():
             )
         """)
 
+        # Créer/Mettre à jour la table PRESENCE_SESSIONS
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS presence_sessions (
+                user_id INTEGER NOT NULL,
+                node_id TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, node_id)
+            )
+        """)
+
+        # Créer/Mettre à jour la table CONVERSATIONS (index de la boîte de réception)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                other_user_id INTEGER NOT NULL,
+                last_message_id INTEGER NOT NULL,
+                last_sender_id INTEGER,
+                last_preview TEXT,
+                last_timestamp DATETIME,
+                unread_count INTEGER NOT NULL DEFAULT 0,
+                last_read_message_id INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (other_user_id) REFERENCES users (id),
+                UNIQUE (user_id, other_user_id)
+            )
+        """)
+
+        # Table ROOM_ACTIVITY (messages par salon et par heure)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS room_activity (
+                room_id INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (room_id, bucket),
+                FOREIGN KEY (room_id) REFERENCES rooms (id)
+            )
+        """)
+
+        # Créer/Mettre à jour la table USER_BADGES
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_badges (
+                user_id INTEGER PRIMARY KEY,
+                friend_requests INTEGER NOT NULL DEFAULT 0,
+                unread_messages INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+        # Créer/Mettre à jour la table REACTION_SUMMARIES
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reaction_summaries (
+                is_private BOOLEAN NOT NULL,
+                message_id INTEGER NOT NULL,
+                summary TEXT NOT NULL DEFAULT '{}',
+                PRIMARY KEY (is_private, message_id)
+            )
+        """)
+
+        # Créer/Mettre à jour les tables des compteurs journaliers de messages
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS room_daily_stats (
+                room_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (room_id, day)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sender_daily_stats (
+                room_id INTEGER NOT NULL,
+                sender_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (room_id, sender_id, day)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_daily_stats (
+                user_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                room_messages INTEGER NOT NULL DEFAULT 0,
+                private_messages INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            )
+        """)
+
+        # Créer/Mettre à jour la table MEDIA_OBJECTS
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_objects (
+                hash TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mimetype TEXT,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                updated_at INTEGER NOT NULL
+            )
+        """)
+
+        # Créer/Mettre à jour la table MEDIA_VARIANTS
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_variants (
+                source TEXT PRIMARY KEY,
+                thumbnail_url TEXT NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                placeholder TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Créer/Mettre à jour la table VOICE_NOTES
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS voice_notes (
+                source TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                duration_ms INTEGER NOT NULL,
+                waveform TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
         # Migration des colonnes SQLite
         print("🔧 Vérification et migration des colonnes existantes...")
 
@@ -345,6 +627,27 @@ def init_db_schema():
         if 'notification_sound' not in user_columns:
             print("  ➕ Ajout de 'notification_sound' à la table users")
             cursor.execute("ALTER TABLE users ADD COLUMN notification_sound BOOLEAN DEFAULT 1;")
+        if 'likes_count' not in user_columns:
+            print("  ➕ Ajout de 'likes_count' à la table users")
+            cursor.execute("ALTER TABLE users ADD COLUMN likes_count INTEGER NOT NULL DEFAULT 0;")
+
+        # Migration pour la table ROOMS
+        cursor.execute("PRAGMA table_info(rooms);")
+        room_columns = [col[1] for col in cursor.fetchall()]
+
+        if 'member_count' not in room_columns:
+            print("  ➕ Ajout de 'member_count' à la table rooms")
+            cursor.execute("ALTER TABLE rooms ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0;")
+
+        # Migration pour la table CONVERSATIONS (repère de lecture)
+        cursor.execute("PRAGMA table_info(conversations);")
+        conversation_columns = [col[1] for col in cursor.fetchall()]
+
+        if 'last_read_message_id' not in conversation_columns:
+            print("  ➕ Ajout de 'last_read_message_id' à la table conversations")
+            cursor.execute("ALTER TABLE conversations ADD COLUMN last_read_message_id INTEGER NOT NULL DEFAULT 0;")
+            for statement in conversation_index.WATERMARK_MIGRATION_SQL:
+                cursor.execute(statement)
 
         # Migration pour les autres tables...
         # (Code de migration existant...)
@@ -356,7 +659,17 @@ def init_db_schema():
             "CREATE INDEX IF NOT EXISTS idx_reactions_message ON reactions(message_id)",
             "CREATE INDEX IF NOT EXISTS idx_reactions_private ON reactions(private_message_id)",
             "CREATE INDEX IF NOT EXISTS idx_room_members ON room_members(room_id, user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_user_activity ON user_activity(user_id, is_online)"
+            "CREATE INDEX IF NOT EXISTS idx_room_members_user ON room_members(user_id, room_id)",
+            "CREATE INDEX IF NOT EXISTS idx_rooms_public ON rooms(is_private, created_at DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_user_activity ON user_activity(user_id, is_online)",
+            "CREATE INDEX IF NOT EXISTS idx_presence_sessions_node ON presence_sessions(node_id)",
+            "CREATE INDEX IF NOT EXISTS idx_presence_sessions_updated ON presence_sessions(updated_at)",
+            "CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user_id, last_timestamp DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_user_profile_likes_liked ON user_profile_likes(liked_user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_media_objects_unreferenced ON media_objects(updated_at) WHERE ref_count <= 0",
+            "CREATE INDEX IF NOT EXISTS idx_messages_voice ON messages(voice_message_url) WHERE voice_message_url IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS idx_room_daily_stats_day ON room_daily_stats(day)",
+            "CREATE INDEX IF NOT EXISTS idx_private_messages_voice ON private_messages(voice_message_url) WHERE voice_message_url IS NOT NULL"
         ]
 
         for index_sql in indexes_sqlite:
@@ -366,10 +679,74 @@ def init_db_schema():
             except Exception as e:
                 print(f"  ⚠️ Index déjà existant: {e}")
 
+        # Recherche plein texte FTS5 (sans contenu: le texte reste dans la table source)
+        for table in ('messages', 'private_messages'):
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f'{table}_fts',))
+            exists = cursor.fetchone()
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+                    content, scope, content='',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+                )
+            """)
+            if not exists:
+                cursor.execute(message_search.rebuild_sql(table))
+                print(f"  ✅ Index plein texte {table}_fts construit")
+
+    # Compteurs de membres des salons (dénormalisés)
+    cursor.execute(room_directory.RECOUNT_SQL)
+
+    # Compteurs de j'aime des profils (dénormalisés)
+    cursor.execute(profile_likes.RECOUNT_SQL)
+
+    # Compteurs d'activité des salons
+    cursor.execute("SELECT COUNT(*) FROM room_activity")
+    if cursor.fetchone()[0] == 0:
+        room_activity.backfill(db_query.connect(conn))
+        print("  ✅ Compteurs d'activité des salons reconstruits")
+
+    # Compteurs journaliers des tableaux de bord
+    if 'room_daily_stats' not in tables:
+        message_stats.backfill(db_query.connect(conn))
+        print("  ✅ Compteurs journaliers des messages reconstruits")
+
+    # Résumés des réactions par message
+    if 'reaction_summaries' not in tables:
+        reaction_summaries.backfill(db_query.connect(conn))
+        print("  ✅ Résumés des réactions reconstruits")
+
+    # Remplir l'index des conversations à partir de l'historique existant
+    cursor.execute("SELECT COUNT(*) FROM conversations")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(conversation_index.BACKFILL_SQL)
+        print("  ✅ Index des conversations reconstruit")
+
+    # Pastilles de notification (depuis les demandes et l'index des conversations)
+    if 'user_badges' not in tables:
+        cursor.execute(notification_badges.BACKFILL_SQL)
+        print("  ✅ Pastilles de notification reconstruites")
+
     conn.commit()
     conn.close()
     print("✅ Schéma de la base de données vérifié/créé avec succès.")
 
+def recount_counters():
+    """Recalcul complet des compteurs dénormalisés depuis l'historique (réparation d'une dérive).
+
+    Parcourt tout l'historique et efface les compteurs avant de les reconstruire:
+    à lancer application arrêtée (python init_and_migrate.py --recount).
+    """
+    conn = db_query.connect(get_db_connection())
+    message_stats.recount(conn)
+    print("  ✅ Compteurs journaliers des messages recalculés")
+    reaction_summaries.recount(conn)
+    print("  ✅ Résumés des réactions recalculés")
+    for statement in notification_badges.RECOUNT_SQL:
+        conn.execute(statement)
+    print("  ✅ Pastilles de notification recalculées")
+    conn.commit()
+    conn.close()
+
 if __name__ == "__main__":
     # Assurez-vous que les dossiers d'uploads existent également
     UPLOAD_FOLDER = 'static/uploads'
@@ -383,3 +760,7 @@ if __name__ == "__main__":
 
     init_db_schema()
     print("🚀 Initialisation et migration de la base de données terminées.")
+
+    if '--recount' in sys.argv[1:]:
+        recount_counters()
+        print("🔁 Compteurs recalculés.")
@@ -1,19 +1,53 @@
-import sqlite3
 import os
 import uuid
 import json
+import base64
+import mimetypes
+import shutil
 from datetime import datetime, timedelta
 from functools import wraps
 import time
 
-from flask import Flask, render_template, request, redirect, session, url_for, flash, jsonify
+from flask import (Flask, render_template, request, redirect, session, url_for, flash, jsonify,
+                   abort)
 from flask_socketio import SocketIO, join_room, leave_room, emit
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
+import chunked_upload
+import conversation_index
+import db_pool
+import db_query
+import media_server
+import media_store
+import media_variants
+import message_hydrator
+import message_ingest
+import message_search
+import message_stats
+import notification_badges
+import presence
+import profile_likes
+import reaction_summaries
+import room_activity
+import room_directory
+import socket_backplane
+import typing_aggregator
+import user_cache
+import user_index
+import voice_transcoder
+from db_pool import DATABASE_URL
+from db_query import IntegrityError
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "vraiment-secret-pour-dev")
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Bus partagé entre workers/machines si SOCKETIO_MESSAGE_QUEUE est défini
+socketio = SocketIO(app, cors_allowed_origins="*",
+                    client_manager=socket_backplane.create_client_manager())
+presence_service = presence.PresenceService(socketio)
+typing_status = typing_aggregator.TypingAggregator(socketio)
+media_processor = media_variants.MediaProcessor(socketio.start_background_task)
+voice_processor = voice_transcoder.VoiceTranscoder(socketio)
 
 # Configuration
 UPLOAD_FOLDER = 'static/uploads'
@@ -28,26 +62,27 @@ app.config['PROFILE_PICS_FOLDER'] = PROFILE_PICS_FOLDER
 app.config['VOICE_FOLDER'] = VOICE_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
-DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
+db_pool.init_app(app)
 
 def get_db_connection():
-    if DATABASE_URL.startswith('postgresql://') or DATABASE_URL.startswith('postgres://'):
-        # PostgreSQL pour la production (Supabase)
-        try:
-            import psycopg2
-            import psycopg2.extras
-            conn = psycopg2.connect(DATABASE_URL)
-            conn.autocommit = True
-            return conn
-        except psycopg2.Error as e:
-            print(f"❌ Erreur de connexion PostgreSQL: {e}")
-            raise
-    else:
-        # SQLite pour le développement local uniquement
-        print("⚠️ Utilisation de SQLite - données non persistantes en production!")
-        conn = sqlite3.connect(DATABASE_URL.replace('sqlite:///', ''))
-        conn.row_factory = sqlite3.Row
-        return conn
+    # Connexion empruntée au pool partagé, rendue en fin de requête.
+    # Le SQL reste écrit en dialecte SQLite, traduit pour PostgreSQL par db_query.
+    return db_query.connect(db_pool.get_db_connection())
+
+def get_message_ingest(conn):
+    # Écriture différée des messages (MESSAGE_WRITE_BEHIND=1), démarrée dans
+    # le worker au premier usage: jamais dans le maître gunicorn (preload_app).
+    # La connexion de la requête sert au rejeu et aux ids: pas de second emprunt au pool.
+    ingest = message_ingest.get_ingest()
+    if ingest:
+        ingest.start(socketio.start_background_task, socketio.sleep, conn)
+    return ingest
+
+def flush_pending_messages(conn, message_id=None):
+    """Rendre visibles en base les messages encore en file d'écriture"""
+    ingest = get_message_ingest(conn)
+    if ingest and (message_id is None or ingest.is_pending(message_id)):
+        ingest.flush(conn)
 
 def login_required(f):
     @wraps(f)
@@ -73,6 +108,77 @@ def allowed_chat_file(filename):
 def allowed_profile_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_PROFILE_EXTENSIONS
 
+def encode_message_cursor(message_id, timestamp):
+    raw = f"{message_id}|{timestamp or ''}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def parse_message_cursor():
+    """Curseur de pagination: (before_id, before_ts) depuis ?cursor= ou ?before_id=/?before_ts="""
+    before_id = request.args.get('before_id', type=int)
+    before_ts = request.args.get('before_ts') or None
+    token = request.args.get('cursor')
+    if token:
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+            cursor_id, cursor_ts = raw.split('|', 1)
+            before_id = int(cursor_id)
+            before_ts = cursor_ts or before_ts
+        except (ValueError, UnicodeDecodeError):
+            pass
+    return before_id, before_ts
+
+def message_cursor_clause(alias, table, before_id, before_ts):
+    """Condition keyset (timestamp, id) < curseur, servie par les index sur timestamp.
+
+    L'horodatage du curseur est relu en base (clé primaire) pour garder la
+    précision exacte; before_ts ne sert que si le message a été supprimé.
+    """
+    if before_id:
+        cursor_ts = f"COALESCE((SELECT timestamp FROM {table} WHERE id = ?), ?)"
+        return (f" AND {alias}.timestamp <= {cursor_ts}"
+                f" AND ({alias}.timestamp < {cursor_ts} OR {alias}.id < ?)",
+                (before_id, before_ts, before_id, before_ts, before_id))
+    if before_ts:
+        return f" AND {alias}.timestamp < ?", (before_ts,)
+    return "", ()
+
+def next_cursor_header(response, rows, limit):
+    # Page incomplète: plus rien à charger
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers['X-Next-Cursor'] = encode_message_cursor(last['id'], last['cursor_ts'])
+    return response
+
+def parse_search_cursor():
+    """Curseur de recherche: (score, id) du dernier résultat de la page précédente"""
+    before_id, score = parse_message_cursor()
+    if not (before_id and score):
+        return None
+    try:
+        return float(score), before_id
+    except ValueError:
+        return None
+
+def search_response(conn, results, limit):
+    """Résultats de recherche avec expéditeurs (cache) et curseur de la page suivante"""
+    users = user_cache.get_user_summaries(conn, [result['sender_id'] for result in results])
+    results_list = []
+    for result in results:
+        sender = users.get(result['sender_id'])
+        if not sender:
+            continue
+        item = {key: value for key, value in result.items() if key != 'score'}
+        item['content'] = item['content'] or ''
+        item['sender_username'] = sender['username']
+        item['sender_profile_pic'] = sender['profile_picture_url'] or 'default_profile.png'
+        results_list.append(item)
+
+    response = jsonify(results_list)
+    if len(results) == limit:
+        last = results[-1]
+        response.headers['X-Next-Cursor'] = encode_message_cursor(last['id'], repr(last['score']))
+    return response
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -96,12 +202,13 @@ def register():
         hashed_password = generate_password_hash(password)
         conn = get_db_connection()
         try:
-            conn.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
-                         (username, email, hashed_password))
+            cursor = conn.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+                                  (username, email, hashed_password))
             conn.commit()
+            user_index.directory.upsert(cursor.lastrowid, username)
             flash('Inscription réussie ! Vous pouvez maintenant vous connecter.', 'success')
             return redirect(url_for('login'))
-        except sqlite3.IntegrityError:
+        except IntegrityError:
             flash('Cet email est déjà utilisé.', 'error')
         finally:
             conn.close()
@@ -124,7 +231,7 @@ def login():
             session['user_id'] = user['id']
             # Mettre à jour le statut en ligne
             conn = get_db_connection()
-            conn.execute("INSERT OR REPLACE INTO user_activity (user_id, last_active, is_online) VALUES (?, CURRENT_TIMESTAMP, 1)", (user['id'],))
+            conn.execute("INSERT OR REPLACE INTO user_activity (user_id, last_active, is_online) VALUES (?, CURRENT_TIMESTAMP, TRUE)", (user['id'],))
             conn.commit()
             conn.close()
             flash(f'Bienvenue, {user["username"]} !', 'success')
@@ -138,11 +245,8 @@ def login():
 def logout():
     user_id = session.pop('user_id', None)
     if user_id:
-        conn = get_db_connection()
-        conn.execute("UPDATE user_activity SET is_online = 0, last_active = CURRENT_TIMESTAMP WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
-        socketio.emit('user_status_changed', {'user_id': user_id, 'is_online': False})
+        presence_service.start()
+        presence_service.logout(user_id)
     flash('Vous avez été déconnecté.', 'info')
     return redirect(url_for('login'))
 
@@ -150,22 +254,15 @@ def logout():
 @login_required
 def rooms_dashboard():
     user_id = session['user_id']
+    page = max(request.args.get('page', 1, type=int), 1)
     conn = get_db_connection()
 
-    # Salons publics
-    public_rooms = conn.execute("""
-        SELECT r.id, r.name, r.description, u.username AS creator_username,
-               (SELECT COUNT(*) FROM room_members rm WHERE rm.room_id = r.id) AS member_count
-        FROM rooms r
-        JOIN users u ON r.creator_id = u.id
-        WHERE r.is_private = 0
-        ORDER BY r.created_at DESC
-    """).fetchall()
+    # Salons publics: page en cache, compteur de membres dénormalisé
+    public_rooms, has_next_page = room_directory.public_rooms.get(conn, page)
 
     # Salons privés créés par l'utilisateur
     private_rooms_created = conn.execute("""
-        SELECT r.id, r.name, r.description, r.room_code, u.username AS creator_username,
-               (SELECT COUNT(*) FROM room_members rm WHERE rm.room_id = r.id) AS member_count
+        SELECT r.id, r.name, r.description, r.room_code, u.username AS creator_username, r.member_count
         FROM rooms r
         JOIN users u ON r.creator_id = u.id
         WHERE r.creator_id = ? AND r.is_private = 1
@@ -174,8 +271,7 @@ def rooms_dashboard():
 
     # Salons privés rejoints
     private_rooms_joined = conn.execute("""
-        SELECT r.id, r.name, r.description, u.username AS creator_username,
-               (SELECT COUNT(*) FROM room_members rm WHERE rm.room_id = r.id) AS member_count
+        SELECT r.id, r.name, r.description, u.username AS creator_username, r.member_count
         FROM rooms r
         JOIN users u ON r.creator_id = u.id
         JOIN room_members rm ON r.id = rm.room_id
@@ -187,7 +283,9 @@ def rooms_dashboard():
     return render_template('rooms_dashboard.html', 
                          public_rooms=public_rooms, 
                          private_rooms_created=private_rooms_created,
-                         private_rooms_joined=private_rooms_joined)
+                         private_rooms_joined=private_rooms_joined,
+                         page=page,
+                         has_next_page=has_next_page)
 
 @app.route('/create_room', methods=['POST'])
 @login_required
@@ -211,11 +309,13 @@ def create_room():
                              (room_name, room_description, is_private, user_id, room_code))
         room_id = cursor.lastrowid
 
-        conn.execute("INSERT INTO room_members (room_id, user_id) VALUES (?, ?)", (room_id, user_id))
+        room_directory.add_member(conn, room_id, user_id)
         conn.commit()
+        if not is_private:
+            room_directory.public_rooms.invalidate()
         flash(f'Salon "{room_name}" créé avec succès !', 'success')
         return redirect(url_for('chat', room_id=room_id))
-    except sqlite3.IntegrityError:
+    except IntegrityError:
         flash('Un salon avec ce nom existe déjà.', 'error')
     finally:
         conn.close()
@@ -228,7 +328,7 @@ def join_room_direct(room_id):
     conn = get_db_connection()
 
     try:
-        conn.execute("INSERT OR IGNORE INTO room_members (room_id, user_id) VALUES (?, ?)", (room_id, user_id))
+        room_directory.add_member(conn, room_id, user_id)
         conn.commit()
         return redirect(url_for('chat', room_id=room_id))
     except Exception as e:
@@ -252,7 +352,7 @@ def join_private_room():
         return redirect(url_for('rooms_dashboard'))
 
     try:
-        conn.execute("INSERT OR IGNORE INTO room_members (room_id, user_id) VALUES (?, ?)", (room['id'], user_id))
+        room_directory.add_member(conn, room['id'], user_id)
         conn.commit()
         flash(f'Vous avez rejoint le salon "{room["name"]}" !', 'success')
         return redirect(url_for('chat', room_id=room['id']))
@@ -295,47 +395,43 @@ def inbox():
     user_id = session['user_id']
     conn = get_db_connection()
 
-    conversations = conn.execute("""
-        SELECT 
-            CASE
-                WHEN pm.sender_id = ? THEN pm.receiver_id
-                ELSE pm.sender_id
-            END AS other_user_id,
-            u.username AS other_username,
-            u.profile_picture_url AS other_profile_pic,
-            pm.content AS last_message,
-            pm.timestamp AS last_timestamp,
-            (SELECT COUNT(*) FROM private_messages 
-             WHERE receiver_id = ? AND sender_id = (CASE WHEN pm.sender_id = ? THEN pm.receiver_id ELSE pm.sender_id END) 
-             AND is_read = 0) AS unread_count
-        FROM private_messages pm
-        JOIN users u ON u.id = CASE
-                                    WHEN pm.sender_id = ? THEN pm.receiver_id
-                                    ELSE pm.sender_id
-                                END
-        WHERE pm.sender_id = ? OR pm.receiver_id = ?
-        GROUP BY other_user_id
-        ORDER BY pm.timestamp DESC
-    """, (user_id, user_id, user_id, user_id, user_id, user_id)).fetchall()
+    # Lecture de l'index des conversations (une ligne par interlocuteur)
+    conversations = conversation_index.list_conversations(conn, user_id)
 
     conn.close()
     return render_template('inbox.html', conversations=conversations)
 
+def mark_conversation_read(conn, user_id, other_user_id, up_to=None):
+    """Avancer le repère de lecture, ajuster la pastille et prévenir l'expéditeur (accusé de lecture)"""
+    cleared, watermark = conversation_index.mark_read(conn, user_id, other_user_id, up_to)
+    if watermark is None:
+        # Rendre tout de suite le verrou de la ligne pris par mark_read
+        conn.rollback()
+        return
+    badges = notification_badges.BadgeChanges()
+    badges.add(user_id, 'unread_messages', -cleared)
+    badges.apply(conn)
+    conn.commit()
+    badges.publish(conn, socketio)
+    if cleared:
+        receipt = {'reader_id': user_id, 'other_user_id': other_user_id, 'last_read_message_id': watermark}
+        socketio.emit('messages_read', receipt, to=f'user_{other_user_id}')
+        socketio.emit('messages_read', receipt, to=f'user_{user_id}')
+
 @app.route('/conversation/<int:other_user_id>')
 @login_required
 def conversation(other_user_id):
     user_id = session['user_id']
     conn = get_db_connection()
 
-    other_user = conn.execute("SELECT username, profile_picture_url FROM users WHERE id = ?", (other_user_id,)).fetchone()
+    other_user = user_cache.get_user_summary(conn, other_user_id)
     if not other_user:
         flash('Utilisateur introuvable.', 'error')
         conn.close()
         return redirect(url_for('inbox'))
 
-    # Marquer les messages comme lus
-    conn.execute("UPDATE private_messages SET is_read = 1 WHERE sender_id = ? AND receiver_id = ?", (other_user_id, user_id))
-    conn.commit()
+    # Marquer les messages comme lus (repère de la conversation)
+    mark_conversation_read(conn, user_id, other_user_id)
     conn.close()
 
     return render_template('conversation.html', 
@@ -366,14 +462,21 @@ def profile():
                 file_path = os.path.join(app.config['PROFILE_PICS_FOLDER'], filename)
                 file.save(file_path)
                 profile_picture_url = filename
+                # Avatar carré réduit, calculé en arrière-plan
+                avatar_name = f"{os.path.splitext(filename)[0]}-w{media_variants.AVATAR_SIZE}.webp"
+                media_processor.submit(filename, file_path,
+                                       os.path.join(app.config['PROFILE_PICS_FOLDER'], avatar_name),
+                                       avatar_name, media_variants.AVATAR_SIZE, square=True)
 
         try:
             conn.execute("""UPDATE users SET username = ?, bio = ?, profile_picture_url = ?, 
                            theme_preference = ?, notification_sound = ? WHERE id = ?""",
                          (username, bio, profile_picture_url, theme_preference, notification_sound, user_id))
             conn.commit()
+            user_cache.invalidate(user_id)
+            user_index.directory.upsert(user_id, username)
             flash('Profil mis à jour avec succès !', 'success')
-        except sqlite3.IntegrityError:
+        except IntegrityError:
             flash('Ce nom d\'utilisateur est déjà pris.', 'error')
         finally:
             conn.close()
@@ -394,13 +497,12 @@ def user_profile(user_id_param):
         conn.close()
         return redirect(url_for('rooms_dashboard'))
 
-    likes_count = conn.execute("SELECT COUNT(*) FROM user_profile_likes WHERE liked_user_id = ?", (user_id_param,)).fetchone()[0]
-    is_liked = conn.execute("SELECT 1 FROM user_profile_likes WHERE liker_user_id = ? AND liked_user_id = ?", (current_user_id, user_id_param)).fetchone() is not None
+    is_liked = profile_likes.is_liked(conn, current_user_id, user_id_param)
 
     conn.close()
     return render_template('user_profile.html', 
                          user=user, 
-                         likes_count=likes_count,
+                         likes_count=user['likes_count'],
                          is_liked=is_liked,
                          is_own_profile=(current_user_id == user_id_param))
 
@@ -413,17 +515,8 @@ def like_profile(user_id_to_like):
         return jsonify({'success': False, 'error': 'Vous ne pouvez pas liker votre propre profil.'})
 
     conn = get_db_connection()
-    existing_like = conn.execute("SELECT 1 FROM user_profile_likes WHERE liker_user_id = ? AND liked_user_id = ?", (current_user_id, user_id_to_like)).fetchone()
-
-    if existing_like:
-        conn.execute("DELETE FROM user_profile_likes WHERE liker_user_id = ? AND liked_user_id = ?", (current_user_id, user_id_to_like))
-        action = 'unliked'
-    else:
-        conn.execute("INSERT INTO user_profile_likes (liker_user_id, liked_user_id) VALUES (?, ?)", (current_user_id, user_id_to_like))
-        action = 'liked'
-
+    action, likes_count = profile_likes.toggle_like(conn, current_user_id, user_id_to_like)
     conn.commit()
-    likes_count = conn.execute("SELECT COUNT(*) FROM user_profile_likes WHERE liked_user_id = ?", (user_id_to_like,)).fetchone()[0]
     conn.close()
 
     return jsonify({'success': True, 'action': action, 'likes_count': likes_count})
@@ -485,30 +578,48 @@ def ai_chat():
 @app.route('/api/user_search', methods=['GET'])
 @login_required
 def user_search():
-    """Recherche d'utilisateurs"""
+    """Recherche d'utilisateurs à la frappe (index en mémoire, voir user_index.py)"""
     query = request.args.get('q', '').strip()
     if len(query) < 2:
         return jsonify([])
 
+    user_id = session['user_id']
+    directory = user_index.directory
+    number, burst = directory.begin(user_id)
+    if burst:
+        # Rafale de frappes: attendre la suivante avant de chercher
+        socketio.sleep(user_index.USER_SEARCH_DEBOUNCE)
+        if directory.superseded(user_id, number):
+            return '', 204
+
     conn = get_db_connection()
-    users = conn.execute("""
-        SELECT id, username, profile_picture_url, bio
-        FROM users 
-        WHERE username LIKE ? AND id != ?
-        LIMIT 10
-    """, (f'%{query}%', session['user_id'])).fetchall()
+    ranked = directory.search(conn, user_id, query)
+    users = {}
+    if ranked:
+        ids = [found_id for found_id, _ in ranked]
+        users = {user['id']: user for user in conn.execute(f"""
+            SELECT id, username, profile_picture_url, bio
+            FROM users
+            WHERE id IN ({','.join(['?'] * len(ids))})
+        """, ids).fetchall()}
+    conn.close()
 
     users_list = []
-    for user in users:
+    for found_id, mutual in ranked:
+        user = users.get(found_id)
+        if user is None:
+            continue
         users_list.append({
             'id': user['id'],
             'username': user['username'],
             'profile_picture_url': user['profile_picture_url'] or 'default_profile.png',
-            'bio': user['bio'] or ''
+            'bio': user['bio'] or '',
+            'mutual_friends': mutual
         })
 
-    conn.close()
-    return jsonify(users_list)
+    response = jsonify(users_list)
+    response.headers['Cache-Control'] = f'private, max-age={int(user_index.USER_SEARCH_CACHE_TTL)}'
+    return response
 
 @app.route('/api/send_friend_request/<int:user_id>', methods=['POST'])
 @login_required
@@ -533,12 +644,25 @@ def send_friend_request(user_id):
         elif existing['status'] == 'accepted':
             return jsonify({'success': False, 'error': 'Vous êtes déjà amis'})
 
-    # Créer nouvelle demande
-    conn.execute("""
-        INSERT OR REPLACE INTO friend_requests (sender_id, receiver_id, status)
+    # Créer nouvelle demande (ou relancer une demande refusée); la pastille ne
+    # compte que la ligne réellement passée en attente (envois concurrents)
+    created = conn.execute("""
+        INSERT OR IGNORE INTO friend_requests (sender_id, receiver_id, status)
         VALUES (?, ?, 'pending')
-    """, (current_user_id, user_id))
+    """, (current_user_id, user_id)).rowcount
+    if not created:
+        created = conn.execute("""
+            UPDATE friend_requests SET status = 'pending', created_at = CURRENT_TIMESTAMP
+            WHERE sender_id = ? AND receiver_id = ? AND status != 'pending'
+        """, (current_user_id, user_id)).rowcount
+    if not created:
+        conn.rollback()
+        return jsonify({'success': False, 'error': 'Demande déjà envoyée'})
+    badges = notification_badges.BadgeChanges()
+    badges.add(user_id, 'friend_requests', 1)
+    badges.apply(conn)
     conn.commit()
+    badges.publish(conn, socketio)
     conn.close()
 
     return jsonify({'success': True, 'message': 'Demande d\'ami envoyée'})
@@ -593,10 +717,14 @@ def respond_friend_request(request_id):
     if not friend_request:
         return jsonify({'success': False, 'error': 'Demande introuvable'})
 
-    if action == 'accept':
-        # Mettre à jour le statut
-        conn.execute("UPDATE friend_requests SET status = 'accepted' WHERE id = ?", (request_id,))
+    # Statut changé une seule fois (réponses concurrentes): la pastille n'est décrémentée qu'une fois
+    status = 'accepted' if action == 'accept' else 'declined'
+    if not conn.execute("UPDATE friend_requests SET status = ? WHERE id = ? AND status = 'pending'",
+                        (status, request_id)).rowcount:
+        conn.rollback()
+        return jsonify({'success': False, 'error': 'Demande introuvable'})
 
+    if action == 'accept':
         # Ajouter dans la table friends (relation bidirectionnelle)
         conn.execute("""
             INSERT OR IGNORE INTO friends (user_id, friend_id) VALUES (?, ?)
@@ -608,10 +736,13 @@ def respond_friend_request(request_id):
 
         message = 'Demande acceptée'
     else:
-        conn.execute("UPDATE friend_requests SET status = 'declined' WHERE id = ?", (request_id,))
         message = 'Demande refusée'
 
+    badges = notification_badges.BadgeChanges()
+    badges.add(friend_request['receiver_id'], 'friend_requests', -1)
+    badges.apply(conn)
     conn.commit()
+    badges.publish(conn, socketio)
     conn.close()
 
     return jsonify({'success': True, 'message': message})
@@ -644,6 +775,44 @@ def get_friends():
     conn.close()
     return jsonify(friends_list)
 
+def store_upload(kind, source_path, filename, mimetype):
+    """Ranger un fichier reçu. Retourne son URL: stockage par contenu pour les fichiers de chat."""
+    if kind == 'voice':
+        name = secure_filename(f"{uuid.uuid4()}.wav")
+        shutil.move(source_path, os.path.join(app.config['VOICE_FOLDER'], name))
+        return store_voice(name)
+    conn = get_db_connection()
+    try:
+        url = media_store.put(conn, source_path, filename, mimetype)
+        conn.commit()
+        media_store.collect(conn)
+    finally:
+        conn.close()
+
+    if media_variants.is_image(filename):
+        # Miniature calculée en arrière-plan (une seule fois par contenu)
+        name = url[len(media_store.MEDIA_URL_PREFIX):]
+        thumbnail_name = media_store.variant_name(name, media_variants.MEDIA_THUMBNAIL_WIDTH)
+        thumbnail_path = media_store.object_path(thumbnail_name)
+        if not os.path.exists(thumbnail_path):
+            media_processor.submit(url, media_store.object_path(name), thumbnail_path,
+                                   media_store.url_for_object(thumbnail_name), media_variants.MEDIA_THUMBNAIL_WIDTH)
+    return url
+
+def store_voice(name):
+    """URL d'un message vocal reçu, converti en Ogg/Opus en arrière-plan"""
+    url = url_for('static', filename='voice_messages/' + name)
+    converted = os.path.splitext(name)[0] + '.ogg'
+    voice_processor.submit(url, os.path.join(app.config['VOICE_FOLDER'], name),
+                           os.path.join(app.config['VOICE_FOLDER'], converted),
+                           url_for('static', filename='voice_messages/' + converted))
+    return url
+
+def upload_response(kind, url, mimetype):
+    if kind == 'voice':
+        return jsonify({'success': True, 'voice_url': url})
+    return jsonify({'success': True, 'file_url': url, 'file_type': mimetype})
+
 @app.route('/upload_file', methods=['POST'])
 @login_required
 def upload_file():
@@ -655,10 +824,10 @@ def upload_file():
         return jsonify({'success': False, 'error': 'Nom de fichier vide'})
 
     if file and allowed_chat_file(file.filename):
-        filename = secure_filename(str(uuid.uuid4()) + os.path.splitext(file.filename)[1])
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        return jsonify({'success': True, 'file_url': url_for('static', filename='uploads/' + filename), 'file_type': file.mimetype})
+        temporary_path = media_store.temporary_path()
+        file.save(temporary_path)
+        file_url = store_upload('file', temporary_path, file.filename, file.mimetype)
+        return upload_response('file', file_url, file.mimetype)
     else:
         return jsonify({'success': False, 'error': 'Type de fichier non autorisé'})
 
@@ -673,10 +842,109 @@ def upload_voice():
         return jsonify({'success': False, 'error': 'Nom de fichier vide'})
 
     filename = secure_filename(f"{uuid.uuid4()}.wav")
-    file_path = os.path.join(app.config['VOICE_FOLDER'], filename)
-    audio_file.save(file_path)
+    audio_file.save(os.path.join(app.config['VOICE_FOLDER'], filename))
+
+    return upload_response('voice', store_voice(filename), audio_file.mimetype)
+
+def upload_error(error):
+    body = {'success': False, 'error': str(error)}
+    if error.offset is not None:
+        body['offset'] = error.offset
+    return jsonify(body), error.status
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def api_create_upload():
+    """Ouvrir un envoi par morceaux (voir chunked_upload.py)"""
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind', 'file')
+    filename = data.get('filename') or ''
+    if kind not in ('file', 'voice'):
+        return jsonify({'success': False, 'error': "Type d'envoi inconnu"}), 400
+    if kind == 'file' and not allowed_chat_file(filename):
+        return jsonify({'success': False, 'error': 'Type de fichier non autorisé'}), 400
+    mimetype = data.get('mimetype') or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
 
-    return jsonify({'success': True, 'voice_url': url_for('static', filename='voice_messages/' + filename)})
+    try:
+        upload_id = chunked_upload.uploads.create(session['user_id'], kind, filename,
+                                                  int(data.get('size') or 0), mimetype, MAX_FILE_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Taille invalide'}), 400
+    except chunked_upload.UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True, 'upload_id': upload_id, 'offset': 0,
+                    'chunk_size': chunked_upload.uploads.chunk_size})
+
+@app.route('/api/uploads/<upload_id>')
+@login_required
+def api_upload_status(upload_id):
+    """Position déjà reçue, pour reprendre après une coupure"""
+    try:
+        meta, offset = chunked_upload.uploads.status(upload_id, session['user_id'])
+    except chunked_upload.UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True, 'offset': offset, 'size': meta['size'],
+                    'chunk_size': chunked_upload.uploads.chunk_size})
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def api_upload_chunk(upload_id):
+    """Morceau brut (application/octet-stream) écrit à la position ?offset="""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'error': 'Position manquante'}), 400
+    try:
+        offset = chunked_upload.uploads.append(upload_id, session['user_id'], offset,
+                                               request.stream, request.headers.get('X-Chunk-SHA256'))
+    except chunked_upload.UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True, 'offset': offset})
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def api_finalize_upload(upload_id):
+    """Terminer l'envoi: même réponse que /upload_file ou /upload_voice"""
+    data = request.get_json(silent=True) or {}
+    uploads = chunked_upload.uploads
+    try:
+        part_path, meta = uploads.complete(upload_id, session['user_id'], data.get('sha256'))
+        try:
+            url = store_upload(meta['kind'], part_path, meta['filename'], meta['mimetype'])
+        except FileNotFoundError:
+            # Terminé entre-temps par une autre requête
+            raise chunked_upload.UploadError("Envoi introuvable ou expiré", 404)
+    except chunked_upload.UploadError as e:
+        return upload_error(e)
+    uploads.discard(upload_id)
+    return upload_response(meta['kind'], url, meta['mimetype'])
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def api_cancel_upload(upload_id):
+    try:
+        chunked_upload.uploads.status(upload_id, session['user_id'])
+    except chunked_upload.UploadError as e:
+        return upload_error(e)
+    chunked_upload.uploads.discard(upload_id)
+    return jsonify({'success': True})
+
+@app.route('/media/<name>')
+def media_file(name):
+    """Fichiers du stockage par contenu: l'URL ne change jamais de contenu, cache d'un an"""
+    path = media_store.object_path(name)
+    if not path:
+        abort(404)
+    # Le nom est le SHA-256 du contenu (ou de l'original pour une variante): ETag tout trouvé
+    return media_server.serve(path, etag=os.path.splitext(name)[0])
+
+def static_media(folder, filename):
+    """Fichiers envoyés servis hors de la route /static (Range, ETag, X-Accel-Redirect)"""
+    return media_server.serve_from(folder, filename)
+
+# Mêmes URL que la route /static, qui reste utilisée pour les CSS, scripts et sons
+for media_folder in (UPLOAD_FOLDER, VOICE_FOLDER, PROFILE_PICS_FOLDER):
+    app.add_url_rule(f'/{media_folder}/<path:filename>', f'static_media_{os.path.basename(media_folder)}',
+                     static_media, defaults={'folder': media_folder})
 
 # API Routes
 @app.route('/api/messages/<int:room_id>')
@@ -685,104 +953,57 @@ def api_messages(room_id):
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 20, type=int)  # Limite plus petite par défaut
     limit = min(limit, 50)  # Maximum 50 messages par requête
-    offset = (page - 1) * limit
-
+    before_id, before_ts = parse_message_cursor()
+    # ?page= reste accepté (OFFSET) pour les anciens clients; le curseur est à coût constant
+    offset = 0 if (before_id or before_ts) else (page - 1) * limit
+    first_page = offset == 0 and not (before_id or before_ts)
+    cursor_sql, cursor_params = message_cursor_clause('m', 'messages', before_id, before_ts)
     conn = get_db_connection()
+    if first_page:
+        flush_pending_messages(conn)
 
     try:
-        # Requête ultra optimisée - ne récupérer que l'essentiel
-        messages = conn.execute("""
-            SELECT m.id, m.sender_id, m.content, m.media_url, m.file_type,
-                   m.voice_message_url, m.parent_message_id, 
-                   strftime('%d/%m/%Y %H:%M', m.timestamp) as timestamp,
-                   u.username AS sender_username, u.profile_picture_url AS sender_profile_pic
+        # Ids de la page seulement (index couvrant), le contenu vient de l'hydratation
+        messages = conn.execute(f"""
+            SELECT m.id, m.timestamp AS cursor_ts
             FROM messages m
             INDEXED BY idx_messages_room_timestamp
-            JOIN users u ON m.sender_id = u.id
-            WHERE m.room_id = ?
-            ORDER BY m.timestamp DESC
+            WHERE m.room_id = ?{cursor_sql}
+            ORDER BY m.timestamp DESC, m.id DESC
             LIMIT ? OFFSET ?
-        """, (room_id, limit, offset)).fetchall()
+        """, (room_id,) + cursor_params + (limit, offset)).fetchall()
 
         if not messages:
             conn.close()
             return jsonify([])
 
-        message_ids = [msg['id'] for msg in messages]
-
-        # Récupérer les messages parents en une requête
-        parent_data = {}
-        if any(msg['parent_message_id'] for msg in messages):
-            parent_ids = [msg['parent_message_id'] for msg in messages if msg['parent_message_id']]
-            if parent_ids:
-                parents = conn.execute(f"""
-                    SELECT m.id, m.content, u.username
-                    FROM messages m
-                    JOIN users u ON m.sender_id = u.id
-                    WHERE m.id IN ({','.join(['?'] * len(parent_ids))})
-                """, parent_ids).fetchall()
-
-                for parent in parents:
-                    parent_data[parent['id']] = {
-                        'content': parent['content'],
-                        'username': parent['username']
-                    }
-
-        # Récupérer les réactions de façon optimisée
-        reactions_data = {}
-        if message_ids and page == 1:  # Seulement pour la première page
-            reactions = conn.execute(f"""
-                SELECT r.message_id, r.emoji, COUNT(*) AS count,
-                       GROUP_CONCAT(u.username, ', ') AS usernames
-                FROM reactions r
-                JOIN users u ON r.user_id = u.id
-                WHERE r.message_id IN ({','.join(['?'] * len(message_ids))})
-                GROUP BY r.message_id, r.emoji
-                LIMIT 100
-            """, message_ids).fetchall()
-
-            for reaction in reactions:
-                msg_id = reaction['message_id']
-                if msg_id not in reactions_data:
-                    reactions_data[msg_id] = []
-                reactions_data[msg_id].append({
-                    'emoji': reaction['emoji'],
-                    'count': reaction['count'],
-                    'usernames': reaction['usernames']
-                })
-
-        # Construire la réponse optimisée
-        messages_list = []
-        for msg in messages:
-            msg_dict = {
-                'id': msg['id'],
-                'sender_id': msg['sender_id'],
-                'content': msg['content'] or '',
-                'media_url': msg['media_url'],
-                'file_type': msg['file_type'],
-                'voice_message_url': msg['voice_message_url'],
-                'timestamp': msg['timestamp'],
-                'sender_username': msg['sender_username'],
-                'sender_profile_pic': msg['sender_profile_pic'],
-                'reactions': reactions_data.get(msg['id'], [])
-            }
-
-            # Ajouter les données parent si disponibles
-            if msg['parent_message_id'] and msg['parent_message_id'] in parent_data:
-                parent = parent_data[msg['parent_message_id']]
-                msg_dict['parent_content'] = parent['content']
-                msg_dict['parent_username'] = parent['username']
-
-            messages_list.append(msg_dict)
-
+        # Expéditeurs, parents et réactions par lots (caches), miniatures sauf ?media=full
+        messages_list = message_hydrator.hydrate(conn, [msg['id'] for msg in messages],
+                                                 full_media=request.args.get('media') == 'full')
         conn.close()
-        return jsonify(messages_list)
+        return next_cursor_header(jsonify(messages_list), messages, limit)
 
     except Exception as e:
         conn.close()
         print(f"Erreur API messages: {e}")
         return jsonify([]), 500
 
+@app.route('/api/db_pool_stats')
+@login_required
+def api_db_pool_stats():
+    """Métriques du pool de connexions (dimensionnement)"""
+    return jsonify(db_pool.get_pool().stats())
+
+@app.route('/api/cache_stats')
+@login_required
+def api_cache_stats():
+    """Compteurs des caches en mémoire du processus"""
+    return jsonify({'user_summaries': user_cache.stats(), 'presence': presence_service.stats(),
+                    'typing': typing_status.stats(), 'public_rooms': room_directory.public_rooms.stats(),
+                    'user_search': user_index.directory.stats(), 'media_variants': media_processor.stats(),
+                    'voice_transcoder': voice_processor.stats(), 'media_server': media_server.stats(),
+                    'reaction_summaries': reaction_summaries.stats(), 'messages': message_hydrator.stats()})
+
 @app.route('/api/ping')
 @login_required
 def api_ping():
@@ -802,24 +1023,21 @@ def offline_mode():
             'id': user_id,
             'username': conn.execute("SELECT username FROM users WHERE id = ?", (user_id,)).fetchone()['username']
         },
-        'unread_count': conn.execute(
-            "SELECT COUNT(*) FROM private_messages WHERE receiver_id = ? AND is_read = 0", 
-            (user_id,)
-        ).fetchone()[0],
+        'unread_count': notification_badges.get(conn, user_id)['unread_messages'],
         'rooms': []
     }
 
     # Salons actifs seulement
     rooms = conn.execute("""
-        SELECT r.id, r.name, COUNT(m.id) as msg_count
-        FROM rooms r
-        JOIN room_members rm ON r.id = rm.room_id
-        LEFT JOIN messages m ON r.id = m.room_id AND m.timestamp >= datetime('now', '-1 day')
+        SELECT r.id, r.name,
+               COALESCE((SELECT SUM(a.message_count) FROM room_activity a
+                         WHERE a.room_id = r.id AND a.bucket >= ?), 0) AS msg_count
+        FROM room_members rm
+        JOIN rooms r ON r.id = rm.room_id
         WHERE rm.user_id = ?
-        GROUP BY r.id, r.name
         ORDER BY msg_count DESC
         LIMIT 3
-    """, (user_id,)).fetchall()
+    """, (room_activity.window_start(24), user_id)).fetchall()
 
     for room in rooms:
         data['rooms'].append({
@@ -838,34 +1056,21 @@ def conversations_light():
     user_id = session['user_id']
     conn = get_db_connection()
 
-    conversations = conn.execute("""
-        SELECT 
-            CASE WHEN pm.sender_id = ? THEN pm.receiver_id ELSE pm.sender_id END as other_user_id,
-            u.username,
-            CASE 
-                WHEN LENGTH(pm.content) > 30 THEN SUBSTR(pm.content, 1, 30) || '...'
-                ELSE COALESCE(pm.content, '[Fichier]')
-            END as preview,
-            pm.timestamp,
-            (SELECT COUNT(*) FROM private_messages 
-             WHERE receiver_id = ? AND sender_id = (CASE WHEN pm.sender_id = ? THEN pm.receiver_id ELSE pm.sender_id END) 
-             AND is_read = 0) as unread
-        FROM private_messages pm
-        JOIN users u ON u.id = CASE WHEN pm.sender_id = ? THEN pm.receiver_id ELSE pm.sender_id END
-        WHERE pm.sender_id = ? OR pm.receiver_id = ?
-        GROUP BY other_user_id
-        ORDER BY pm.timestamp DESC
-        LIMIT 10
-    """, (user_id, user_id, user_id, user_id, user_id, user_id)).fetchall()
+    conversations = conversation_index.list_conversations(conn, user_id, limit=10)
 
     result = []
     for conv in conversations:
+        last_message = conv['last_message']
+        if last_message and len(last_message) > 30:
+            preview = last_message[:30] + '...'
+        else:
+            preview = last_message or '[Fichier]'
         result.append({
             'id': conv['other_user_id'],
-            'name': conv['username'][:15],  # Tronquer les noms longs
-            'preview': conv['preview'],
-            'time': conv['timestamp'][-5:] if conv['timestamp'] else '',  # Heure seulement
-            'unread': min(conv['unread'], 99)  # Limiter à 99+
+            'name': conv['other_username'][:15],  # Tronquer les noms longs
+            'preview': preview,
+            'time': conv['last_timestamp'][-5:] if conv['last_timestamp'] else '',  # Heure seulement
+            'unread': min(conv['unread_count'], 99)  # Limiter à 99+
         })
 
     conn.close()
@@ -878,18 +1083,17 @@ def rooms_light():
     user_id = session['user_id']
     conn = get_db_connection()
 
+    # Compteurs dénormalisés: membres (rooms.member_count) et tranches horaires de room_activity
     rooms = conn.execute("""
-        SELECT r.id, r.name, r.is_private,
-               COUNT(rm.user_id) as members,
-               COUNT(m.id) as recent_msgs
-        FROM rooms r
-        JOIN room_members rm_user ON r.id = rm_user.room_id AND rm_user.user_id = ?
-        LEFT JOIN room_members rm ON r.id = rm.room_id
-        LEFT JOIN messages m ON r.id = m.room_id AND m.timestamp >= datetime('now', '-6 hours')
-        GROUP BY r.id, r.name, r.is_private
+        SELECT r.id, r.name, r.is_private, r.member_count AS members,
+               COALESCE((SELECT SUM(a.message_count) FROM room_activity a
+                         WHERE a.room_id = r.id AND a.bucket >= ?), 0) AS recent_msgs
+        FROM room_members rm_user
+        JOIN rooms r ON r.id = rm_user.room_id
+        WHERE rm_user.user_id = ?
         ORDER BY recent_msgs DESC, r.created_at DESC
         LIMIT 15
-    """, (user_id,)).fetchall()
+    """, (room_activity.window_start(6), user_id)).fetchall()
 
     result = []
     for room in rooms:
@@ -911,104 +1115,108 @@ def api_private_messages(other_user_id):
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 20, type=int)
     limit = min(limit, 50)  # Maximum 50 messages par requête
-    offset = (page - 1) * limit
+    before_id, before_ts = parse_message_cursor()
+    offset = 0 if (before_id or before_ts) else (page - 1) * limit
+    cursor_sql, cursor_params = message_cursor_clause('p', 'private_messages', before_id, before_ts)
+    # Chaque sens de la conversation est lu sur idx_private_messages_users puis fusionné
+    branch_limit = limit + offset
 
     conn = get_db_connection()
 
     try:
-        # Requête optimisée similaire aux messages de salon
-        messages = conn.execute("""
-            SELECT pm.id, pm.sender_id, pm.content, pm.media_url, pm.file_type,
-                   pm.voice_message_url, pm.parent_message_id, 
-                   strftime('%d/%m/%Y %H:%M', pm.timestamp) as timestamp,
-                   u.username AS sender_username, u.profile_picture_url AS sender_profile_pic
-            FROM private_messages pm
-            JOIN users u ON pm.sender_id = u.id
-            WHERE (pm.sender_id = ? AND pm.receiver_id = ?) OR (pm.sender_id = ? AND pm.receiver_id = ?)
-            ORDER BY pm.timestamp DESC
+        messages = conn.execute(f"""
+            SELECT id, cursor_ts
+            FROM (
+                SELECT id, cursor_ts FROM (
+                    SELECT p.id, p.timestamp AS cursor_ts FROM private_messages p
+                    WHERE p.sender_id = ? AND p.receiver_id = ?{cursor_sql}
+                    ORDER BY p.timestamp DESC, p.id DESC LIMIT ?
+                ) sent
+                UNION ALL
+                SELECT id, cursor_ts FROM (
+                    SELECT p.id, p.timestamp AS cursor_ts FROM private_messages p
+                    WHERE p.sender_id = ? AND p.receiver_id = ?{cursor_sql}
+                    ORDER BY p.timestamp DESC, p.id DESC LIMIT ?
+                ) received
+            ) page_ids
+            ORDER BY cursor_ts DESC, id DESC
             LIMIT ? OFFSET ?
-        """, (user_id, other_user_id, other_user_id, user_id, limit, offset)).fetchall()
+        """, (user_id, other_user_id) + cursor_params + (branch_limit,)
+             + (other_user_id, user_id) + cursor_params + (branch_limit, limit, offset)).fetchall()
 
         if not messages:
             conn.close()
             return jsonify([])
 
-        message_ids = [msg['id'] for msg in messages]
-
-        # Récupérer les messages parents en une requête
-        parent_data = {}
-        if any(msg['parent_message_id'] for msg in messages):
-            parent_ids = [msg['parent_message_id'] for msg in messages if msg['parent_message_id']]
-            if parent_ids:
-                parents = conn.execute(f"""
-                    SELECT pm.id, pm.content, u.username
-                    FROM private_messages pm
-                    JOIN users u ON pm.sender_id = u.id
-                    WHERE pm.id IN ({','.join(['?'] * len(parent_ids))})
-                """, parent_ids).fetchall()
-
-                for parent in parents:
-                    parent_data[parent['id']] = {
-                        'content': parent['content'],
-                        'username': parent['username']
-                    }
-
-        # Récupérer les réactions de façon optimisée
-        reactions_data = {}
-        if message_ids and page == 1:  # Seulement pour la première page
-            reactions = conn.execute(f"""
-                SELECT r.private_message_id, r.emoji, COUNT(*) AS count,
-                       GROUP_CONCAT(u.username, ', ') AS usernames
-                FROM reactions r
-                JOIN users u ON r.user_id = u.id
-                WHERE r.private_message_id IN ({','.join(['?'] * len(message_ids))})
-                GROUP BY r.private_message_id, r.emoji
-                LIMIT 100
-            """, message_ids).fetchall()
-
-            for reaction in reactions:
-                msg_id = reaction['private_message_id']
-                if msg_id not in reactions_data:
-                    reactions_data[msg_id] = []
-                reactions_data[msg_id].append({
-                    'emoji': reaction['emoji'],
-                    'count': reaction['count'],
-                    'usernames': reaction['usernames']
-                })
-
-        # Construire la réponse optimisée
-        messages_list = []
-        for msg in messages:
-            msg_dict = {
-                'id': msg['id'],
-                'sender_id': msg['sender_id'],
-                'receiver_id': other_user_id if msg['sender_id'] == user_id else user_id,
-                'content': msg['content'] or '',
-                'media_url': msg['media_url'],
-                'file_type': msg['file_type'],
-                'voice_message_url': msg['voice_message_url'],
-                'timestamp': msg['timestamp'],
-                'sender_username': msg['sender_username'],
-                'sender_profile_pic': msg['sender_profile_pic'] or 'default_profile.png',
-                'reactions': reactions_data.get(msg['id'], [])
-            }
-
-            # Ajouter les données parent si disponibles
-            if msg['parent_message_id'] and msg['parent_message_id'] in parent_data:
-                parent = parent_data[msg['parent_message_id']]
-                msg_dict['parent_content'] = parent['content']
-                msg_dict['parent_username'] = parent['username']
-
-            messages_list.append(msg_dict)
+        # Expéditeurs, parents et réactions par lots (caches), miniatures sauf ?media=full
+        messages_list = message_hydrator.hydrate(conn, [msg['id'] for msg in messages], is_private=True,
+                                                 full_media=request.args.get('media') == 'full')
 
+        # Messages envoyés lus par l'interlocuteur: id inférieur ou égal à son repère
+        read_watermark = conversation_index.read_watermark(conn, other_user_id, user_id)
+        for msg in messages_list:
+            msg['is_read'] = msg['sender_id'] != user_id or msg['id'] <= read_watermark
         conn.close()
-        return jsonify(messages_list)
+        return next_cursor_header(jsonify(messages_list), messages, limit)
 
     except Exception as e:
         conn.close()
         print(f"Erreur API messages privés: {e}")
         return jsonify([]), 500
 
+@app.route('/api/search_messages')
+@app.route('/api/search_messages/<int:room_id>')
+@login_required
+def api_search_messages(room_id=None):
+    """Recherche plein texte dans un salon, ou dans tous les salons de l'utilisateur"""
+    user_id = session['user_id']
+    terms = message_search.parse_query(request.args.get('q'))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+    if not terms:
+        return jsonify([])
+
+    conn = get_db_connection()
+    flush_pending_messages(conn)
+    try:
+        if room_id is None:
+            results = message_search.search_user_rooms(conn, user_id, terms, limit, parse_search_cursor())
+        else:
+            is_member = conn.execute("SELECT 1 FROM room_members WHERE user_id = ? AND room_id = ?",
+                                     (user_id, room_id)).fetchone()
+            if not is_member:
+                conn.close()
+                return jsonify([]), 403
+            results = message_search.search_room(conn, room_id, terms, limit, parse_search_cursor())
+        response = search_response(conn, results, limit)
+        conn.close()
+        return response
+    except Exception as e:
+        conn.close()
+        print(f"Erreur recherche messages: {e}")
+        return jsonify([]), 500
+
+@app.route('/api/search_private_messages/<int:other_user_id>')
+@login_required
+def api_search_private_messages(other_user_id):
+    """Recherche plein texte dans une conversation privée"""
+    user_id = session['user_id']
+    terms = message_search.parse_query(request.args.get('q'))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+    if not terms:
+        return jsonify([])
+
+    conn = get_db_connection()
+    try:
+        results = message_search.search_conversation(conn, user_id, other_user_id, terms, limit,
+                                                     parse_search_cursor())
+        response = search_response(conn, results, limit)
+        conn.close()
+        return response
+    except Exception as e:
+        conn.close()
+        print(f"Erreur recherche messages privés: {e}")
+        return jsonify([]), 500
+
 @app.route('/api/room_members/<int:room_id>')
 @login_required
 def api_room_members(room_id):
@@ -1044,12 +1252,21 @@ def api_delete_room(room_id):
         return jsonify({'success': False, 'error': 'Vous n\'êtes pas autorisé à supprimer ce salon'})
 
     try:
+        flush_pending_messages(conn)
         # Supprimer toutes les données associées
         conn.execute("DELETE FROM reactions WHERE message_id IN (SELECT id FROM messages WHERE room_id = ?)", (room_id,))
+        reaction_summaries.forget_room(conn, room_id)
+        message_hydrator.clear()
+        message_search.forget_room(conn, room_id)
+        media_store.release_room(conn, room_id)
         conn.execute("DELETE FROM messages WHERE room_id = ?", (room_id,))
+        room_activity.forget_room(conn, room_id)
+        message_stats.forget_room(conn, room_id)
         conn.execute("DELETE FROM room_members WHERE room_id = ?", (room_id,))
         conn.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
         conn.commit()
+        room_directory.public_rooms.invalidate()
+        media_store.collect(conn)
         conn.close()
         return jsonify({'success': True})
     except Exception as e:
@@ -1074,7 +1291,7 @@ def api_kick_member(room_id, member_id):
         return jsonify({'success': False, 'error': 'Vous ne pouvez pas vous expulser vous-même'})
 
     try:
-        conn.execute("DELETE FROM room_members WHERE room_id = ? AND user_id = ?", (room_id, member_id))
+        room_directory.remove_member(conn, room_id, member_id)
         conn.commit()
         conn.close()
         return jsonify({'success': True})
@@ -1095,10 +1312,18 @@ def api_clear_room_messages(room_id):
         return jsonify({'success': False, 'error': 'Vous n\'êtes pas autorisé à nettoyer ce salon'})
 
     try:
+        flush_pending_messages(conn)
         # Supprimer les réactions puis les messages
         conn.execute("DELETE FROM reactions WHERE message_id IN (SELECT id FROM messages WHERE room_id = ?)", (room_id,))
+        reaction_summaries.forget_room(conn, room_id)
+        message_hydrator.clear()
+        message_search.forget_room(conn, room_id)
+        media_store.release_room(conn, room_id)
         conn.execute("DELETE FROM messages WHERE room_id = ?", (room_id,))
+        room_activity.forget_room(conn, room_id)
+        message_stats.forget_room(conn, room_id)
         conn.commit()
+        media_store.collect(conn)
         conn.close()
         return jsonify({'success': True})
     except Exception as e:
@@ -1113,6 +1338,7 @@ def api_toggle_pin_message(message_id):
     is_pinned = data.get('is_pinned', False)
 
     conn = get_db_connection()
+    flush_pending_messages(conn, message_id)
 
     # Vérifier que l'utilisateur est créateur du salon
     message = conn.execute("""
@@ -1129,6 +1355,7 @@ def api_toggle_pin_message(message_id):
     try:
         conn.execute("UPDATE messages SET is_pinned = ? WHERE id = ?", (is_pinned, message_id))
         conn.commit()
+        message_hydrator.invalidate(message_id)
         conn.close()
         return jsonify({'success': True})
     except Exception as e:
@@ -1140,14 +1367,12 @@ def api_toggle_pin_message(message_id):
 def api_pinned_messages(room_id):
     conn = get_db_connection()
     messages = conn.execute("""
-        SELECT m.id, m.content, m.timestamp, u.username as sender_username
-        FROM messages m
-        JOIN users u ON m.sender_id = u.id
+        SELECT m.id FROM messages m
         WHERE m.room_id = ? AND m.is_pinned = 1
         ORDER BY m.timestamp DESC
     """, (room_id,)).fetchall()
 
-    messages_list = [dict(msg) for msg in messages]
+    messages_list = message_hydrator.hydrate(conn, [msg['id'] for msg in messages])
     conn.close()
     return jsonify(messages_list)
 
@@ -1156,10 +1381,11 @@ def api_pinned_messages(room_id):
 def api_delete_message(message_id):
     user_id = session['user_id']
     conn = get_db_connection()
+    flush_pending_messages(conn, message_id)
 
     # Vérifier les permissions (créateur du message ou créateur du salon)
     message = conn.execute("""
-        SELECT m.sender_id, m.room_id, r.creator_id 
+        SELECT m.sender_id, m.room_id, m.timestamp, m.media_url, r.creator_id 
         FROM messages m 
         JOIN rooms r ON m.room_id = r.id 
         WHERE m.id = ?
@@ -1176,8 +1402,19 @@ def api_delete_message(message_id):
     try:
         # Supprimer les réactions puis le message
         conn.execute("DELETE FROM reactions WHERE message_id = ?", (message_id,))
-        conn.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+        reaction_summaries.forget_message(conn, message_id)
+        message_hydrator.invalidate(message_id)
+        message_search.forget_message(conn, message_id)
+        if not conn.execute("DELETE FROM messages WHERE id = ?", (message_id,)).rowcount:
+            # Déjà supprimé par une requête concurrente: rien à décompter
+            conn.rollback()
+            conn.close()
+            return jsonify({'success': False, 'error': 'Message introuvable'})
+        room_activity.forget_message(conn, message['room_id'], message['timestamp'])
+        message_stats.forget_room_message(conn, message['room_id'], message['sender_id'], message['timestamp'])
+        media_store.release(conn, [message['media_url']])
         conn.commit()
+        media_store.collect(conn)
         conn.close()
         return jsonify({'success': True})
     except Exception as e:
@@ -1192,7 +1429,7 @@ def api_delete_private_message(message_id):
 
     # Vérifier que l'utilisateur est l'expéditeur du message
     message = conn.execute("""
-        SELECT sender_id FROM private_messages WHERE id = ?
+        SELECT sender_id, receiver_id, media_url, timestamp FROM private_messages WHERE id = ?
     """, (message_id,)).fetchone()
 
     if not message:
@@ -1206,8 +1443,24 @@ def api_delete_private_message(message_id):
     try:
         # Supprimer les réactions puis le message privé
         conn.execute("DELETE FROM reactions WHERE private_message_id = ?", (message_id,))
-        conn.execute("DELETE FROM private_messages WHERE id = ?", (message_id,))
+        reaction_summaries.forget_message(conn, message_id, is_private=True)
+        message_hydrator.invalidate(message_id, is_private=True)
+        message_search.forget_private_message(conn, message_id)
+        if not conn.execute("DELETE FROM private_messages WHERE id = ?", (message_id,)).rowcount:
+            # Déjà supprimé par une requête concurrente: rien à décompter
+            conn.rollback()
+            conn.close()
+            return jsonify({'success': False, 'error': 'Message introuvable'})
+        badges = notification_badges.BadgeChanges()
+        if conversation_index.decrement_unread(conn, message['receiver_id'], message['sender_id'], message_id):
+            badges.add(message['receiver_id'], 'unread_messages', -1)
+        badges.apply(conn)
+        conversation_index.refresh_pair(conn, message['sender_id'], message['receiver_id'])
+        message_stats.forget_private_message(conn, message['sender_id'], message['timestamp'])
+        media_store.release(conn, [message['media_url']])
         conn.commit()
+        badges.publish(conn, socketio)
+        media_store.collect(conn)
         conn.close()
         return jsonify({'success': True})
     except Exception as e:
@@ -1220,21 +1473,14 @@ def handle_connect():
     if 'user_id' in session:
         user_id = session['user_id']
         join_room(f'user_{user_id}')
-        conn = get_db_connection()
-        conn.execute("INSERT OR REPLACE INTO user_activity (user_id, last_active, is_online) VALUES (?, CURRENT_TIMESTAMP, 1)", (user_id,))
-        conn.commit()
-        conn.close()
-        emit('user_status_changed', {'user_id': user_id, 'is_online': True}, broadcast=True)
+        # Mémoire seulement: écriture en base et notifications groupées par presence
+        presence_service.start()
+        presence_service.connect(user_id, request.sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     if 'user_id' in session:
-        user_id = session['user_id']
-        conn = get_db_connection()
-        conn.execute("UPDATE user_activity SET is_online = 0, last_active = CURRENT_TIMESTAMP WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
-        emit('user_status_changed', {'user_id': user_id, 'is_online': False}, broadcast=True)
+        presence_service.disconnect(session['user_id'], request.sid)
 
 @socketio.on('join_room')
 def on_join(data):
@@ -1269,33 +1515,35 @@ def handle_send_message(data):
         return
 
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO messages (room_id, sender_id, content, media_url, file_type, voice_message_url, parent_message_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (room_id, user_id, content, media_url, file_type, voice_url, parent_id))
-    message_id = cursor.lastrowid
-    conn.commit()
-
-    sender = conn.execute("SELECT username, profile_picture_url FROM users WHERE id = ?", (user_id,)).fetchone()
-
-    message_data = {
-        'id': message_id,
-        'room_id': room_id,
-        'sender_id': user_id,
-        'content': content,
-        'media_url': media_url,
-        'file_type': file_type,
-        'voice_message_url': voice_url,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'sender_username': sender['username'],
-        'sender_profile_pic': sender['profile_picture_url'] or 'default_profile.png',
-        'parent_message_id': parent_id,
-        'reactions': []
-    }
+    if voice_url:
+        # Conversion déjà terminée: le message désigne directement le fichier Ogg/Opus
+        voice_url = voice_transcoder.current_url(conn, voice_url)
+    ingest = get_message_ingest(conn)
+    if ingest:
+        # Id pré-alloué: diffusion immédiate, insertion groupée plus tard
+        message_id = ingest.submit(conn, room_id, user_id, content, media_url, file_type, voice_url, parent_id)['id']
+    else:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO messages (room_id, sender_id, content, media_url, file_type, voice_message_url, parent_message_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (room_id, user_id, content, media_url, file_type, voice_url, parent_id))
+        message_id = cursor.lastrowid
+        message_search.index_message(conn, message_id, room_id, content)
+        room_activity.record_message(conn, room_id)
+        message_stats.record_room_message(conn, room_id, user_id)
+        media_store.retain(conn, [media_url])
+        conn.commit()
 
+    # Même forme que l'historique (parent, miniatures, message vocal converti)
+    message_data = message_hydrator.hydrate_rows(conn, [{
+        'id': message_id, 'room_id': room_id, 'sender_id': user_id, 'content': content,
+        'media_url': media_url, 'file_type': file_type, 'voice_message_url': voice_url,
+        'parent_message_id': parent_id, 'is_pinned': False, 'timestamp': message_hydrator.current_timestamp(),
+    }])
     conn.close()
-    emit('new_message', message_data, room=f'room_{room_id}')
+    if message_data:
+        emit('new_message', message_data[0], room=f'room_{room_id}')
 
 @socketio.on('send_private_message')
 def handle_send_private_message(data):
@@ -1314,35 +1562,56 @@ def handle_send_private_message(data):
         return
 
     conn = get_db_connection()
+    if voice_url:
+        # Conversion déjà terminée: le message désigne directement le fichier Ogg/Opus
+        voice_url = voice_transcoder.current_url(conn, voice_url)
     cursor = conn.cursor()
     cursor.execute("""
-        INSERT INTO private_messages (sender_id, receiver_id, content, media_url, file_type, voice_message_url, parent_message_id, is_read)
-        VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+        INSERT INTO private_messages (sender_id, receiver_id, content, media_url, file_type, voice_message_url, parent_message_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
     """, (user_id, receiver_id, content, media_url, file_type, voice_url, parent_id))
     message_id = cursor.lastrowid
+    message_search.index_private_message(conn, message_id, user_id, receiver_id, content)
+    conversation_index.record_private_message(conn, message_id, user_id, receiver_id, content)
+    message_stats.record_private_message(conn, user_id)
+    media_store.retain(conn, [media_url])
+    badges = notification_badges.BadgeChanges()
+    if receiver_id != user_id:
+        badges.add(receiver_id, 'unread_messages', 1)
+    badges.apply(conn)
     conn.commit()
+    badges.publish(conn, socketio)
 
-    sender = conn.execute("SELECT username, profile_picture_url FROM users WHERE id = ?", (user_id,)).fetchone()
-
-    message_data = {
-        'id': message_id,
-        'sender_id': user_id,
-        'receiver_id': receiver_id,
-        'content': content,
-        'media_url': media_url,
-        'file_type': file_type,
-        'voice_message_url': voice_url,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'sender_username': sender['username'],
-        'sender_profile_pic': sender['profile_picture_url'] or 'default_profile.png',
-        'parent_message_id': parent_id,
-        'reactions': []
-    }
-
+    message_data = message_hydrator.hydrate_rows(conn, [{
+        'id': message_id, 'sender_id': user_id, 'receiver_id': receiver_id, 'content': content,
+        'media_url': media_url, 'file_type': file_type, 'voice_message_url': voice_url,
+        'parent_message_id': parent_id, 'timestamp': message_hydrator.current_timestamp(),
+    }], is_private=True)
     conn.close()
+    if not message_data:
+        return
+    message_data = message_data[0]
+    message_data['is_read'] = receiver_id == user_id
     emit('new_private_message', message_data, room=f'user_{user_id}')
     emit('new_private_message', message_data, room=f'user_{receiver_id}')
 
+@socketio.on('mark_read')
+def handle_mark_read(data):
+    """Messages reçus affichés dans une conversation ouverte (envoi groupé par le client)"""
+    user_id = session.get('user_id')
+    try:
+        other_user_id = int(data.get('other_user_id'))
+        message_id = int(data.get('message_id'))
+    except (AttributeError, TypeError, ValueError):
+        return
+    if not user_id or other_user_id <= 0 or message_id <= 0:
+        return
+    conn = get_db_connection()
+    try:
+        mark_conversation_read(conn, user_id, other_user_id, message_id)
+    finally:
+        conn.close()
+
 @socketio.on('add_reaction')
 def handle_add_reaction(data):
     user_id = session.get('user_id')
@@ -1352,52 +1621,23 @@ def handle_add_reaction(data):
     is_private = data.get('is_private', False)
 
     conn = get_db_connection()
-
-    if is_private:
-        existing = conn.execute("SELECT id FROM reactions WHERE user_id = ? AND private_message_id = ? AND emoji = ?", 
-                               (user_id, message_id, emoji)).fetchone()
-        if existing:
-            conn.execute("DELETE FROM reactions WHERE id = ?", (existing['id'],))
-        else:
-            conn.execute("INSERT INTO reactions (user_id, private_message_id, emoji) VALUES (?, ?, ?)", 
-                        (user_id, message_id, emoji))
-    else:
-        existing = conn.execute("SELECT id FROM reactions WHERE user_id = ? AND message_id = ? AND emoji = ?", 
-                               (user_id, message_id, emoji)).fetchone()
-        if existing:
-            conn.execute("DELETE FROM reactions WHERE id = ?", (existing['id'],))
-        else:
-            conn.execute("INSERT INTO reactions (user_id, message_id, emoji) VALUES (?, ?, ?)", 
-                        (user_id, message_id, emoji))
-
+    if not is_private:
+        # La réaction référence le message: il doit être inséré avant
+        flush_pending_messages(conn, message_id)
+    # Bascule et résumé mis à jour dans la même transaction (pas de regroupement de toutes les réactions)
+    reactions = reaction_summaries.toggle(conn, user_id, message_id, emoji, is_private)
     conn.commit()
+    conn.close()
 
-    # Récupérer les réactions mises à jour
     if is_private:
-        reactions = conn.execute("""
-            SELECT r.emoji, GROUP_CONCAT(u.username) AS usernames, COUNT(*) AS count
-            FROM reactions r
-            JOIN users u ON r.user_id = u.id
-            WHERE r.private_message_id = ?
-            GROUP BY r.emoji
-        """, (message_id,)).fetchall()
-        emit('private_message_reacted', {'message_id': message_id, 'reactions': [dict(r) for r in reactions]}, 
+        emit('private_message_reacted', {'message_id': message_id, 'reactions': reactions},
              room=f'user_{user_id}')
-        emit('private_message_reacted', {'message_id': message_id, 'reactions': [dict(r) for r in reactions]}, 
+        emit('private_message_reacted', {'message_id': message_id, 'reactions': reactions},
              room=f'user_{data.get("receiver_id")}')
     else:
-        reactions = conn.execute("""
-            SELECT r.emoji, GROUP_CONCAT(u.username) AS usernames, COUNT(*) AS count
-            FROM reactions r
-            JOIN users u ON r.user_id = u.id
-            WHERE r.message_id = ?
-            GROUP BY r.emoji
-        """, (message_id,)).fetchall()
-        emit('message_reacted', {'message_id': message_id, 'reactions': [dict(r) for r in reactions]}, 
+        emit('message_reacted', {'message_id': message_id, 'reactions': reactions},
              room=f'room_{room_id}')
 
-    conn.close()
-
 @socketio.on('typing')
 def handle_typing(data):
     user_id = session.get('user_id')
@@ -1405,11 +1645,9 @@ def handle_typing(data):
     is_typing = data.get('is_typing')
 
     if user_id and room_id:
-        conn = get_db_connection()
-        username = conn.execute("SELECT username FROM users WHERE id = ?", (user_id,)).fetchone()['username']
-        conn.close()
-        emit('typing_status', {'user_id': user_id, 'username': username, 'is_typing': is_typing}, 
-             room=f'room_{room_id}', skip_sid=request.sid)
+        # Mémoire seulement: diffusion groupée par salon dans typing_aggregator
+        typing_status.start()
+        typing_status.update('typing_status', f'room_{room_id}', user_id, bool(is_typing))
 
 @socketio.on('private_typing')
 def handle_private_typing(data):
@@ -1418,11 +1656,8 @@ def handle_private_typing(data):
     is_typing = data.get('is_typing')
 
     if user_id and receiver_id:
-        conn = get_db_connection()
-        username = conn.execute("SELECT username FROM users WHERE id = ?", (user_id,)).fetchone()['username']
-        conn.close()
-        emit('private_typing_status', {'user_id': user_id, 'username': username, 'is_typing': is_typing}, 
-             room=f'user_{receiver_id}')
+        typing_status.start()
+        typing_status.update('private_typing_status', f'user_{receiver_id}', user_id, bool(is_typing))
 
 @app.route('/friends')
 @login_required
@@ -1441,39 +1676,8 @@ def room_stats(room_id):
     if not is_member:
         return jsonify({'error': 'Accès refusé'}), 403
 
-    stats = {}
-
-    # Messages par jour (7 derniers jours)
-    stats['messages_per_day'] = conn.execute("""
-        SELECT DATE(timestamp) as date, COUNT(*) as count
-        FROM messages 
-        WHERE room_id = ? AND timestamp >= datetime('now', '-7 days')
-        GROUP BY DATE(timestamp)
-        ORDER BY date
-    """, (room_id,)).fetchall()
-
-    # Top utilisateurs actifs
-    stats['top_users'] = conn.execute("""
-        SELECT u.username, COUNT(*) as message_count
-        FROM messages m
-        JOIN users u ON m.sender_id = u.id
-        WHERE m.room_id = ? AND m.timestamp >= datetime('now', '-30 days')
-        GROUP BY u.username
-        ORDER BY message_count DESC
-        LIMIT 5
-    """, (room_id,)).fetchall()
-
-    # Total messages
-    stats['total_messages'] = conn.execute(
-        "SELECT COUNT(*) FROM messages WHERE room_id = ?", (room_id,)
-    ).fetchone()[0]
-
-    # Membres actifs aujourd'hui
-    stats['active_today'] = conn.execute("""
-        SELECT COUNT(DISTINCT sender_id) 
-        FROM messages 
-        WHERE room_id = ? AND DATE(timestamp) = DATE('now')
-    """, (room_id,)).fetchone()[0]
+    # Compteurs journaliers tenus à jour à l'insertion (message_stats.py)
+    stats = message_stats.room_stats(conn, room_id)
 
     conn.close()
     return jsonify(stats)
@@ -1487,17 +1691,8 @@ def user_activity():
 
     activity = {}
 
-    # Messages envoyés (7 derniers jours)
-    activity['messages_sent'] = conn.execute("""
-        SELECT COUNT(*) FROM messages 
-        WHERE sender_id = ? AND timestamp >= datetime('now', '-7 days')
-    """, (user_id,)).fetchone()[0]
-
-    # Messages privés (7 derniers jours)
-    activity['private_messages'] = conn.execute("""
-        SELECT COUNT(*) FROM private_messages 
-        WHERE sender_id = ? AND timestamp >= datetime('now', '-7 days')
-    """, (user_id,)).fetchone()[0]
+    # Messages envoyés dans les salons et en privé (7 derniers jours)
+    activity['messages_sent'], activity['private_messages'] = message_stats.user_counts(conn, user_id)
 
     # Salons rejoints
     activity['rooms_joined'] = conn.execute("""
@@ -1531,24 +1726,9 @@ def global_stats():
     # Total salons
     stats['total_rooms'] = conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0]
 
-    # Messages aujourd'hui
-    stats['messages_today'] = conn.execute("""
-        SELECT COUNT(*) FROM messages 
-        WHERE DATE(timestamp) = DATE('now')
-    """).fetchone()[0]
-
-    # Top salon le plus actif
-    top_room = conn.execute("""
-        SELECT r.name, COUNT(*) as msg_count
-        FROM messages m
-        JOIN rooms r ON m.room_id = r.id
-        WHERE m.timestamp >= datetime('now', '-7 days')
-        GROUP BY r.id, r.name
-        ORDER BY msg_count DESC
-        LIMIT 1
-    """).fetchone()
-
-    stats['top_room'] = dict(top_room) if top_room else None
+    # Messages aujourd'hui et salon le plus actif (7 jours), depuis les compteurs journaliers
+    stats['messages_today'] = message_stats.messages_today(conn)
+    stats['top_room'] = message_stats.top_room(conn)
 
     conn.close()
     return jsonify(stats)
@@ -1606,6 +1786,15 @@ def quick_actions():
     conn.close()
     return jsonify({'success': False, 'error': 'Action inconnue'})
 
+@app.route('/api/badges')
+@login_required
+def api_badges():
+    """Pastilles de l'utilisateur (une ligne), ensuite poussées par l'événement Socket.IO 'badges'"""
+    conn = get_db_connection()
+    badges = notification_badges.get(conn, session['user_id'])
+    conn.close()
+    return jsonify(badges)
+
 @app.route('/api/notifications')
 @login_required
 def get_notifications():
@@ -1615,6 +1804,9 @@ def get_notifications():
 
     notifications = []
 
+    # Compteurs de user_badges: listes lues seulement s'il y a quelque chose à montrer
+    badges = notification_badges.get(conn, user_id)
+
     # Demandes d'amis en attente
     friend_requests = conn.execute("""
         SELECT fr.id, u.username, fr.created_at
@@ -1623,7 +1815,7 @@ def get_notifications():
         WHERE fr.receiver_id = ? AND fr.status = 'pending'
         ORDER BY fr.created_at DESC
         LIMIT 5
-    """, (user_id,)).fetchall()
+    """, (user_id,)).fetchall() if badges['friend_requests'] else []
 
     for req in friend_requests:
         notifications.append({
@@ -1636,11 +1828,7 @@ def get_notifications():
         })
 
     # Messages non lus
-    unread_count = conn.execute("""
-        SELECT COUNT(*) FROM private_messages 
-        WHERE receiver_id = ? AND is_read = 0
-    """, (user_id,)).fetchone()[0]
-
+    unread_count = badges['unread_messages']
     if unread_count > 0:
         notifications.append({
             'type': 'messages',
@@ -1657,6 +1845,7 @@ if __name__ == '__main__':
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(PROFILE_PICS_FOLDER, exist_ok=True)
     os.makedirs(VOICE_FOLDER, exist_ok=True)
+    media_store.move_legacy_store()
 
     # Initialiser la base de données
     import init_and_migrate
@@ -0,0 +1,119 @@
+"""Service des fichiers envoyés (images, vidéos, messages vocaux, photos de profil).
+
+La route /static de Flask ne renvoie aucune durée de cache et lit les
+fichiers par blocs de 8 Ko dans le worker qui sert aussi le chat. serve()
+répond avec un ETag fort et Last-Modified (304 si le navigateur a déjà le
+fichier), gère les requêtes Range (206, avance rapide dans une vidéo ou un
+message vocal) et met en cache pour un an les fichiers à nom unique (uuid ou
+SHA-256), qui ne changent jamais de contenu.
+
+Par défaut le fichier est lu par blocs de 64 Ko dans le worker, qui le
+transmet au client: avec le worker gevent de gunicorn_config.py (aucun
+wsgi.file_wrapper), il n'y a pas de sendfile, seulement moins d'appels
+système qu'avec /static. Seul un serveur frontal évite la copie. Avec
+MEDIA_SENDFILE, la réponse est vide et c'est lui qui envoie le fichier, sans
+occuper le worker:
+- `x-accel-redirect` (nginx): en-tête X-Accel-Redirect vers
+  MEDIA_ACCEL_PREFIX + chemin relatif au dossier de l'application;
+- `x-sendfile` (Apache mod_xsendfile, lighttpd): chemin absolu du fichier.
+Ce mode est à activer dès qu'un tel serveur est placé devant gunicorn.
+Render expose gunicorn directement, donc le défaut reste l'envoi par le
+worker.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from flask import Response, request
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '').lower()
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/_media/')
+MEDIA_MAX_AGE = 365 * 24 * 3600
+READ_BLOCK = 64 * 1024
+
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+
+# Noms générés par l'application (uuid, éventuellement suffixé) ou par media_store (sha256)
+_IMMUTABLE_NAME = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{64})[.-]')
+
+# Métriques
+served = {'full': 0, 'partial': 0, 'not_modified': 0, 'offloaded': 0}
+
+
+def is_immutable(filename):
+    return bool(_IMMUTABLE_NAME.match(os.path.basename(filename)))
+
+
+def serve_from(directory, filename):
+    """Fichier `filename` sous `directory`, sans sortir du dossier"""
+    path = safe_join(directory, filename)
+    if path is None:
+        raise NotFound()
+    return serve(path)
+
+
+def serve(path, etag=None):
+    """Réponse conditionnelle (304), partielle (206) ou déléguée au serveur frontal pour `path`"""
+    try:
+        info = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise NotFound()
+    if not stat.S_ISREG(info.st_mode):
+        raise NotFound()
+
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    file = None
+    if MEDIA_SENDFILE == X_ACCEL_REDIRECT:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + os.path.relpath(path).replace(os.sep, '/')
+    elif MEDIA_SENDFILE == X_SENDFILE:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        file = open(path, 'rb')
+        response = Response(wrap_file(request.environ, file, READ_BLOCK), mimetype=mimetype,
+                            direct_passthrough=True)
+        response.content_length = info.st_size
+
+    response.set_etag(etag or f"{info.st_mtime_ns:x}-{info.st_size:x}")
+    response.last_modified = int(info.st_mtime)
+    if is_immutable(path):
+        response.headers['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+
+    try:
+        # Plages traitées par le serveur frontal quand il envoie le fichier
+        response.make_conditional(request.environ, accept_ranges=file is not None,
+                                  complete_length=info.st_size)
+    except RequestedRangeNotSatisfiable:
+        if file:
+            file.close()
+        raise
+
+    if response.status_code == 304:
+        served['not_modified'] += 1
+        for header in ('X-Accel-Redirect', 'X-Sendfile'):
+            response.headers.pop(header, None)
+    elif file is None:
+        served['offloaded'] += 1
+    elif response.status_code == 206:
+        served['partial'] += 1
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper:
+            # Worker synchrone uniquement (gevent n'en fournit pas): fichier positionné au début
+            # de la plage, le serveur envoie Content-Length octets à partir de là (sendfile)
+            file.seek(response.content_range.start)
+            response.response = file_wrapper(file, READ_BLOCK)
+    else:
+        served['full'] += 1
+    return response
+
+
+def stats():
+    return {'mode': MEDIA_SENDFILE or 'wsgi', **served}
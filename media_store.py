@@ -0,0 +1,196 @@
+"""Stockage des fichiers de chat adressé par contenu (SHA-256), sans doublons.
+
+Chaque fichier envoyé est rangé sous MEDIA_STORE_DIR/<2 premiers caractères>/
+<sha256><extension> et servi par /media/<sha256><extension>: le même fichier
+transféré dans dix salons n'est stocké qu'une fois, et son URL ne change
+jamais de contenu (cache navigateur immuable).
+
+media_objects compte les messages (salons et privés) dont media_url désigne
+l'objet: +1 à l'envoi (retain), -1 à la suppression (release). Un objet qui
+n'est plus référencé est supprimé par collect() après MEDIA_GC_GRACE
+secondes; ce délai couvre aussi l'intervalle entre l'envoi du fichier et
+celui du message, et un nouvel envoi du même contenu pendant le délai
+réutilise l'objet. Les anciens fichiers (uuid sous static/uploads) ne sont
+pas concernés.
+
+MEDIA_STORE_DIR est hors de static/: un objet n'est servi que par /media/
+(ETag, Range), et les fichiers en cours d'envoi (tmp/) ou en cours de
+suppression (trash/) ne sont servis par aucune route.
+"""
+import hashlib
+import os
+import re
+import shutil
+import time
+import uuid
+
+MEDIA_STORE_DIR = os.environ.get('MEDIA_STORE_DIR', 'media_objects')
+# Emplacement des versions précédentes, servi tel quel par la route des fichiers statiques
+LEGACY_MEDIA_STORE_DIR = 'static/uploads/objects'
+MEDIA_URL_PREFIX = '/media/'
+MEDIA_GC_GRACE = float(os.environ.get('MEDIA_GC_GRACE', 600))
+# collect() parcourt la table au plus une fois par intervalle et par processus
+MEDIA_GC_INTERVAL = 60
+MEDIA_GC_BATCH = 100
+READ_BLOCK = 64 * 1024
+
+# <sha256><extension>, ou <sha256>-w<largeur>.webp pour une variante réduite (media_variants)
+_NAME = re.compile(r'^([0-9a-f]{64})(-w[0-9]{1,4})?(\.[a-z0-9]{1,8})?$')
+
+_collected_at = 0
+
+
+def _extension(filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    return extension if re.match(r'^\.[a-z0-9]{1,8}$', extension) else ''
+
+
+def object_path(name):
+    """Chemin sur disque d'un nom d'objet (<sha256><extension>), None s'il est invalide"""
+    if not _NAME.match(name or ''):
+        return None
+    return os.path.join(MEDIA_STORE_DIR, name[:2], name)
+
+
+def url_for_object(name):
+    return MEDIA_URL_PREFIX + name
+
+
+def variant_name(name, width):
+    """Nom de la variante WebP d'un objet, rangée et servie à côté de lui"""
+    return f"{name[:64]}-w{width}.webp"
+
+
+def digest_of_url(url):
+    """SHA-256 d'une URL /media/..., None pour une autre URL"""
+    if not url or not url.startswith(MEDIA_URL_PREFIX):
+        return None
+    match = _NAME.match(url[len(MEDIA_URL_PREFIX):])
+    return match.group(1) if match else None
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(READ_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def move_legacy_store():
+    """Déplacer le stockage hérité de static/ vers MEDIA_STORE_DIR (une fois, au démarrage)"""
+    if (os.path.isdir(LEGACY_MEDIA_STORE_DIR) and not os.path.exists(MEDIA_STORE_DIR)
+            and os.path.abspath(LEGACY_MEDIA_STORE_DIR) != os.path.abspath(MEDIA_STORE_DIR)):
+        shutil.move(LEGACY_MEDIA_STORE_DIR, MEDIA_STORE_DIR)
+
+
+def temporary_path():
+    """Fichier temporaire sur le même disque que le stockage (renommage sans copie)"""
+    directory = os.path.join(MEDIA_STORE_DIR, 'tmp')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, uuid.uuid4().hex)
+
+
+def put(conn, source_path, filename, mimetype):
+    """Ranger un fichier reçu (déplacé, ou supprimé si le contenu existe déjà). Retourne son URL."""
+    digest = file_digest(source_path)
+    now = int(time.time())
+    existing = conn.execute("SELECT name FROM media_objects WHERE hash = ?", (digest,)).fetchone()
+    refreshed = False
+    if existing:
+        # Nouveau délai de grâce; aucune ligne si collect() vient de supprimer l'objet
+        refreshed = conn.execute("UPDATE media_objects SET updated_at = ? WHERE hash = ?",
+                                 (now, digest)).rowcount == 1
+    name = existing['name'] if existing else digest + _extension(filename)
+    path = object_path(name)
+    if refreshed and os.path.exists(path):
+        os.remove(source_path)
+        return url_for_object(name)
+
+    if not refreshed:
+        conn.execute("""
+            INSERT OR IGNORE INTO media_objects (hash, name, size, mimetype, ref_count, updated_at)
+            VALUES (?, ?, ?, ?, 0, ?)
+        """, (digest, name, os.path.getsize(source_path), mimetype, now))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.move(source_path, path)
+    return url_for_object(name)
+
+
+def _adjust(conn, urls, delta):
+    counts = {}
+    for url in urls:
+        digest = digest_of_url(url)
+        if digest:
+            counts[digest] = counts.get(digest, 0) + 1
+    now = int(time.time())
+    for digest, count in counts.items():
+        conn.execute("UPDATE media_objects SET ref_count = ref_count + ?, updated_at = ? WHERE hash = ?",
+                     (delta * count, now, digest))
+
+
+def retain(conn, urls):
+    """Messages insérés: une référence de plus par media_url"""
+    _adjust(conn, urls, 1)
+
+
+def release(conn, urls):
+    """Messages supprimés (à appeler avec les media_url lues avant le DELETE)"""
+    _adjust(conn, urls, -1)
+
+
+def release_room(conn, room_id):
+    """Tous les messages d'un salon vont être supprimés"""
+    release(conn, [row['media_url'] for row in conn.execute(
+        "SELECT media_url FROM messages WHERE room_id = ? AND media_url LIKE ?",
+        (room_id, MEDIA_URL_PREFIX + '%')).fetchall()])
+
+
+def collect(conn, force=False):
+    """Supprimer les objets sans référence depuis MEDIA_GC_GRACE secondes. Retourne leur nombre."""
+    global _collected_at
+    now = time.time()
+    if not force and now - _collected_at < MEDIA_GC_INTERVAL:
+        return 0
+    _collected_at = now
+    cutoff = int(now - MEDIA_GC_GRACE)
+    rows = conn.execute("""
+        SELECT hash, name, (SELECT thumbnail_url FROM media_variants WHERE source = ? || name) AS thumbnail_url
+        FROM media_objects
+        WHERE ref_count <= 0 AND updated_at < ?
+        LIMIT ?
+    """, (MEDIA_URL_PREFIX, cutoff, MEDIA_GC_BATCH)).fetchall()
+    removed = 0
+    # Fichiers mis de côté jusqu'au commit: supprimés après, remis en place si la
+    # transaction échoue (aucune ligne ne désigne alors un fichier absent)
+    trash = os.path.join(MEDIA_STORE_DIR, 'trash', uuid.uuid4().hex)
+    moved = []
+    try:
+        for row in rows:
+            # Condition répétée: l'objet a pu être renvoyé ou référencé entre-temps
+            cursor = conn.execute("DELETE FROM media_objects WHERE hash = ? AND ref_count <= 0 AND updated_at < ?",
+                                  (row['hash'], cutoff))
+            if cursor.rowcount != 1:
+                continue
+            # Ligne verrouillée jusqu'au commit (PostgreSQL: verrou de ligne, SQLite: verrou
+            # d'écriture): l'UPDATE d'un put() concurrent attend, ne trouve plus la ligne,
+            # puis recrée l'objet et son fichier à un chemin déjà libéré
+            conn.execute("DELETE FROM media_variants WHERE source = ?", (url_for_object(row['name']),))
+            names = [row['name']]
+            if row['thumbnail_url']:
+                names.append(row['thumbnail_url'][len(MEDIA_URL_PREFIX):])
+            for name in names:
+                path = object_path(name)
+                if path and os.path.exists(path):
+                    os.makedirs(trash, exist_ok=True)
+                    os.rename(path, os.path.join(trash, name))
+                    moved.append((path, os.path.join(trash, name)))
+            removed += 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        for path, trashed in moved:
+            os.rename(trashed, path)
+        raise
+    shutil.rmtree(trash, ignore_errors=True)
+    return removed
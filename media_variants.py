@@ -0,0 +1,164 @@
+"""Variantes réduites des images: miniatures WebP et aperçus flous.
+
+Les images de chat et les photos de profil étaient toujours servies à leur
+taille d'origine. Après l'envoi, une miniature WebP (MEDIA_THUMBNAIL_WIDTH
+pixels de large pour le chat, carré de AVATAR_SIZE pour les profils) et un
+aperçu flou de quelques centaines d'octets (data URI, affiché pendant le
+chargement) sont calculés hors de la requête, puis enregistrés dans
+media_variants à côté de l'URL d'origine. /api/messages sert la miniature
+par défaut (?media=full pour les originaux).
+
+Le calcul (décodage, redimensionnement, encodage) tourne dans un pool de
+vrais threads (MEDIA_WORKERS): Pillow y relâche le GIL, la boucle gevent
+continue de servir les autres clients. L'écriture en base se fait ensuite
+depuis une tâche de fond Socket.IO. Sans Pillow, rien n'est calculé et les
+originaux sont servis comme avant.
+"""
+import base64
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db_pool
+import db_query
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:
+    Image = None
+
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', 2))
+MEDIA_THUMBNAIL_WIDTH = int(os.environ.get('MEDIA_THUMBNAIL_WIDTH', 480))
+AVATAR_SIZE = int(os.environ.get('AVATAR_SIZE', 128))
+WEBP_QUALITY = 80
+PLACEHOLDER_WIDTH = 16
+# Images plus grandes refusées (bombe de décompression)
+MAX_IMAGE_PIXELS = 50_000_000
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+
+
+def available():
+    return Image is not None
+
+
+def is_image(filename):
+    return os.path.splitext(filename or '')[1].lower() in IMAGE_EXTENSIONS
+
+
+def _placeholder(image):
+    """Aperçu flou en data URI (quelques centaines d'octets)"""
+    small = image.copy()
+    small.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH))
+    small = small.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    small.save(buffer, 'WEBP', quality=40)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def render(source_path, target_path, width, square=False):
+    """Calculer la miniature WebP et l'aperçu. Retourne {'width', 'height', 'placeholder'},
+    ou None pour une image animée ou illisible (l'original reste servi)."""
+    with Image.open(source_path) as image:
+        if image.width * image.height > MAX_IMAGE_PIXELS or getattr(image, 'is_animated', False):
+            return None
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+        size = image.size
+        if square:
+            thumbnail = ImageOps.fit(image, (width, width), Image.LANCZOS)
+        else:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((width, width * 4), Image.LANCZOS)
+        temporary = f"{target_path}.{threading.get_ident()}.tmp"
+        thumbnail.save(temporary, 'WEBP', quality=WEBP_QUALITY, method=4)
+        os.replace(temporary, target_path)
+        return {'width': size[0], 'height': size[1], 'placeholder': _placeholder(thumbnail)}
+
+
+def variants_for(conn, sources):
+    """{source: ligne media_variants} pour les URL (ou noms de photo) données"""
+    sources = list({source for source in sources if source})
+    if not sources:
+        return {}
+    rows = conn.execute(f"""
+        SELECT source, thumbnail_url, width, height, placeholder
+        FROM media_variants
+        WHERE source IN ({','.join(['?'] * len(sources))})
+    """, sources).fetchall()
+    return {row['source']: dict(row) for row in rows}
+
+
+def forget(conn, source):
+    conn.execute("DELETE FROM media_variants WHERE source = ?", (source,))
+
+
+class MediaProcessor:
+    """File de calcul des variantes, exécutée hors des requêtes"""
+
+    def __init__(self, start_background_task, workers=MEDIA_WORKERS):
+        self.start_background_task = start_background_task
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # Métriques
+        self.submitted = 0
+        self.processed = 0
+        self.skipped = 0
+        self.failures = 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = _native_executor(self.workers)
+            return self._executor
+
+    def submit(self, source, source_path, target_path, thumbnail_url, width, square=False):
+        """Calculer en arrière-plan les variantes de `source` (URL de media_url ou nom de photo)"""
+        if not available():
+            return False
+        self.submitted += 1
+        self.start_background_task(self._process, source, source_path, target_path, thumbnail_url, width, square)
+        return True
+
+    def _process(self, source, source_path, target_path, thumbnail_url, width, square):
+        try:
+            result = self._pool().submit(render, source_path, target_path, width, square).result()
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Variantes de {source} non calculées: {e}")
+            return
+        if result is None:
+            self.skipped += 1
+            return
+        conn = db_query.connect(db_pool.get_pool().connection())
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO media_variants (source, thumbnail_url, width, height, placeholder)
+                VALUES (?, ?, ?, ?, ?)
+            """, (source, thumbnail_url, result['width'], result['height'], result['placeholder']))
+            conn.commit()
+            self.processed += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Variantes de {source} non enregistrées: {e}")
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {'available': available(), 'workers': self.workers, 'submitted': self.submitted,
+                'processed': self.processed, 'skipped': self.skipped, 'failures': self.failures}
+
+
+def _native_executor(workers):
+    """Pool de threads système, même quand gevent a remplacé le module threading"""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            return NativeThreadPoolExecutor(workers)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(workers, thread_name_prefix='media')
@@ -0,0 +1,236 @@
+"""Hydratation des messages de salon et privés pour les clients.
+
+api_messages, api_private_messages, les messages épinglés et les
+événements Socket.IO assemblaient chacun leur variante de la même réponse
+(lignes, messages parents en IN, réactions, expéditeurs, miniatures et
+messages vocaux). hydrate() prend une liste d'ids et résout chaque
+dépendance par lot, cache d'abord, une requête pour l'ensemble des absents:
+
+- lignes des messages et de leurs parents: LRU de MESSAGE_CACHE_SIZE
+  entrées, expiration après MESSAGE_CACHE_TTL secondes (épinglage fait sur
+  un autre worker), invalidé à la suppression et à l'épinglage;
+- expéditeurs: user_cache; réactions: reaction_summaries;
+- miniatures (media_variants) et messages vocaux convertis (voice_notes).
+
+La forme produite est compacte: les champs vides (None, aucune réaction)
+sont omis. Les horodatages sont au format de l'historique, 'JJ/MM/AAAA HH:MM'
+(UTC, comme CURRENT_TIMESTAMP), y compris pour les messages diffusés en
+direct.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import media_variants
+import reaction_summaries
+import user_cache
+import voice_transcoder
+
+MESSAGE_CACHE_SIZE = int(os.environ.get('MESSAGE_CACHE_SIZE', 50000))
+MESSAGE_CACHE_TTL = float(os.environ.get('MESSAGE_CACHE_TTL', 300))
+DEFAULT_PROFILE_PICTURE = 'default_profile.png'
+
+_ROOM_COLUMNS = ('id', 'room_id', 'sender_id', 'content', 'media_url', 'file_type', 'voice_message_url',
+                 'parent_message_id', 'is_pinned', 'timestamp')
+_PRIVATE_COLUMNS = ('id', 'sender_id', 'receiver_id', 'content', 'media_url', 'file_type', 'voice_message_url',
+                    'parent_message_id', 'timestamp')
+
+
+def current_timestamp():
+    """Horodatage d'un message qui vient d'être envoyé (même forme que CURRENT_TIMESTAMP)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def format_timestamp(value):
+    """'JJ/MM/AAAA HH:MM' d'un horodatage SQLite (texte) ou PostgreSQL (datetime)"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime('%d/%m/%Y %H:%M')
+    # 'AAAA-MM-JJ HH:MM:SS': découpage direct (strptime coûte plus que le reste de l'hydratation)
+    value = str(value)
+    return f"{value[8:10]}/{value[5:7]}/{value[:4]} {value[11:16]}"
+
+
+class MessageRowCache:
+    """LRU + TTL des lignes de messages, indexé par (is_private, id)"""
+
+    def __init__(self, max_size=MESSAGE_CACHE_SIZE, ttl=MESSAGE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métriques
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.queries = 0
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < now:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _store(self, key, row, now):
+        self._entries[key] = (now + self.ttl, row)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, conn, message_ids, is_private=False):
+        """Lignes {id: dict} des messages existants; une requête pour les absents"""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for message_id in set(message_ids):
+                row = self._lookup((is_private, message_id), now)
+                if row is None:
+                    missing.append(message_id)
+                else:
+                    found[message_id] = row
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            table, columns = ('private_messages', _PRIVATE_COLUMNS) if is_private else ('messages', _ROOM_COLUMNS)
+            rows = conn.execute(f"""
+                SELECT {', '.join(columns)} FROM {table}
+                WHERE id IN ({','.join(['?'] * len(missing))})
+            """, missing).fetchall()
+            with self._lock:
+                self.queries += 1
+                for row in rows:
+                    row = {column: row[column] for column in columns}
+                    self._store((is_private, row['id']), row, now)
+                    found[row['id']] = row
+        return found
+
+    def invalidate(self, message_id, is_private=False):
+        with self._lock:
+            self._entries.pop((is_private, message_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'queries': self.queries,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+_rows = MessageRowCache()
+
+
+def apply_voice_notes(conn, messages):
+    """URL convertie, durée (s) et forme d'onde des messages vocaux"""
+    notes = voice_transcoder.notes_for(conn, [msg['voice_message_url'] for msg in messages])
+    for msg in messages:
+        note = notes.get(msg['voice_message_url'])
+        if note:
+            msg['voice_message_url'] = note['url']
+            msg['voice_duration'] = note['duration_ms'] / 1000
+            msg['voice_waveform'] = note['waveform']
+    return messages
+
+
+def apply_media_variants(conn, messages, full=False):
+    """Miniatures et aperçus flous à la place des images et photos d'origine (sauf full)"""
+    if full or not messages:
+        return messages
+    variants = media_variants.variants_for(
+        conn, [msg['media_url'] for msg in messages] + [msg.get('sender_profile_pic') for msg in messages])
+    if not variants:
+        return messages
+    for msg in messages:
+        variant = variants.get(msg['media_url'])
+        if variant:
+            msg['media_original_url'] = msg['media_url']
+            msg['media_url'] = variant['thumbnail_url']
+            msg['media_width'] = variant['width']
+            msg['media_height'] = variant['height']
+            msg['media_placeholder'] = variant['placeholder']
+        avatar = variants.get(msg.get('sender_profile_pic'))
+        if avatar:
+            msg['sender_profile_pic'] = avatar['thumbnail_url']
+    return messages
+
+
+def hydrate_rows(conn, rows, is_private=False, full_media=False):
+    """Messages prêts à envoyer pour des lignes déjà lues (ou un message qui vient d'être envoyé)"""
+    parent_ids = [row['parent_message_id'] for row in rows if row['parent_message_id']]
+    parents = _rows.get_many(conn, parent_ids, is_private) if parent_ids else {}
+    users = user_cache.get_user_summaries(
+        conn, [row['sender_id'] for row in rows] + [parent['sender_id'] for parent in parents.values()])
+    reactions = reaction_summaries.reactions_for(conn, [row['id'] for row in rows], is_private)
+
+    messages = []
+    for row in rows:
+        sender = users.get(row['sender_id'])
+        if not sender:
+            continue
+        message = {
+            'id': row['id'],
+            'sender_id': row['sender_id'],
+            'content': row['content'] or '',
+            'media_url': row['media_url'],
+            'file_type': row['file_type'],
+            'voice_message_url': row['voice_message_url'],
+            'parent_message_id': row['parent_message_id'],
+            'timestamp': format_timestamp(row['timestamp']),
+            'sender_username': sender['username'],
+            'sender_profile_pic': sender['profile_picture_url'] or DEFAULT_PROFILE_PICTURE,
+            'reactions': reactions.get(row['id']),
+        }
+        if is_private:
+            message['receiver_id'] = row['receiver_id']
+        else:
+            message['room_id'] = row['room_id']
+            message['is_pinned'] = bool(row['is_pinned'])
+        parent = parents.get(row['parent_message_id'])
+        if parent:
+            message['parent_content'] = parent['content']
+            message['parent_username'] = users.get(parent['sender_id'], {}).get('username')
+        messages.append(message)
+
+    apply_media_variants(conn, messages, full=full_media)
+    apply_voice_notes(conn, messages)
+    return [{key: value for key, value in message.items() if value is not None} for message in messages]
+
+
+def hydrate(conn, message_ids, is_private=False, full_media=False):
+    """Messages prêts à envoyer, dans l'ordre des ids (messages supprimés omis)"""
+    if not message_ids:
+        return []
+    rows = _rows.get_many(conn, message_ids, is_private)
+    return hydrate_rows(conn, [rows[message_id] for message_id in message_ids if message_id in rows],
+                        is_private, full_media)
+
+
+def invalidate(message_id, is_private=False):
+    _rows.invalidate(message_id, is_private)
+
+
+def clear():
+    _rows.clear()
+
+
+def stats():
+    return _rows.stats()
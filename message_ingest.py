@@ -0,0 +1,341 @@
+"""Écriture différée (write-behind) des messages de salon.
+
+Activée par MESSAGE_WRITE_BEHIND=1. handle_send_message reçoit un id
+pré-alloué, diffuse immédiatement, et le message est inséré plus tard avec
+les autres dans un INSERT multi-lignes (par lots de MESSAGE_BATCH_SIZE ou
+toutes les MESSAGE_FLUSH_INTERVAL secondes).
+
+Chaque message est d'abord ajouté à un journal local (un fichier JSON par
+ligne). Après un crash, les journaux restants sont rejoués au démarrage;
+l'insertion est idempotente (INSERT OR IGNORE sur l'id pré-alloué). Un
+segment reste verrouillé (flock) jusqu'à ce que son lot soit validé et le
+fichier supprimé, y compris après un échec: un autre worker qui démarre ne
+rejoue que les journaux des processus disparus.
+
+Les méthodes qui touchent la base prennent la connexion de l'appelant (celle
+de la requête ou de l'événement Socket.IO); sans connexion elles en empruntent
+une au pool avant de prendre leurs verrous. Elles valident leur travail
+(bloc d'ids sous SQLite, lot): l'appelant les appelle avant ses propres
+écritures, ce qui est vérifié sous SQLite.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import db_pool
+import db_query
+import media_store
+import message_search
+import message_stats
+import room_activity
+
+MESSAGE_WRITE_BEHIND = os.environ.get('MESSAGE_WRITE_BEHIND', '0') == '1'
+MESSAGE_BATCH_SIZE = int(os.environ.get('MESSAGE_BATCH_SIZE', 100))
+MESSAGE_FLUSH_INTERVAL = float(os.environ.get('MESSAGE_FLUSH_INTERVAL', 0.2))
+MESSAGE_ID_BLOCK = int(os.environ.get('MESSAGE_ID_BLOCK', 100))
+MESSAGE_JOURNAL_DIR = os.environ.get('MESSAGE_JOURNAL_DIR', 'message_journal')
+# fsync à chaque message: survit à une coupure machine, pas seulement à un crash du processus
+MESSAGE_JOURNAL_FSYNC = os.environ.get('MESSAGE_JOURNAL_FSYNC', '0') == '1'
+
+COLUMNS = ('id', 'room_id', 'sender_id', 'content', 'media_url', 'file_type',
+           'voice_message_url', 'parent_message_id', 'timestamp')
+
+
+def require_no_pending_writes(conn):
+    """Refuser une connexion portant des écritures non validées: le commit du bloc d'ids
+    ou du lot les validerait avec lui (SQLite; sous PostgreSQL nextval ne valide rien)"""
+    if getattr(conn, 'in_transaction', False):
+        raise RuntimeError("Écritures non validées sur la connexion: appeler l'écriture différée avant")
+
+
+def reserve_message_ids(conn, count):
+    """Réserver un bloc d'ids consécutifs dans la séquence de messages"""
+    if db_query.dialect_of(conn) == db_query.POSTGRESQL:
+        # nextval est hors transaction: rien à valider sur la connexion de l'appelant
+        rows = conn.execute("SELECT nextval(pg_get_serial_sequence('messages', 'id')) AS id "
+                            "FROM generate_series(1, ?)", (count,)).fetchall()
+        return [row['id'] for row in rows]
+
+    require_no_pending_writes(conn)
+    # SQLite AUTOINCREMENT: avancer sqlite_sequence réserve le bloc pour tous les processus
+    updated = conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT COALESCE(MAX(id), 0) FROM messages)) + ? "
+                           "WHERE name = 'messages'", (count,)).rowcount
+    if not updated:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) "
+                     "VALUES ('messages', (SELECT COALESCE(MAX(id), 0) FROM messages) + ?)", (count,))
+    last = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()[0]
+    conn.commit()
+    return list(range(last - count + 1, last + 1))
+
+
+def insert_messages(conn, records):
+    """INSERT multi-lignes idempotent d'un lot de messages"""
+    placeholders = '(' + ', '.join(['?'] * len(COLUMNS)) + ')'
+    sql = (f"INSERT OR IGNORE INTO messages ({', '.join(COLUMNS)}) VALUES "
+           + ', '.join([placeholders] * len(records)))
+    params = []
+    for record in records:
+        params.extend(record[column] for column in COLUMNS)
+    conn.execute(sql, params)
+
+
+class MessageIngest:
+    """File d'attente journalisée des messages à insérer par lots"""
+
+    def __init__(self, journal_dir=MESSAGE_JOURNAL_DIR, batch_size=MESSAGE_BATCH_SIZE,
+                 flush_interval=MESSAGE_FLUSH_INTERVAL, id_block=MESSAGE_ID_BLOCK,
+                 fsync=MESSAGE_JOURNAL_FSYNC):
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block = id_block
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._pending_ids = set()
+        # Segments (fichier ouvert et verrouillé, chemin) dont le lot a échoué:
+        # supprimés au prochain vidage réussi
+        self._failed_segments = []
+        self._ids = []
+        self._journal = None
+        self._journal_path = None
+        self._segment = 0
+        self._started = False
+        self._sleep = time.sleep
+
+        # Métriques
+        self.submitted = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+
+    def _connection(self):
+        return db_query.connect(db_pool.get_pool().connection())
+
+    def _open_segment(self):
+        self._segment += 1
+        self._journal_path = os.path.join(
+            self.journal_dir, f"messages-{os.getpid()}-{int(time.time() * 1000)}-{self._segment}.journal")
+        self._journal = open(self._journal_path, 'a', encoding='utf-8')
+        fcntl.flock(self._journal.fileno(), fcntl.LOCK_EX)
+
+    def start(self, start_background_task, sleep=time.sleep, conn=None):
+        """Rejouer les journaux orphelins puis lancer la tâche de vidage périodique (idempotent)"""
+        if self._started:
+            return
+        own = conn is None
+        if own:
+            conn = self._connection()
+        try:
+            with self._flush_lock:
+                if self._started:
+                    return
+                os.makedirs(self.journal_dir, exist_ok=True)
+                self.recover(conn)
+                with self._lock:
+                    self._open_segment()
+                self._started = True
+        finally:
+            if own:
+                conn.close()
+        self._sleep = sleep
+        start_background_task(self._run)
+        atexit.register(self.close)
+
+    def recover(self, conn):
+        """Insérer les messages des journaux laissés par un arrêt brutal"""
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, '*.journal'))):
+            try:
+                journal = open(path, encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with journal:
+                try:
+                    fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Segment d'un worker vivant
+                    continue
+                if os.fstat(journal.fileno()).st_nlink == 0:
+                    # Lot validé et fichier supprimé entre l'ouverture et le verrou
+                    continue
+                records = []
+                for line in journal:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Dernière ligne tronquée par le crash
+                        continue
+                if records:
+                    # Le segment a pu être inséré juste avant l'arrêt: seuls les
+                    # messages absents sont insérés, indexés et comptés
+                    ids = [record['id'] for record in records]
+                    existing = set()
+                    for start in range(0, len(ids), self.batch_size):
+                        chunk = ids[start:start + self.batch_size]
+                        rows = conn.execute(f"SELECT id FROM messages WHERE id IN ({','.join(['?'] * len(chunk))})",
+                                            chunk).fetchall()
+                        existing.update(row['id'] for row in rows)
+                    try:
+                        self._store(conn, [record for record in records if record['id'] not in existing])
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    print(f"♻️ {len(records)} message(s) rejoué(s) depuis {os.path.basename(path)}")
+                # Supprimé avant de rendre le verrou (fermeture du fichier)
+                os.remove(path)
+
+    def _next_id(self, conn):
+        if not self._ids:
+            # Connexion de l'appelant: jamais d'emprunt au pool sous self._lock
+            self._ids = reserve_message_ids(conn, self.id_block)
+        return self._ids.pop(0)
+
+    def submit(self, conn, room_id, sender_id, content, media_url, file_type, voice_message_url, parent_message_id):
+        """Journaliser un message et renvoyer son id pré-alloué"""
+        with self._lock:
+            record = {
+                'id': self._next_id(conn),
+                'room_id': room_id,
+                'sender_id': sender_id,
+                'content': content,
+                'media_url': media_url,
+                'file_type': file_type,
+                'voice_message_url': voice_message_url,
+                'parent_message_id': parent_message_id,
+                # Même format et même fuseau (UTC) que CURRENT_TIMESTAMP
+                'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            self._journal.write(json.dumps(record) + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._buffer.append(record)
+            self._pending_ids.add(record['id'])
+            self.submitted += 1
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            try:
+                self.flush(conn)
+            except Exception as e:
+                # Message journalisé et lot remis en file: _run réessaiera, l'envoi est accepté
+                print(f"⚠️ Vidage immédiat reporté: {e}")
+        return record
+
+    def is_pending(self, message_id):
+        return message_id in self._pending_ids
+
+    def _store(self, conn, records):
+        """Insérer des messages par lots, puis index de recherche, compteurs d'activité et références des médias"""
+        if not records:
+            return
+        for start in range(0, len(records), self.batch_size):
+            insert_messages(conn, records[start:start + self.batch_size])
+            self.batches += 1
+        message_search.index_messages(conn, [(record['id'], record['room_id'], record['content']) for record in records])
+        activity = {}
+        for record in records:
+            key = (record['room_id'], room_activity.bucket_of(record['timestamp']))
+            activity[key] = activity.get(key, 0) + 1
+        room_activity.record_messages(conn, activity)
+        message_stats.record_room_messages(
+            conn, [(record['room_id'], record['sender_id'], message_stats.day_of(record['timestamp'])) for record in records])
+        media_store.retain(conn, [record['media_url'] for record in records])
+
+    def flush(self, conn=None):
+        """Insérer tout ce qui est en attente (appelé aussi avant lecture/suppression)"""
+        if not self._buffer:
+            return 0
+        own = conn is None
+        if own:
+            conn = self._connection()
+        try:
+            require_no_pending_writes(conn)
+            return self._flush(conn)
+        finally:
+            if own:
+                conn.close()
+
+    def _flush(self, conn):
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                batch, self._buffer = self._buffer, []
+                # Le segment reste ouvert (verrouillé) jusqu'à sa suppression
+                journal, journal_path = self._journal, self._journal_path
+                self._open_segment()
+
+            try:
+                self._store(conn, batch)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                self.failures += 1
+                print(f"❌ Écriture différée des messages échouée (journal conservé): {e}")
+                # Le segment reste sur disque, verrouillé, et ne sera rejoué qu'après
+                # la fin du processus; on remet le lot en file pour la prochaine tentative.
+                with self._lock:
+                    self._buffer[:0] = batch
+                self._failed_segments.append((journal, journal_path))
+                raise
+
+            for segment, path in self._failed_segments + [(journal, journal_path)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                segment.close()
+            self._failed_segments = []
+            with self._lock:
+                self._pending_ids.difference_update(record['id'] for record in batch)
+            self.flushed += len(batch)
+            return len(batch)
+
+    def close(self):
+        """Vider la file et supprimer le segment courant (arrêt propre)"""
+        self.flush()
+        with self._lock:
+            if self._journal is not None:
+                os.remove(self._journal_path)
+                self._journal.close()
+                self._journal = None
+
+    def _run(self):
+        while True:
+            self._sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._buffer)
+        return {
+            'enabled': True,
+            'pending': pending,
+            'submitted': self.submitted,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failures': self.failures,
+            'avg_batch_size': round(self.flushed / self.batches, 1) if self.batches else 0.0,
+        }
+
+
+_ingest = None
+
+
+def get_ingest():
+    """Pipeline du processus, ou None si l'écriture différée est désactivée"""
+    global _ingest
+    if MESSAGE_WRITE_BEHIND and _ingest is None:
+        _ingest = MessageIngest()
+    return _ingest
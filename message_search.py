@@ -0,0 +1,248 @@
+"""Recherche plein texte dans les messages de salon et les messages privés.
+
+SQLite: tables FTS5 sans contenu (messages_fts, private_messages_fts) tenues
+à jour par l'application à chaque insertion et avant chaque suppression
+(index_* / forget_*). Une colonne `scope` y indexe le salon (r<id>) ou la
+paire d'une conversation (c<id>x<id>): la recherche dans un salon ou une
+conversation est une intersection de listes dans l'index au lieu d'une
+jointure sur tous les résultats.
+PostgreSQL: colonne générée search_vector (tsvector) indexée en GIN,
+maintenue par la base; les fonctions d'indexation n'y font rien.
+
+Les accents sont ignorés des deux côtés (remove_diacritics pour FTS5,
+translate() pour PostgreSQL, l'extension unaccent n'étant pas toujours
+disponible). Les résultats sont classés par pertinence (bm25 / ts_rank_cd)
+parmi les SEARCH_RANK_WINDOW correspondances les plus récentes, puis
+paginés par curseur (score, id). Les extraits sont calculés pour la page
+seulement, termes trouvés entourés de <mark>.
+"""
+import html
+import os
+import re
+import unicodedata
+
+import db_query
+
+# Configuration de recherche PostgreSQL (colonne search_vector et requêtes)
+SEARCH_CONFIG = 'french'
+SEARCH_MAX_TERMS = 8
+# Un mot très courant correspond à une grande partie de l'historique: seules
+# les correspondances les plus récentes sont classées
+SEARCH_RANK_WINDOW = int(os.environ.get('SEARCH_RANK_WINDOW', 1000))
+SNIPPET_WORDS = 24
+
+_ACCENTS = 'àâäáãåçéèêëíìîïñóòôöõúùûüýÿÀÂÄÁÃÅÇÉÈÊËÍÌÎÏÑÓÒÔÖÕÚÙÛÜÝ'
+_PLAIN = 'aaaaaaceeeeiiiinooooouuuuyyAAAAAACEEEEIIIINOOOOOUUUUY'
+
+# Expression de la colonne générée search_vector (init_and_migrate)
+POSTGRES_SEARCH_VECTOR = (f"to_tsvector('{SEARCH_CONFIG}', "
+                          f"translate(COALESCE(content, ''), '{_ACCENTS}', '{_PLAIN}'))")
+
+# Marqueurs internes des termes trouvés, remplacés par <mark> après échappement HTML
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+_COLUMNS = {
+    'messages': "t.room_id, (SELECT name FROM rooms WHERE id = t.room_id) AS room_name",
+    'private_messages': "t.receiver_id",
+}
+
+# Jeton de portée indexé avec chaque message (SQLite)
+_SCOPE_SQL = {
+    'messages': "'r' || room_id",
+    'private_messages': "'c' || MIN(sender_id, receiver_id) || 'x' || MAX(sender_id, receiver_id)",
+}
+
+
+def room_scope(room_id):
+    return f"r{room_id}"
+
+
+def conversation_scope(user_a, user_b):
+    return f"c{min(user_a, user_b)}x{max(user_a, user_b)}"
+
+
+def parse_query(text):
+    """Termes de recherche (le dernier est cherché comme préfixe)"""
+    return _TERM.findall((text or '').lower())[:SEARCH_MAX_TERMS]
+
+
+def _fold(word):
+    return ''.join(char for char in unicodedata.normalize('NFKD', word.lower())
+                   if not unicodedata.combining(char))
+
+
+def _index(conn, table, rows):
+    """rows: [(id, contenu, portée)]"""
+    if db_query.dialect_of(conn) == db_query.POSTGRESQL:
+        return
+    rows = [row for row in rows if row[1]]
+    if rows:
+        conn.executemany(f"INSERT INTO {table}_fts (rowid, content, scope) VALUES (?, ?, ?)", rows)
+
+
+def _forget(conn, table, where, params):
+    # Table sans contenu: FTS5 a besoin des valeurs indexées, à lire avant le DELETE
+    if db_query.dialect_of(conn) == db_query.POSTGRESQL:
+        return
+    conn.execute(f"""
+        INSERT INTO {table}_fts ({table}_fts, rowid, content, scope)
+        SELECT 'delete', id, content, {_SCOPE_SQL[table]} FROM {table} WHERE {where} AND content <> ''
+    """, params)
+
+
+def index_message(conn, message_id, room_id, content):
+    _index(conn, 'messages', [(message_id, content, room_scope(room_id))])
+
+
+def index_messages(conn, rows):
+    """Indexer un lot de messages de salon: [(id, salon, contenu)]"""
+    _index(conn, 'messages', [(message_id, content, room_scope(room_id))
+                              for message_id, room_id, content in rows])
+
+
+def index_private_message(conn, message_id, sender_id, receiver_id, content):
+    _index(conn, 'private_messages', [(message_id, content, conversation_scope(sender_id, receiver_id))])
+
+
+def forget_message(conn, message_id):
+    _forget(conn, 'messages', "id = ?", (message_id,))
+
+
+def forget_room(conn, room_id):
+    _forget(conn, 'messages', "room_id = ?", (room_id,))
+
+
+def forget_private_message(conn, message_id):
+    _forget(conn, 'private_messages', "id = ?", (message_id,))
+
+
+def rebuild_sql(table):
+    """Remplissage initial de l'index FTS5 depuis l'historique"""
+    return (f"INSERT INTO {table}_fts (rowid, content, scope) "
+            f"SELECT id, content, {_SCOPE_SQL[table]} FROM {table} WHERE content <> ''")
+
+
+def highlight(text):
+    """Extrait en HTML sûr: contenu échappé, termes trouvés dans <mark>"""
+    return (html.escape(text or '')
+            .replace(_MARK_START, '<mark>')
+            .replace(_MARK_END, '</mark>'))
+
+
+def snippet(content, terms):
+    """Extrait d'environ SNIPPET_WORDS mots autour du premier terme trouvé"""
+    exact = {_fold(term) for term in terms[:-1]}
+    prefix = _fold(terms[-1])
+    words = list(_TERM.finditer(content))
+    if not words:
+        return content
+    found = [i for i, word in enumerate(words)
+             if _fold(word.group()) in exact or _fold(word.group()).startswith(prefix)]
+    first = max(0, (found[0] if found else 0) - SNIPPET_WORDS // 4)
+    last = min(len(words), first + SNIPPET_WORDS)
+    truncated = last < len(words)
+    end = words[last].start() if truncated else len(content)
+    parts = ['…' if first else '']
+    position = words[first].start() if first else 0
+    for i in found:
+        if first <= i < last:
+            word = words[i]
+            parts += [content[position:word.start()], _MARK_START, word.group(), _MARK_END]
+            position = word.end()
+    parts += [content[position:end].rstrip() if truncated else content[position:end],
+              '…' if truncated else '']
+    return ''.join(parts)
+
+
+def _search(conn, table, terms, scope, scope_sql, scope_params, limit, after):
+    """scope: jeton de portée FTS5, ou None pour filtrer en SQL (scope_sql, scope_params)"""
+    if not terms:
+        return []
+    postgres = db_query.dialect_of(conn) == db_query.POSTGRESQL
+    cursor_sql, cursor_params = '', ()
+    if after:
+        score = "CAST(? AS real)" if postgres else "?"
+        cursor_sql = f"WHERE score < {score} OR (score = {score} AND id < ?)"
+        cursor_params = (after[0], after[0], after[1])
+
+    # 1) Classement des correspondances les plus récentes: ids et scores seulement
+    if postgres:
+        folded = [_fold(term) for term in terms]
+        expression = ' & '.join(folded[:-1] + [folded[-1] + ':*'])
+        ranked = f"""
+            SELECT t.id, ts_rank_cd(t.search_vector, q) AS score
+            FROM {table} t, to_tsquery('{SEARCH_CONFIG}', ?) q
+            WHERE t.search_vector @@ q AND {scope_sql}
+            ORDER BY t.id DESC
+            LIMIT ?
+        """
+        params = (expression,) + tuple(scope_params)
+    else:
+        words = ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+        expression = f"content : ({words})"
+        join_sql, params = '', ()
+        if scope:
+            expression = f"scope : {scope} AND {expression}"
+        else:
+            join_sql = f"JOIN {table} t ON t.id = f.rowid AND {scope_sql}"
+            params = tuple(scope_params)
+        # Poids nul pour la colonne scope: seul le texte compte dans bm25
+        ranked = f"""
+            SELECT f.rowid AS id, -bm25({table}_fts, 1.0, 0.0) AS score
+            FROM {table}_fts f
+            {join_sql}
+            WHERE {table}_fts MATCH ?
+            ORDER BY f.rowid DESC
+            LIMIT ?
+        """
+        params = params + (expression,)
+    hits = conn.execute(f"""
+        SELECT id, score FROM ({ranked}) hits
+        {cursor_sql}
+        ORDER BY score DESC, id DESC
+        LIMIT ?
+    """, params + (SEARCH_RANK_WINDOW,) + cursor_params + (limit,)).fetchall()
+    if not hits:
+        return []
+
+    # 2) Contenu et extrait de la page seulement
+    ids = [hit['id'] for hit in hits]
+    rows = conn.execute(f"""
+        SELECT t.id, t.sender_id, t.content, {_COLUMNS[table]},
+               strftime('%d/%m/%Y %H:%M', t.timestamp) AS timestamp
+        FROM {table} t
+        WHERE t.id IN ({','.join(['?'] * len(ids))})
+    """, ids).fetchall()
+    by_id = {row['id']: dict(row) for row in rows}
+
+    results = []
+    for hit in hits:
+        row = by_id.get(hit['id'])
+        if row:
+            row['highlight'] = highlight(snippet(row['content'] or '', terms))
+            row['score'] = hit['score']
+            results.append(row)
+    return results
+
+
+def search_room(conn, room_id, terms, limit, after=None):
+    """Messages d'un salon. after: (score, id) du dernier résultat de la page précédente"""
+    return _search(conn, 'messages', terms, room_scope(room_id),
+                   "t.room_id = ?", (room_id,), limit, after)
+
+
+def search_user_rooms(conn, user_id, terms, limit, after=None):
+    """Messages de tous les salons dont l'utilisateur est membre"""
+    return _search(conn, 'messages', terms, None,
+                   "t.room_id IN (SELECT room_id FROM room_members WHERE user_id = ?)",
+                   (user_id,), limit, after)
+
+
+def search_conversation(conn, user_id, other_user_id, terms, limit, after=None):
+    """Messages privés échangés entre deux utilisateurs"""
+    return _search(conn, 'private_messages', terms, conversation_scope(user_id, other_user_id),
+                   "((t.sender_id = ? AND t.receiver_id = ?) OR (t.sender_id = ? AND t.receiver_id = ?))",
+                   (user_id, other_user_id, other_user_id, user_id), limit, after)
@@ -0,0 +1,239 @@
+"""Compteurs journaliers des messages pour les tableaux de bord (/api/room_stats,
+/api/global_stats, /api/user_activity).
+
+Ces routes regroupaient à chaque appel tout l'historique récent par
+DATE(timestamp), et `DATE(timestamp) = DATE('now')` ne peut pas utiliser
+l'index (room_id, timestamp). Les compteurs sont maintenant tenus à jour dans
+la transaction qui insère ou supprime le message, par jour UTC (nombre de
+jours depuis l'epoch), et remplis depuis l'historique une seule fois, à la
+création des tables (backfill):
+
+- room_daily_stats (salon, jour): messages par jour, total et salon le plus
+  actif. Conservé sans limite (une ligne par jour d'activité du salon);
+- sender_daily_stats (salon, expéditeur, jour): meilleurs contributeurs et
+  membres actifs du jour (nombre exact de lignes, sans estimation);
+- user_daily_stats (utilisateur, jour): messages de salon et privés envoyés.
+
+Les deux dernières ne gardent que STATS_RETENTION_DAYS jours, la plus
+longue fenêtre lue. Les compteurs par heure restent dans room_activity.
+"""
+import time
+from datetime import datetime, timezone
+
+# Jours conservés dans sender_daily_stats et user_daily_stats (fenêtres lues: 30 jours)
+STATS_RETENTION_DAYS = 35
+
+_ROOM_UPSERT_SQL = """
+    INSERT INTO room_daily_stats (room_id, day, message_count) VALUES (?, ?, ?)
+    ON CONFLICT (room_id, day) DO UPDATE SET
+        message_count = room_daily_stats.message_count + excluded.message_count
+"""
+
+_SENDER_UPSERT_SQL = """
+    INSERT INTO sender_daily_stats (room_id, sender_id, day, message_count) VALUES (?, ?, ?, ?)
+    ON CONFLICT (room_id, sender_id, day) DO UPDATE SET
+        message_count = sender_daily_stats.message_count + excluded.message_count
+"""
+
+_USER_UPSERT_SQL = """
+    INSERT INTO user_daily_stats (user_id, day, room_messages, private_messages) VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        room_messages = user_daily_stats.room_messages + excluded.room_messages,
+        private_messages = user_daily_stats.private_messages + excluded.private_messages
+"""
+
+_last_prune = None
+
+
+def current_day():
+    return int(time.time() // 86400)
+
+
+def day_of(timestamp):
+    """Jour d'un horodatage 'YYYY-MM-DD HH:MM:SS' (UTC, comme CURRENT_TIMESTAMP)"""
+    moment = datetime.strptime(str(timestamp)[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() // 86400)
+
+
+def date_of(day):
+    """'YYYY-MM-DD' d'un jour"""
+    return datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d')
+
+
+def window_start(days):
+    """Premier jour d'une fenêtre de `days` jours (aujourd'hui inclus)"""
+    return current_day() - days + 1
+
+
+def _prune(conn):
+    global _last_prune
+    day = current_day()
+    if _last_prune != day:
+        cutoff = day - STATS_RETENTION_DAYS
+        conn.execute("DELETE FROM sender_daily_stats WHERE day < ?", (cutoff,))
+        conn.execute("DELETE FROM user_daily_stats WHERE day < ?", (cutoff,))
+        _last_prune = day
+
+
+def _apply(conn, rooms, senders, users):
+    if rooms:
+        conn.executemany(_ROOM_UPSERT_SQL, [(room_id, day, count) for (room_id, day), count in rooms.items()])
+    if senders:
+        conn.executemany(_SENDER_UPSERT_SQL, [(room_id, sender_id, day, count)
+                                              for (room_id, sender_id, day), count in senders.items()])
+    if users:
+        conn.executemany(_USER_UPSERT_SQL, [(user_id, day, room_count, private_count)
+                                            for (user_id, day), (room_count, private_count) in users.items()])
+    _prune(conn)
+
+
+def record_room_messages(conn, messages):
+    """Ajouter des messages de salon: [(room_id, sender_id, jour)]"""
+    rooms, senders, users = {}, {}, {}
+    for room_id, sender_id, day in messages:
+        rooms[(room_id, day)] = rooms.get((room_id, day), 0) + 1
+        senders[(room_id, sender_id, day)] = senders.get((room_id, sender_id, day), 0) + 1
+        room_count, private_count = users.get((sender_id, day), (0, 0))
+        users[(sender_id, day)] = (room_count + 1, private_count)
+    _apply(conn, rooms, senders, users)
+
+
+def record_room_message(conn, room_id, sender_id):
+    record_room_messages(conn, [(room_id, sender_id, current_day())])
+
+
+def record_private_message(conn, sender_id):
+    _apply(conn, {}, {}, {(sender_id, current_day()): (0, 1)})
+
+
+def forget_room_message(conn, room_id, sender_id, timestamp):
+    day = day_of(timestamp)
+    conn.execute("""
+        UPDATE room_daily_stats SET message_count = message_count - 1
+        WHERE room_id = ? AND day = ? AND message_count > 0
+    """, (room_id, day))
+    conn.execute("""
+        UPDATE sender_daily_stats SET message_count = message_count - 1
+        WHERE room_id = ? AND sender_id = ? AND day = ? AND message_count > 0
+    """, (room_id, sender_id, day))
+    conn.execute("""
+        UPDATE user_daily_stats SET room_messages = room_messages - 1
+        WHERE user_id = ? AND day = ? AND room_messages > 0
+    """, (sender_id, day))
+
+
+def forget_private_message(conn, sender_id, timestamp):
+    conn.execute("""
+        UPDATE user_daily_stats SET private_messages = private_messages - 1
+        WHERE user_id = ? AND day = ? AND private_messages > 0
+    """, (sender_id, day_of(timestamp)))
+
+
+def forget_room(conn, room_id):
+    """Tous les messages d'un salon sont supprimés (salon supprimé ou vidé)"""
+    rows = conn.execute("SELECT sender_id, day, message_count FROM sender_daily_stats WHERE room_id = ?",
+                        (room_id,)).fetchall()
+    conn.executemany("""
+        UPDATE user_daily_stats SET room_messages = CASE WHEN room_messages > ? THEN room_messages - ? ELSE 0 END
+        WHERE user_id = ? AND day = ?
+    """, [(row['message_count'], row['message_count'], row['sender_id'], row['day']) for row in rows])
+    conn.execute("DELETE FROM sender_daily_stats WHERE room_id = ?", (room_id,))
+    conn.execute("DELETE FROM room_daily_stats WHERE room_id = ?", (room_id,))
+
+
+def room_stats(conn, room_id):
+    """Messages par jour (7 jours), meilleurs contributeurs (30 jours), total et actifs du jour"""
+    per_day = conn.execute("""
+        SELECT day, message_count FROM room_daily_stats
+        WHERE room_id = ? AND day >= ? AND message_count > 0
+        ORDER BY day
+    """, (room_id, window_start(7))).fetchall()
+    top_users = conn.execute("""
+        SELECT u.username, SUM(s.message_count) AS message_count
+        FROM sender_daily_stats s
+        JOIN users u ON u.id = s.sender_id
+        WHERE s.room_id = ? AND s.day >= ?
+        GROUP BY u.id, u.username
+        HAVING SUM(s.message_count) > 0
+        ORDER BY message_count DESC
+        LIMIT 5
+    """, (room_id, window_start(30))).fetchall()
+    total = conn.execute("SELECT COALESCE(SUM(message_count), 0) FROM room_daily_stats WHERE room_id = ?",
+                         (room_id,)).fetchone()[0]
+    active_today = conn.execute("""
+        SELECT COUNT(*) FROM sender_daily_stats
+        WHERE room_id = ? AND day = ? AND message_count > 0
+    """, (room_id, current_day())).fetchone()[0]
+    return {
+        'messages_per_day': [{'date': date_of(row['day']), 'count': row['message_count']} for row in per_day],
+        'top_users': [{'username': row['username'], 'message_count': row['message_count']} for row in top_users],
+        'total_messages': total,
+        'active_today': active_today,
+    }
+
+
+def user_counts(conn, user_id, days=7):
+    """(messages de salon, messages privés) envoyés sur `days` jours"""
+    row = conn.execute("""
+        SELECT COALESCE(SUM(room_messages), 0), COALESCE(SUM(private_messages), 0)
+        FROM user_daily_stats
+        WHERE user_id = ? AND day >= ?
+    """, (user_id, window_start(days))).fetchone()
+    return row[0], row[1]
+
+
+def messages_today(conn):
+    return conn.execute("SELECT COALESCE(SUM(message_count), 0) FROM room_daily_stats WHERE day = ?",
+                        (current_day(),)).fetchone()[0]
+
+
+def top_room(conn, days=7):
+    """Salon le plus actif sur `days` jours: {'name', 'msg_count'} ou None"""
+    row = conn.execute("""
+        SELECT r.name, SUM(s.message_count) AS msg_count
+        FROM room_daily_stats s
+        JOIN rooms r ON r.id = s.room_id
+        WHERE s.day >= ?
+        GROUP BY r.id, r.name
+        HAVING SUM(s.message_count) > 0
+        ORDER BY msg_count DESC
+        LIMIT 1
+    """, (window_start(days),)).fetchone()
+    return {'name': row['name'], 'msg_count': row['msg_count']} if row else None
+
+
+def recount(conn):
+    """Recalcul complet (maintenance, application arrêtée: les incréments concurrents seraient perdus)"""
+    for table in ('room_daily_stats', 'sender_daily_stats', 'user_daily_stats'):
+        conn.execute(f"DELETE FROM {table}")
+    backfill(conn)
+
+
+def backfill(conn):
+    """Reconstruire les compteurs depuis l'historique (tables vides)"""
+    cutoff = current_day() - STATS_RETENTION_DAYS
+    rooms, senders, users = {}, {}, {}
+    rows = conn.execute("""
+        SELECT room_id, sender_id, DATE(timestamp) AS date, COUNT(*) AS message_count
+        FROM messages
+        GROUP BY room_id, sender_id, DATE(timestamp)
+    """).fetchall()
+    for row in rows:
+        day = day_of(f"{row['date']} 00:00:00")
+        rooms[(row['room_id'], day)] = rooms.get((row['room_id'], day), 0) + row['message_count']
+        if day >= cutoff:
+            senders[(row['room_id'], row['sender_id'], day)] = row['message_count']
+            room_count, private_count = users.get((row['sender_id'], day), (0, 0))
+            users[(row['sender_id'], day)] = (room_count + row['message_count'], private_count)
+    rows = conn.execute(f"""
+        SELECT sender_id, DATE(timestamp) AS date, COUNT(*) AS message_count
+        FROM private_messages
+        WHERE timestamp >= datetime('now', '-{STATS_RETENTION_DAYS + 1} days')
+        GROUP BY sender_id, DATE(timestamp)
+    """).fetchall()
+    for row in rows:
+        day = day_of(f"{row['date']} 00:00:00")
+        if day >= cutoff:
+            room_count, private_count = users.get((row['sender_id'], day), (0, 0))
+            users[(row['sender_id'], day)] = (room_count, private_count + row['message_count'])
+    _apply(conn, rooms, senders, users)
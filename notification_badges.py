@@ -0,0 +1,72 @@
+"""Pastilles de notification par utilisateur (table user_badges).
+
+Une ligne par utilisateur: demandes d'amis en attente et messages privés
+non lus. Les compteurs sont ajustés dans la transaction qui crée ou traite
+la demande, envoie ou lit le message; après le commit, la nouvelle valeur et
+la variation sont poussées sur le salon Socket.IO user_{id} (événement
+'badges'). Un chargement de page lit une seule ligne (/api/badges) au lieu
+de compter les demandes et les messages non lus.
+
+apply() écrit dans la transaction de l'appelant: une erreur avant le commit
+annule aussi l'ajustement (rollback au retour de la connexion au pool). Les
+appelants ne comptent que les lignes qu'ils ont réellement modifiées
+(rowcount). La table est remplie une seule fois, à sa création (BACKFILL_SQL).
+"""
+
+BADGES = ('friend_requests', 'unread_messages')
+
+_ADJUST_SQL = """
+    INSERT INTO user_badges (user_id, friend_requests, unread_messages)
+    VALUES (?, CASE WHEN ? > 0 THEN ? ELSE 0 END, CASE WHEN ? > 0 THEN ? ELSE 0 END)
+    ON CONFLICT (user_id) DO UPDATE SET
+        friend_requests = CASE WHEN user_badges.friend_requests + ? > 0
+                               THEN user_badges.friend_requests + ? ELSE 0 END,
+        unread_messages = CASE WHEN user_badges.unread_messages + ? > 0
+                               THEN user_badges.unread_messages + ? ELSE 0 END
+"""
+
+# Construction depuis friend_requests et l'index des conversations (table vide, à sa création)
+BACKFILL_SQL = """
+    INSERT INTO user_badges (user_id, friend_requests, unread_messages)
+    SELECT user_id, SUM(friend_requests), SUM(unread_messages) FROM (
+        SELECT receiver_id AS user_id, COUNT(*) AS friend_requests, 0 AS unread_messages
+        FROM friend_requests WHERE status = 'pending' GROUP BY receiver_id
+        UNION ALL
+        SELECT user_id, 0, SUM(unread_count) FROM conversations WHERE unread_count > 0 GROUP BY user_id
+    ) counts
+    GROUP BY user_id
+"""
+
+# Recalcul complet (maintenance, application arrêtée: les ajustements concurrents seraient perdus)
+RECOUNT_SQL = ("DELETE FROM user_badges", BACKFILL_SQL)
+
+
+class BadgeChanges:
+    """Variations accumulées pendant une transaction, publiées après le commit"""
+
+    def __init__(self):
+        self.changes = {}
+
+    def add(self, user_id, badge, delta):
+        if user_id and delta:
+            user_changes = self.changes.setdefault(user_id, {})
+            user_changes[badge] = user_changes.get(badge, 0) + delta
+
+    def apply(self, conn):
+        """Ajuster les compteurs en base (avant le commit)"""
+        for user_id, user_changes in self.changes.items():
+            friend_requests = user_changes.get('friend_requests', 0)
+            unread_messages = user_changes.get('unread_messages', 0)
+            conn.execute(_ADJUST_SQL, (user_id, friend_requests, friend_requests, unread_messages, unread_messages,
+                                       friend_requests, friend_requests, unread_messages, unread_messages))
+
+    def publish(self, conn, socketio):
+        """Pousser les nouveaux compteurs et leur variation à chaque utilisateur (après le commit)"""
+        for user_id, user_changes in self.changes.items():
+            socketio.emit('badges', {'badges': get(conn, user_id), 'changes': user_changes}, to=f'user_{user_id}')
+
+
+def get(conn, user_id):
+    row = conn.execute("SELECT friend_requests, unread_messages FROM user_badges WHERE user_id = ?",
+                       (user_id,)).fetchone()
+    return {badge: (row[badge] if row else 0) for badge in BADGES}
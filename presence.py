@@ -0,0 +1,243 @@
+"""Présence en ligne: état en mémoire, écritures groupées, diffusion ciblée.
+
+Chaque connexion Socket.IO ne touche que la mémoire du processus (sockets
+ouverts par utilisateur). Une tâche de fond, toutes les
+PRESENCE_FLUSH_INTERVAL secondes:
+
+- passe hors ligne, pour ce processus, les utilisateurs sans socket depuis
+  PRESENCE_OFFLINE_GRACE secondes (navigation entre pages, reconnexions:
+  aucun changement visible);
+- tient à jour presence_sessions, une ligne par utilisateur et par processus
+  qui lui connaît au moins un socket, et rafraîchit ces lignes et last_active
+  toutes les PRESENCE_HEARTBEAT secondes;
+- envoie user_status_changed aux amis, aux interlocuteurs privés et aux
+  salons de l'utilisateur, au lieu de tous les sockets connectés.
+
+Un utilisateur est en ligne tant qu'il lui reste une ligne, quel que soit le
+processus ou la machine: un socket fermé sur un worker ne le fait pas passer
+hors ligne s'il en garde un sur un autre. Chaque changement est fait sous le
+verrou de sa ligne user_activity; seul le processus qui fait apparaître la
+première ligne ou disparaître la dernière notifie, et recopie l'état dans
+user_activity.is_online. Les lignes d'un processus arrêté brutalement
+expirent après PRESENCE_STALE_AFTER secondes sans battement de cœur.
+"""
+import os
+import threading
+import time
+import uuid
+
+import db_pool
+import db_query
+
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', 1.0))
+PRESENCE_OFFLINE_GRACE = float(os.environ.get('PRESENCE_OFFLINE_GRACE', 5.0))
+PRESENCE_HEARTBEAT = float(os.environ.get('PRESENCE_HEARTBEAT', 60.0))
+PRESENCE_STALE_AFTER = int(os.environ.get('PRESENCE_STALE_AFTER', 3 * PRESENCE_HEARTBEAT))
+
+
+def status_audience(conn, user_id):
+    """Salons Socket.IO concernés par le statut d'un utilisateur"""
+    users = conn.execute("""
+        SELECT friend_id AS id FROM friends WHERE user_id = ?
+        UNION
+        SELECT other_user_id AS id FROM conversations WHERE user_id = ?
+    """, (user_id, user_id)).fetchall()
+    rooms = conn.execute("SELECT room_id FROM room_members WHERE user_id = ?", (user_id,)).fetchall()
+    return ([f"user_{row['id']}" for row in users if row['id'] != user_id]
+            + [f"room_{row['room_id']}" for row in rooms])
+
+
+class PresenceService:
+    """Suivi des sockets par utilisateur et publication des changements de statut"""
+
+    def __init__(self, socketio, flush_interval=PRESENCE_FLUSH_INTERVAL,
+                 offline_grace=PRESENCE_OFFLINE_GRACE, heartbeat=PRESENCE_HEARTBEAT,
+                 stale_after=PRESENCE_STALE_AFTER):
+        self.socketio = socketio
+        self.flush_interval = flush_interval
+        self.offline_grace = offline_grace
+        self.heartbeat = heartbeat
+        self.stale_after = int(stale_after)
+        # Identifiant des lignes presence_sessions de ce processus
+        self.node_id = uuid.uuid4().hex
+
+        self._lock = threading.Lock()
+        self._sockets = {}
+        self._offline_at = {}
+        self._changes = {}
+        self._last_heartbeat = time.monotonic()
+        self._started = False
+
+        # Métriques
+        self.connects = 0
+        self.debounced = 0
+        self.notifications = 0
+        self.writes = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def connect(self, user_id, sid):
+        """Nouveau socket: en ligne immédiatement si c'est le premier"""
+        with self._lock:
+            self.connects += 1
+            sockets = self._sockets.setdefault(user_id, set())
+            first = not sockets
+            sockets.add(sid)
+            if first:
+                if self._offline_at.pop(user_id, None) is not None:
+                    # Reconnexion pendant le délai de grâce: rien à signaler
+                    self.debounced += 1
+                else:
+                    self._changes[user_id] = True
+
+    def disconnect(self, user_id, sid):
+        """Socket fermé: hors ligne après le délai de grâce s'il n'en reste aucun"""
+        with self._lock:
+            sockets = self._sockets.get(user_id)
+            if sockets is None:
+                return
+            sockets.discard(sid)
+            if not sockets:
+                del self._sockets[user_id]
+                self._offline_at[user_id] = time.monotonic() + self.offline_grace
+
+    def logout(self, user_id):
+        """Déconnexion explicite: hors ligne sans délai de grâce (sauf sockets ouverts ailleurs)"""
+        with self._lock:
+            self._sockets.pop(user_id, None)
+            self._offline_at.pop(user_id, None)
+            self._changes[user_id] = False
+
+    def is_online(self, user_id):
+        with self._lock:
+            return user_id in self._sockets or user_id in self._offline_at
+
+    def _collect(self):
+        now = time.monotonic()
+        with self._lock:
+            for user_id, deadline in list(self._offline_at.items()):
+                if deadline <= now:
+                    del self._offline_at[user_id]
+                    self._changes[user_id] = False
+            changes, self._changes = self._changes, {}
+
+            heartbeat = None
+            if now - self._last_heartbeat >= self.heartbeat:
+                self._last_heartbeat = now
+                heartbeat = set(self._sockets) | set(self._offline_at)
+        return changes, heartbeat
+
+    def _lock_user(self, conn, user_id):
+        """Verrou de la ligne user_activity jusqu'au commit (PostgreSQL: FOR UPDATE,
+        SQLite: verrou d'écriture): les changements d'un utilisateur sont sérialisés
+        entre processus"""
+        conn.execute("""
+            INSERT INTO user_activity (user_id, last_active, is_online) VALUES (?, CURRENT_TIMESTAMP, ?)
+            ON CONFLICT (user_id) DO NOTHING
+        """, (user_id, False))
+        if getattr(conn, 'is_postgres', False):
+            conn.execute("SELECT user_id FROM user_activity WHERE user_id = ? FOR UPDATE", (user_id,))
+
+    def _has_sessions(self, conn, user_id):
+        return conn.execute("SELECT 1 FROM presence_sessions WHERE user_id = ? LIMIT 1",
+                            (user_id,)).fetchone() is not None
+
+    def _write(self, conn, changes, heartbeat):
+        """Appliquer les changements locaux; retourne {user_id: en ligne} des transitions globales"""
+        stale = set()
+        if heartbeat is not None:
+            present = {row['user_id'] for row in conn.execute(
+                "SELECT user_id FROM presence_sessions WHERE node_id = ?", (self.node_id,)).fetchall()}
+            conn.execute("UPDATE presence_sessions SET updated_at = CURRENT_TIMESTAMP WHERE node_id = ?",
+                         (self.node_id,))
+            conn.executemany("UPDATE user_activity SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?",
+                             [(user_id,) for user_id in heartbeat])
+            # Ligne supprimée ailleurs (expirée pendant une panne de la base): recréée
+            for user_id in heartbeat - present:
+                changes.setdefault(user_id, True)
+            stale = {row['user_id'] for row in conn.execute(f"""
+                SELECT DISTINCT user_id FROM presence_sessions
+                WHERE updated_at < datetime('now', '-{self.stale_after} seconds')
+            """).fetchall()}
+
+        notify = {}
+        # Ordre fixe des verrous: pas d'interblocage entre processus
+        for user_id in sorted(set(changes) | stale):
+            self._lock_user(conn, user_id)
+            before = self._has_sessions(conn, user_id)
+            if user_id in stale:
+                conn.execute(f"""
+                    DELETE FROM presence_sessions
+                    WHERE user_id = ? AND updated_at < datetime('now', '-{self.stale_after} seconds')
+                """, (user_id,))
+            online = changes.get(user_id)
+            if online:
+                conn.execute("""
+                    INSERT INTO presence_sessions (user_id, node_id, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id, node_id) DO UPDATE SET updated_at = excluded.updated_at
+                """, (user_id, self.node_id))
+            elif online is not None:
+                conn.execute("DELETE FROM presence_sessions WHERE user_id = ? AND node_id = ?",
+                             (user_id, self.node_id))
+            after = self._has_sessions(conn, user_id)
+            conn.execute("UPDATE user_activity SET is_online = ?, last_active = CURRENT_TIMESTAMP WHERE user_id = ?",
+                         (after, user_id))
+            if after != before:
+                notify[user_id] = after
+        self.writes += len(changes) + len(stale)
+        return notify
+
+    def flush(self):
+        """Écrire les changements en un lot puis notifier les personnes concernées"""
+        changes, heartbeat = self._collect()
+        if not changes and heartbeat is None:
+            return
+        conn = db_query.connect(db_pool.get_pool().connection())
+        try:
+            try:
+                notify = self._write(conn, dict(changes), heartbeat)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # Changements remis en file (sans écraser un plus récent), battement refait
+                with self._lock:
+                    for user_id, online in changes.items():
+                        self._changes.setdefault(user_id, online)
+                    if heartbeat is not None:
+                        self._last_heartbeat = 0.0
+                raise
+            audiences = {user_id: status_audience(conn, user_id) for user_id in notify}
+        finally:
+            conn.close()
+
+        for user_id, online in notify.items():
+            rooms = audiences[user_id]
+            if rooms:
+                self.socketio.emit('user_status_changed', {'user_id': user_id, 'is_online': online}, to=rooms)
+                self.notifications += 1
+
+    def _run(self):
+        while True:
+            # socketio.sleep: coopératif en mode gevent même sans monkey patch
+            self.socketio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Erreur présence: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'online_users': len(self._sockets) + len(self._offline_at),
+                'sockets': sum(len(s) for s in self._sockets.values()),
+                'pending_offline': len(self._offline_at),
+                'connects': self.connects,
+                'debounced': self.debounced,
+                'notifications': self.notifications,
+                'writes': self.writes,
+            }
@@ -0,0 +1,41 @@
+"""J'aime des profils: compteur dénormalisé users.likes_count.
+
+Le compteur est mis à jour dans la même transaction que l'ajout ou le
+retrait du j'aime, validée par l'appelant (une erreur avant le commit annule
+les deux au retour de la connexion au pool), et recalculé à l'initialisation
+du schéma: la page de profil et le bouton j'aime lisent une colonne au lieu
+de compter user_profile_likes.
+
+Deux bascules concurrentes ne comptent chacune que la ligne qu'elles ont
+réellement supprimée ou insérée (rowcount).
+"""
+
+# Recalcul complet (migration initiale, correction d'une dérive éventuelle)
+RECOUNT_SQL = """
+    UPDATE users SET likes_count = (
+        SELECT COUNT(*) FROM user_profile_likes l WHERE l.liked_user_id = users.id
+    )
+"""
+
+
+def toggle_like(conn, liker_user_id, liked_user_id):
+    """Ajouter ou retirer le j'aime (sans commit). Retourne ('liked' | 'unliked', nouveau total)."""
+    cursor = conn.execute("DELETE FROM user_profile_likes WHERE liker_user_id = ? AND liked_user_id = ?",
+                          (liker_user_id, liked_user_id))
+    if cursor.rowcount == 1:
+        conn.execute("UPDATE users SET likes_count = likes_count - 1 WHERE id = ? AND likes_count > 0",
+                     (liked_user_id,))
+        action = 'unliked'
+    else:
+        cursor = conn.execute("INSERT OR IGNORE INTO user_profile_likes (liker_user_id, liked_user_id) VALUES (?, ?)",
+                              (liker_user_id, liked_user_id))
+        if cursor.rowcount == 1:
+            conn.execute("UPDATE users SET likes_count = likes_count + 1 WHERE id = ?", (liked_user_id,))
+        action = 'liked'
+    row = conn.execute("SELECT likes_count FROM users WHERE id = ?", (liked_user_id,)).fetchone()
+    return action, row['likes_count'] if row else 0
+
+
+def is_liked(conn, liker_user_id, liked_user_id):
+    return conn.execute("SELECT 1 FROM user_profile_likes WHERE liker_user_id = ? AND liked_user_id = ?",
+                        (liker_user_id, liked_user_id)).fetchone() is not None
@@ -0,0 +1,254 @@
+"""Résumés des réactions par message (table reaction_summaries).
+
+handle_add_reaction relisait toutes les réactions du message (GROUP BY emoji,
+GROUP_CONCAT, JOIN users) après chaque bascule, et les historiques refaisaient
+le même regroupement par page (la première seulement). Chaque message a
+maintenant une ligne JSON compacte {emoji: [nombre, [ids d'un échantillon
+d'au plus REACTION_SAMPLE_SIZE utilisateurs]]}, modifiée sur place à chaque
+bascule dans la même transaction que la réaction. La ligne du résumé est
+verrouillée avant de toucher à reactions: les bascules d'un même message
+s'exécutent l'une après l'autre (pas de mise à jour perdue, pas de réaction
+en double). Les résumés sont construits depuis reactions une seule fois, à
+la création de la table (backfill).
+
+Les historiques lisent les résumés par lots à travers un LRU en mémoire
+(REACTION_CACHE_SIZE messages, expiration après REACTION_CACHE_TTL secondes,
+délai de propagation d'une réaction entre workers); les noms de l'échantillon
+viennent de user_cache.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import user_cache
+
+REACTION_CACHE_SIZE = int(os.environ.get('REACTION_CACHE_SIZE', 20000))
+REACTION_CACHE_TTL = float(os.environ.get('REACTION_CACHE_TTL', 30))
+REACTION_SAMPLE_SIZE = 10
+# Plage d'ids de messages lue par requête lors de la construction initiale
+BACKFILL_BLOCK = 5000
+
+_SELECT_SQL = "SELECT summary FROM reaction_summaries WHERE is_private = ? AND message_id = ?"
+
+
+def _decode(text):
+    return json.loads(text) if text else {}
+
+
+def _encode(summary):
+    return json.dumps(summary, ensure_ascii=False, separators=(',', ':'))
+
+
+def _target_column(is_private):
+    return 'private_message_id' if is_private else 'message_id'
+
+
+class ReactionSummaryCache:
+    """LRU + TTL des résumés, indexé par (is_private, message_id); {} pour un message sans réaction"""
+
+    def __init__(self, max_size=REACTION_CACHE_SIZE, ttl=REACTION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métriques
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.toggles = 0
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < now:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _store(self, key, summary, now):
+        self._entries[key] = (now + self.ttl, summary)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, conn, message_ids, is_private=False):
+        """Résumés {message_id: {emoji: [nombre, [user_ids]]}}; une requête pour les absents"""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for message_id in set(message_ids):
+                summary = self._lookup((is_private, message_id), now)
+                if summary is None:
+                    missing.append(message_id)
+                else:
+                    found[message_id] = summary
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            rows = conn.execute(f"""
+                SELECT message_id, summary FROM reaction_summaries
+                WHERE is_private = ? AND message_id IN ({','.join(['?'] * len(missing))})
+            """, [is_private] + missing).fetchall()
+            loaded = {row['message_id']: _decode(row['summary']) for row in rows}
+            with self._lock:
+                for message_id in missing:
+                    summary = loaded.get(message_id, {})
+                    self._store((is_private, message_id), summary, now)
+                    found[message_id] = summary
+        return found
+
+    def toggle(self, conn, user_id, message_id, emoji, is_private=False):
+        """Ajouter ou retirer la réaction de l'utilisateur (sans commit). Retourne le nouveau résumé."""
+        column = _target_column(is_private)
+        # Verrou pris avant toute lecture, gardé jusqu'au commit: l'écriture ouvre le
+        # verrou d'écriture SQLite, FOR UPDATE le verrou de ligne PostgreSQL
+        conn.execute("""
+            INSERT INTO reaction_summaries (is_private, message_id, summary) VALUES (?, ?, '{}')
+            ON CONFLICT (is_private, message_id) DO NOTHING
+        """, (is_private, message_id))
+        select_sql = _SELECT_SQL + (" FOR UPDATE" if getattr(conn, 'is_postgres', False) else "")
+        summary = _decode(conn.execute(select_sql, (is_private, message_id)).fetchone()['summary'])
+
+        removed = conn.execute(f"DELETE FROM reactions WHERE user_id = ? AND {column} = ? AND emoji = ?",
+                               (user_id, message_id, emoji)).rowcount
+        if not removed:
+            conn.execute(f"INSERT INTO reactions (user_id, {column}, emoji) VALUES (?, ?, ?)",
+                         (user_id, message_id, emoji))
+
+        count, sample = summary.get(emoji, [0, []])
+        if removed:
+            count = max(count - removed, 0)
+            if user_id in sample:
+                sample.remove(user_id)
+            if len(sample) < min(count, REACTION_SAMPLE_SIZE):
+                # Échantillon complété par d'autres utilisateurs ayant la même réaction
+                sample = [r['user_id'] for r in conn.execute(f"""
+                    SELECT user_id FROM reactions WHERE {column} = ? AND emoji = ? LIMIT ?
+                """, (message_id, emoji, REACTION_SAMPLE_SIZE)).fetchall()]
+        else:
+            count += 1
+            if len(sample) < REACTION_SAMPLE_SIZE:
+                sample.append(user_id)
+        if count:
+            summary[emoji] = [count, sample]
+        else:
+            summary.pop(emoji, None)
+
+        conn.execute("UPDATE reaction_summaries SET summary = ? WHERE is_private = ? AND message_id = ?",
+                     (_encode(summary), is_private, message_id))
+        with self._lock:
+            self._store((is_private, message_id), summary, time.monotonic())
+            self.toggles += 1
+        return summary
+
+    def invalidate(self, message_id, is_private=False):
+        with self._lock:
+            self._entries.pop((is_private, message_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'toggles': self.toggles,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+_cache = ReactionSummaryCache()
+
+
+def render(conn, summaries):
+    """{message_id: [{'emoji', 'count', 'usernames'}]} pour les clients, noms depuis user_cache"""
+    users = user_cache.get_user_summaries(
+        conn, [user_id for summary in summaries.values() for _, sample in summary.values() for user_id in sample])
+    rendered = {}
+    for message_id, summary in summaries.items():
+        reactions = []
+        for emoji, (count, sample) in summary.items():
+            names = [users[user_id]['username'] for user_id in sample if user_id in users]
+            usernames = ', '.join(names)
+            if count > len(names):
+                usernames += f" et {count - len(names)} autre(s)" if names else f"{count} utilisateur(s)"
+            reactions.append({'emoji': emoji, 'count': count, 'usernames': usernames})
+        if reactions:
+            rendered[message_id] = reactions
+    return rendered
+
+
+def reactions_for(conn, message_ids, is_private=False):
+    """Réactions prêtes à envoyer pour une page de messages"""
+    if not message_ids:
+        return {}
+    return render(conn, _cache.get_many(conn, message_ids, is_private))
+
+
+def toggle(conn, user_id, message_id, emoji, is_private=False):
+    """Basculer une réaction; retourne la liste des réactions du message pour l'événement Socket.IO"""
+    summary = _cache.toggle(conn, user_id, message_id, emoji, is_private)
+    return render(conn, {message_id: summary}).get(message_id, [])
+
+
+def forget_message(conn, message_id, is_private=False):
+    conn.execute("DELETE FROM reaction_summaries WHERE is_private = ? AND message_id = ?",
+                 (is_private, message_id))
+    _cache.invalidate(message_id, is_private)
+
+
+def forget_room(conn, room_id):
+    """Messages d'un salon supprimés (salon supprimé ou vidé)"""
+    conn.execute("""
+        DELETE FROM reaction_summaries
+        WHERE is_private = ? AND message_id IN (SELECT id FROM messages WHERE room_id = ?)
+    """, (False, room_id))
+    _cache.clear()
+
+
+def recount(conn):
+    """Recalcul complet (maintenance, application arrêtée: les bascules concurrentes seraient perdues)"""
+    conn.execute("DELETE FROM reaction_summaries")
+    backfill(conn)
+    _cache.clear()
+
+
+def backfill(conn):
+    """Construire les résumés depuis la table reactions (table vide), par plages d'ids de messages"""
+    for is_private in (False, True):
+        column = _target_column(is_private)
+        last = conn.execute(f"SELECT MAX({column}) FROM reactions").fetchone()[0] or 0
+        for start in range(0, last, BACKFILL_BLOCK):
+            summaries = {}
+            rows = conn.execute(f"""
+                SELECT {column} AS message_id, user_id, emoji FROM reactions
+                WHERE {column} > ? AND {column} <= ?
+                ORDER BY id
+            """, (start, start + BACKFILL_BLOCK)).fetchall()
+            for row in rows:
+                summary = summaries.setdefault(row['message_id'], {})
+                count, sample = summary.get(row['emoji'], [0, []])
+                if len(sample) < REACTION_SAMPLE_SIZE and row['user_id'] not in sample:
+                    sample.append(row['user_id'])
+                summary[row['emoji']] = [count + 1, sample]
+            if summaries:
+                conn.executemany("INSERT INTO reaction_summaries (is_private, message_id, summary) VALUES (?, ?, ?)",
+                                 [(is_private, message_id, _encode(summary))
+                                  for message_id, summary in summaries.items()])
+
+
+def stats():
+    return _cache.stats()
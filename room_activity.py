@@ -0,0 +1,79 @@
+"""Compteurs d'activité des salons par tranche d'une heure (table room_activity).
+
+Chaque message inséré incrémente (room_id, heure) où l'heure est le nombre
+d'heures depuis l'epoch (UTC). « Messages des 6 dernières heures » devient
+une somme sur au plus 6 lignes par salon, au lieu d'une jointure entre les
+membres et les messages récents.
+"""
+import time
+from datetime import datetime, timezone
+
+# Tranches conservées (les fenêtres lues vont jusqu'à 24 heures)
+ACTIVITY_RETENTION_HOURS = 48
+
+_UPSERT_SQL = """
+    INSERT INTO room_activity (room_id, bucket, message_count) VALUES (?, ?, ?)
+    ON CONFLICT (room_id, bucket) DO UPDATE SET
+        message_count = room_activity.message_count + excluded.message_count
+"""
+
+_last_prune = None
+
+
+def current_bucket():
+    return int(time.time() // 3600)
+
+
+def bucket_of(timestamp):
+    """Tranche d'un horodatage 'YYYY-MM-DD HH:MM:SS' (UTC, comme CURRENT_TIMESTAMP)"""
+    moment = datetime.strptime(str(timestamp)[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() // 3600)
+
+
+def window_start(hours):
+    """Première tranche d'une fenêtre de `hours` heures (heure en cours incluse)"""
+    return current_bucket() - hours + 1
+
+
+def _prune(conn):
+    global _last_prune
+    bucket = current_bucket()
+    if _last_prune != bucket:
+        conn.execute("DELETE FROM room_activity WHERE bucket < ?", (bucket - ACTIVITY_RETENTION_HOURS,))
+        _last_prune = bucket
+
+
+def record_messages(conn, counts):
+    """Ajouter des messages: {(room_id, tranche): nombre}"""
+    if not counts:
+        return
+    conn.executemany(_UPSERT_SQL, [(room_id, bucket, count) for (room_id, bucket), count in counts.items()])
+    _prune(conn)
+
+
+def record_message(conn, room_id):
+    record_messages(conn, {(room_id, current_bucket()): 1})
+
+
+def forget_message(conn, room_id, timestamp):
+    conn.execute("""
+        UPDATE room_activity SET message_count = message_count - 1
+        WHERE room_id = ? AND bucket = ? AND message_count > 0
+    """, (room_id, bucket_of(timestamp)))
+
+
+def forget_room(conn, room_id):
+    conn.execute("DELETE FROM room_activity WHERE room_id = ?", (room_id,))
+
+
+def backfill(conn):
+    """Reconstruire les tranches récentes depuis messages (table vide)"""
+    counts = {}
+    rows = conn.execute(f"""
+        SELECT room_id, timestamp FROM messages
+        WHERE timestamp >= datetime('now', '-{ACTIVITY_RETENTION_HOURS} hours')
+    """)
+    for row in rows.fetchall():
+        key = (row['room_id'], bucket_of(row['timestamp']))
+        counts[key] = counts.get(key, 0) + 1
+    record_messages(conn, counts)
@@ -0,0 +1,93 @@
+"""Annuaire des salons: compteur de membres dénormalisé et cache des salons publics.
+
+rooms.member_count est tenu à jour à chaque entrée/sortie d'un membre (et
+recalculé à l'initialisation du schéma): le tableau de bord ne compte plus
+room_members salon par salon. La liste des salons publics est paginée et
+mise en cache PUBLIC_ROOMS_CACHE_TTL secondes, invalidée à la création et à
+la suppression d'un salon.
+"""
+import os
+import threading
+import time
+
+PUBLIC_ROOMS_PAGE_SIZE = int(os.environ.get('PUBLIC_ROOMS_PAGE_SIZE', 24))
+PUBLIC_ROOMS_CACHE_TTL = float(os.environ.get('PUBLIC_ROOMS_CACHE_TTL', 10))
+# Seules les premières pages (les plus consultées) sont gardées en cache
+PUBLIC_ROOMS_CACHED_PAGES = 10
+
+# Recalcul complet (migration initiale, correction d'une dérive éventuelle)
+RECOUNT_SQL = """
+    UPDATE rooms SET member_count = (
+        SELECT COUNT(*) FROM room_members rm WHERE rm.room_id = rooms.id
+    )
+"""
+
+
+def add_member(conn, room_id, user_id):
+    """Ajouter un membre (idempotent). Retourne True s'il n'était pas déjà membre."""
+    cursor = conn.execute("INSERT OR IGNORE INTO room_members (room_id, user_id) VALUES (?, ?)", (room_id, user_id))
+    if cursor.rowcount != 1:
+        return False
+    conn.execute("UPDATE rooms SET member_count = member_count + 1 WHERE id = ?", (room_id,))
+    return True
+
+
+def remove_member(conn, room_id, user_id):
+    """Retirer un membre. Retourne True s'il était membre."""
+    cursor = conn.execute("DELETE FROM room_members WHERE room_id = ? AND user_id = ?", (room_id, user_id))
+    if cursor.rowcount != 1:
+        return False
+    conn.execute("UPDATE rooms SET member_count = member_count - 1 WHERE id = ? AND member_count > 0", (room_id,))
+    return True
+
+
+class PublicRoomsCache:
+    """Pages de salons publics mises en cache pour une courte durée"""
+
+    def __init__(self, ttl=PUBLIC_ROOMS_CACHE_TTL):
+        self.ttl = ttl
+        self._pages = {}
+        self._lock = threading.Lock()
+
+        # Métriques
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conn, page, page_size=PUBLIC_ROOMS_PAGE_SIZE):
+        """(salons, page_suivante) pour la page demandée (1 = plus récents)"""
+        page = max(page, 1)
+        key = (page, page_size)
+        cacheable = page <= PUBLIC_ROOMS_CACHED_PAGES
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        rows = conn.execute("""
+            SELECT r.id, r.name, r.description, r.member_count, u.username AS creator_username
+            FROM rooms r
+            JOIN users u ON r.creator_id = u.id
+            WHERE r.is_private = 0
+            ORDER BY r.created_at DESC, r.id DESC
+            LIMIT ? OFFSET ?
+        """, (page_size + 1, (page - 1) * page_size)).fetchall()
+        result = ([dict(row) for row in rows[:page_size]], len(rows) > page_size)
+        if cacheable:
+            with self._lock:
+                self._pages[key] = (now + self.ttl, result)
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self):
+        with self._lock:
+            pages = len(self._pages)
+        return {'pages': pages, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+public_rooms = PublicRoomsCache()
@@ -0,0 +1,172 @@
+"""Bus de diffusion Socket.IO partagé entre processus et machines.
+
+Sans bus, `emit(..., room='room_42')` n'atteint que les clients connectés au
+même processus. Avec SOCKETIO_MESSAGE_QUEUE chaque émission (salons room_{id},
+user_{id}, broadcast) est publiée sur le bus et rejouée par tous les workers:
+
+- redis://hôte:6379/0      Redis (nécessite le paquet `redis`)
+- postgresql://...         PostgreSQL LISTEN/NOTIFY (aucun service en plus)
+- memory://                bus en mémoire du processus (tests, plusieurs
+                           serveurs Socket.IO dans un même processus)
+
+Les clients doivent rester attachés à un worker (sessions collantes) pendant
+le handshake long-polling.
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+
+import socketio
+
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'flask_socketio')
+
+# Taille maximale d'une charge NOTIFY (8000 octets côté serveur, marge incluse)
+NOTIFY_PAYLOAD_LIMIT = 7800
+# Durée de conservation des charges volumineuses stockées en table
+LARGE_PAYLOAD_TTL = 300
+
+
+class PostgresNotifyManager(socketio.PubSubManager):
+    """Bus Socket.IO basé sur LISTEN/NOTIFY de PostgreSQL"""
+    name = 'postgres'
+
+    def __init__(self, url, channel=SOCKETIO_CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+        self._table_ready = False
+        self._last_cleanup = 0.0
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.url)
+        conn.autocommit = True
+        return conn
+
+    def _ensure_table(self, cursor):
+        # Les charges > 8 ko ne passent pas par NOTIFY: stockées puis référencées
+        if not self._table_ready:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS socketio_backplane (
+                    id BIGSERIAL PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self._table_ready = True
+
+    def _send(self, payload):
+        if self._publish_conn is None or self._publish_conn.closed:
+            self._publish_conn = self._connect()
+        cursor = self._publish_conn.cursor()
+        if len(payload.encode('utf-8')) > NOTIFY_PAYLOAD_LIMIT:
+            self._ensure_table(cursor)
+            cursor.execute("INSERT INTO socketio_backplane (payload) VALUES (%s) RETURNING id", (payload,))
+            payload = f"@{cursor.fetchone()[0]}"
+            now = time.monotonic()
+            if now - self._last_cleanup > LARGE_PAYLOAD_TTL:
+                cursor.execute("DELETE FROM socketio_backplane WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+                               (LARGE_PAYLOAD_TTL,))
+                self._last_cleanup = now
+        cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+        cursor.close()
+
+    def _publish(self, data):
+        import psycopg2
+        payload = json.dumps(data)
+        with self._publish_lock:
+            try:
+                self._send(payload)
+            except psycopg2.Error:
+                self._get_logger().error('Publication PostgreSQL impossible... nouvelle tentative')
+                self._publish_conn = None
+                try:
+                    self._send(payload)
+                except psycopg2.Error:
+                    self._get_logger().error('Publication PostgreSQL impossible... abandon')
+
+    def _resolve(self, conn, payload):
+        if not payload.startswith('@'):
+            return payload
+        cursor = conn.cursor()
+        cursor.execute("SELECT payload FROM socketio_backplane WHERE id = %s", (int(payload[1:]),))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def _listen(self):
+        import psycopg2
+        retry_sleep = 1
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                cursor = conn.cursor()
+                cursor.execute(f'LISTEN "{self.channel}"')
+                cursor.close()
+                retry_sleep = 1
+                while True:
+                    # select est coopératif une fois gevent appliqué
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        payload = self._resolve(conn, notify.payload)
+                        if payload is not None:
+                            yield payload
+            except psycopg2.Error:
+                self._get_logger().error(f'Écoute PostgreSQL interrompue... reprise dans {retry_sleep}s')
+                if conn is not None and not conn.closed:
+                    conn.close()
+                time.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+
+
+_local_channels = {}
+_local_lock = threading.Lock()
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    """Bus en mémoire: relie plusieurs serveurs Socket.IO d'un même processus"""
+    name = 'memory'
+
+    def __init__(self, url='memory://', channel=SOCKETIO_CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _publish(self, data):
+        # Sérialiser comme un vrai bus pour détecter les données non transportables
+        payload = json.dumps(data)
+        with _local_lock:
+            subscribers = list(_local_channels.get(self.channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(payload)
+
+    def _listen(self):
+        subscriber = queue.Queue()
+        with _local_lock:
+            _local_channels.setdefault(self.channel, []).append(subscriber)
+        try:
+            while True:
+                yield subscriber.get()
+        finally:
+            with _local_lock:
+                _local_channels[self.channel].remove(subscriber)
+
+
+def create_client_manager(url=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL, write_only=False):
+    """Gestionnaire de clients Socket.IO pour l'URL de bus configurée (None: local)"""
+    if not url:
+        return None
+    if url.startswith(('redis://', 'rediss://', 'redis+sentinel://')):
+        return socketio.RedisManager(url, channel=channel, write_only=write_only)
+    if url.startswith(('postgresql://', 'postgres://')):
+        return PostgresNotifyManager(url, channel=channel, write_only=write_only)
+    if url.startswith('memory://'):
+        return LocalPubSubManager(url, channel=channel, write_only=write_only)
+    raise ValueError(f"SOCKETIO_MESSAGE_QUEUE non supportée: {url}")
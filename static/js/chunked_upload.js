@@ -0,0 +1,87 @@
+// Envoi de fichiers par morceaux, reprenable après une coupure (voir chunked_upload.py).
+// chunkedUpload(fichier, {kind: 'file' | 'voice', filename, onProgress}) renvoie la même
+// réponse que /upload_file ou /upload_voice.
+(function () {
+    const MAX_RETRIES = 6;
+
+    async function sha256Hex(blob) {
+        const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+    }
+
+    function postJson(url, body) {
+        return fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        }).then(response => response.json());
+    }
+
+    function singleRequestUpload(file, kind, filename) {
+        const formData = new FormData();
+        formData.append(kind === 'voice' ? 'audio' : 'file', file, filename);
+        return fetch(kind === 'voice' ? '/upload_voice' : '/upload_file', {
+            method: 'POST',
+            body: formData
+        }).then(response => response.json());
+    }
+
+    async function chunkedUpload(file, options = {}) {
+        const kind = options.kind || 'file';
+        const filename = options.filename || file.name || 'fichier';
+        if (!(window.crypto && crypto.subtle)) {
+            // Sommes SHA-256 indisponibles hors HTTPS: envoi en une seule requête
+            return singleRequestUpload(file, kind, filename);
+        }
+
+        const opened = await postJson('/api/uploads', {
+            kind: kind, filename: filename, size: file.size, mimetype: file.type
+        });
+        if (!opened.success) return opened;
+
+        const uploadUrl = `/api/uploads/${opened.upload_id}`;
+        let offset = 0;
+        let failures = 0;
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + opened.chunk_size);
+            try {
+                const response = await fetch(`${uploadUrl}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'X-Chunk-SHA256': await sha256Hex(chunk)
+                    },
+                    body: chunk
+                });
+                const data = await response.json();
+                if (data.success) {
+                    offset = data.offset;
+                    failures = 0;
+                    if (options.onProgress) options.onProgress(offset / file.size);
+                    continue;
+                }
+                // 409 (position ou écriture concurrente), 422 (morceau abîmé): on reprend
+                if (response.status !== 409 && response.status !== 422 && response.status < 500) {
+                    return data;
+                }
+            } catch (error) {
+                // Coupure réseau: on reprend à la position reçue par le serveur
+            }
+
+            if (++failures > MAX_RETRIES) {
+                return { success: false, error: 'Connexion perdue pendant l\'envoi' };
+            }
+            await new Promise(resolve => setTimeout(resolve, 500 * 2 ** failures));
+            try {
+                const status = await fetch(uploadUrl).then(response => response.json());
+                if (!status.success) return status;
+                offset = status.offset;
+            } catch (error) {
+                // Toujours hors ligne: nouvel essai au tour suivant
+            }
+        }
+        return postJson(`${uploadUrl}/finalize`, {});
+    }
+
+    window.chunkedUpload = chunkedUpload;
+})();
@@ -0,0 +1,26 @@
+// Pastilles de notification (voir notification_badges.py): une lecture de /api/badges au
+// chargement, puis les nouvelles valeurs poussées par Socket.IO (événement 'badges').
+// Les éléments marqués data-badge="friend_requests" ou data-badge="unread_messages" affichent le compteur.
+(function () {
+    function renderBadges(badges) {
+        document.querySelectorAll('[data-badge]').forEach(element => {
+            const count = badges[element.dataset.badge] || 0;
+            element.textContent = count > 0 ? count : '';
+            element.style.display = count > 0 ? '' : 'none';
+        });
+    }
+
+    // onChange(changements) est appelé à chaque variation poussée (ex. recharger une liste)
+    function watchBadges(socket, onChange) {
+        fetch('/api/badges')
+            .then(response => response.json())
+            .then(renderBadges)
+            .catch(() => {});
+        socket.on('badges', data => {
+            renderBadges(data.badges);
+            if (onChange) onChange(data.changes);
+        });
+    }
+
+    window.watchBadges = watchBadges;
+})();
@@ -0,0 +1,53 @@
+"""Base SQLite jetable par test, schéma créé par init_and_migrate."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_pool
+import db_query
+import init_and_migrate
+import message_hydrator
+import reaction_summaries
+import user_cache
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    pool = db_pool.ConnectionPool(f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(db_pool, '_pool', pool)
+    # Caches du processus: une nouvelle base réutilise les mêmes ids
+    monkeypatch.setattr(user_cache, '_cache', user_cache.UserSummaryCache())
+    monkeypatch.setattr(reaction_summaries, '_cache', reaction_summaries.ReactionSummaryCache())
+    monkeypatch.setattr(message_hydrator, '_rows', message_hydrator.MessageRowCache())
+    init_and_migrate.init_db_schema()
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def conn(pool):
+    conn = db_query.connect(pool.connection())
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def make_user(conn):
+    def make_user(username):
+        user_id = conn.execute("INSERT INTO users (username, email, password) VALUES (?, ?, 'x')",
+                               (username, f"{username}@example.com")).lastrowid
+        conn.commit()
+        return user_id
+    return make_user
+
+
+@pytest.fixture
+def make_room(conn):
+    def make_room(name, creator_id):
+        room_id = conn.execute("INSERT INTO rooms (name, creator_id) VALUES (?, ?)", (name, creator_id)).lastrowid
+        conn.commit()
+        return room_id
+    return make_room
@@ -0,0 +1,114 @@
+"""Repère de lecture des conversations privées: non-lus effacés, lectures partielles ou périmées."""
+import threading
+
+import pytest
+
+import conversation_index
+import db_query
+
+
+@pytest.fixture
+def pair(make_user):
+    return make_user('alice'), make_user('bob')
+
+
+def send(conn, sender_id, receiver_id, content):
+    message_id = conn.execute("INSERT INTO private_messages (sender_id, receiver_id, content) VALUES (?, ?, ?)",
+                              (sender_id, receiver_id, content)).lastrowid
+    conversation_index.record_private_message(conn, message_id, sender_id, receiver_id, content)
+    conn.commit()
+    return message_id
+
+
+def unread(conn, user_id, other_user_id):
+    return conn.execute("SELECT unread_count FROM conversations WHERE user_id = ? AND other_user_id = ?",
+                        (user_id, other_user_id)).fetchone()[0]
+
+
+def test_record_counts_unread_for_the_receiver_only(conn, pair):
+    alice, bob = pair
+    for i in range(3):
+        send(conn, bob, alice, f"message {i}")
+    assert unread(conn, alice, bob) == 3
+    assert unread(conn, bob, alice) == 0
+    assert conversation_index.list_conversations(conn, alice)[0]['last_message'] == 'message 2'
+
+
+def test_mark_read_up_to_a_message_keeps_later_ones_unread(conn, pair):
+    alice, bob = pair
+    received = [send(conn, bob, alice, f"message {i}") for i in range(3)]
+    # Réponse d'alice: le dernier message de la conversation n'est pas un non-lu
+    send(conn, alice, bob, "réponse")
+
+    assert conversation_index.mark_read(conn, alice, bob, up_to=received[1]) == (2, received[1])
+    assert unread(conn, alice, bob) == 1
+    assert conversation_index.read_watermark(conn, alice, bob) == received[1]
+
+    cleared, watermark = conversation_index.mark_read(conn, alice, bob)
+    assert cleared == 1
+    assert unread(conn, alice, bob) == 0
+    assert watermark > received[2]
+
+
+def test_stale_mark_read_changes_nothing(conn, pair):
+    alice, bob = pair
+    first = send(conn, bob, alice, "un")
+    second = send(conn, bob, alice, "deux")
+    assert conversation_index.mark_read(conn, alice, bob, up_to=second) == (2, second)
+
+    # Accusé de lecture en retard (ou rejoué) derrière le repère
+    assert conversation_index.mark_read(conn, alice, bob, up_to=first) == (0, None)
+    assert conversation_index.mark_read(conn, alice, bob) == (0, None)
+    assert conversation_index.read_watermark(conn, alice, bob) == second
+    # Conversation inconnue
+    assert conversation_index.mark_read(conn, bob, bob) == (0, None)
+
+
+def test_decrement_unread_only_counts_messages_after_the_watermark(conn, pair):
+    alice, bob = pair
+    read = send(conn, bob, alice, "lu")
+    conversation_index.mark_read(conn, alice, bob)
+    pending = send(conn, bob, alice, "non lu")
+    assert unread(conn, alice, bob) == 1
+
+    assert conversation_index.decrement_unread(conn, alice, bob, read) == 0
+    assert unread(conn, alice, bob) == 1
+    assert conversation_index.decrement_unread(conn, alice, bob, pending) == 1
+    assert unread(conn, alice, bob) == 0
+    # Jamais en dessous de zéro
+    assert conversation_index.decrement_unread(conn, alice, bob, pending) == 0
+
+
+def test_send_during_mark_read_is_not_lost(conn, pool, pair):
+    alice, bob = pair
+    received = [send(conn, bob, alice, f"message {i}") for i in range(3)]
+    sent = []
+
+    def send_from_other_worker():
+        other = db_query.connect(pool.connection())
+        try:
+            sent.append(send(other, bob, alice, "pendant la lecture"))
+        finally:
+            other.close()
+
+    # L'envoi arrive entre la lecture de la ligne et l'écriture du repère
+    worker = threading.Thread(target=send_from_other_worker)
+    execute = conn.execute
+
+    def interleaved(sql, params=()):
+        if 'SET last_read_message_id' in sql and worker.ident is None:
+            worker.start()
+            worker.join(0.5)
+        return execute(sql, params)
+
+    conn.execute = interleaved
+    try:
+        assert conversation_index.mark_read(conn, alice, bob, up_to=received[1]) == (2, received[1])
+        conn.commit()
+    finally:
+        del conn.execute
+    worker.join()
+
+    assert sent
+    assert unread(conn, alice, bob) == 2
+    assert conversation_index.mark_read(conn, alice, bob) == (2, sent[0])
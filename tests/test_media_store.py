@@ -0,0 +1,64 @@
+"""Stockage par contenu: dédoublonnage, collecte après le commit, ancien emplacement."""
+import os
+
+import pytest
+
+import media_store
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_store, 'MEDIA_STORE_DIR', str(tmp_path / 'media_objects'))
+    monkeypatch.setattr(media_store, 'MEDIA_GC_GRACE', -10)
+    return tmp_path
+
+
+def upload(conn, content):
+    path = media_store.temporary_path()
+    with open(path, 'wb') as target:
+        target.write(content)
+    url = media_store.put(conn, path, 'photo.png', 'image/png')
+    conn.commit()
+    return url, media_store.object_path(url[len(media_store.MEDIA_URL_PREFIX):])
+
+
+def test_same_content_is_stored_once(conn):
+    first, path = upload(conn, b'abc')
+    second, _ = upload(conn, b'abc')
+    assert first == second
+    assert os.path.exists(path)
+    assert conn.execute("SELECT COUNT(*) FROM media_objects").fetchone()[0] == 1
+    assert os.listdir(os.path.join(media_store.MEDIA_STORE_DIR, 'tmp')) == []
+
+
+def test_collect_removes_file_after_commit(conn):
+    url, path = upload(conn, b'abc')
+    assert media_store.collect(conn, force=True) == 1
+    assert not os.path.exists(path)
+    assert conn.execute("SELECT COUNT(*) FROM media_objects").fetchone()[0] == 0
+    assert os.listdir(os.path.join(media_store.MEDIA_STORE_DIR, 'trash')) == []
+
+
+def test_failed_commit_keeps_row_and_file(conn):
+    url, path = upload(conn, b'abc')
+
+    def failing():
+        raise RuntimeError("commit impossible")
+
+    conn.commit = failing
+    with pytest.raises(RuntimeError):
+        media_store.collect(conn, force=True)
+    del conn.commit
+    assert os.path.exists(path)
+    assert conn.execute("SELECT COUNT(*) FROM media_objects").fetchone()[0] == 1
+
+
+def test_legacy_store_is_moved_out_of_static(store, monkeypatch):
+    legacy = store / 'static' / 'uploads' / 'objects'
+    (legacy / 'ab').mkdir(parents=True)
+    (legacy / 'ab' / 'object').write_bytes(b'abc')
+    monkeypatch.setattr(media_store, 'LEGACY_MEDIA_STORE_DIR', str(legacy))
+
+    media_store.move_legacy_store()
+    assert not legacy.exists()
+    assert (store / 'media_objects' / 'ab' / 'object').read_bytes() == b'abc'
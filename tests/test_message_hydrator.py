@@ -0,0 +1,83 @@
+"""Hydratation par lots: forme compacte, parents, ordre, invalidation du cache."""
+from datetime import datetime
+
+import pytest
+
+import message_hydrator
+import reaction_summaries
+
+
+@pytest.fixture
+def room(make_user, make_room):
+    user_id = make_user('alice')
+    return make_room('general', user_id), user_id
+
+
+def post(conn, room_id, sender_id, content, parent_message_id=None):
+    message_id = conn.execute("""
+        INSERT INTO messages (room_id, sender_id, content, parent_message_id, timestamp)
+        VALUES (?, ?, ?, ?, '2024-03-09 14:05:33')
+    """, (room_id, sender_id, content, parent_message_id)).lastrowid
+    conn.commit()
+    return message_id
+
+
+def test_empty_fields_are_omitted(conn, room):
+    room_id, user_id = room
+    message_id = post(conn, room_id, user_id, "hello")
+    assert message_hydrator.hydrate(conn, [message_id]) == [{
+        'id': message_id,
+        'sender_id': user_id,
+        'content': 'hello',
+        'timestamp': '09/03/2024 14:05',
+        'sender_username': 'alice',
+        'sender_profile_pic': message_hydrator.DEFAULT_PROFILE_PICTURE,
+        'room_id': room_id,
+        'is_pinned': False,
+    }]
+
+
+def test_reply_carries_parent_and_reactions(conn, room, make_user):
+    room_id, alice = room
+    bob = make_user('bob')
+    parent_id = post(conn, room_id, alice, "question")
+    reply_id = post(conn, room_id, bob, "réponse", parent_id)
+    reaction_summaries.toggle(conn, alice, reply_id, '👍')
+    conn.commit()
+
+    reply = message_hydrator.hydrate(conn, [reply_id])[0]
+    assert reply['parent_message_id'] == parent_id
+    assert reply['parent_content'] == 'question'
+    assert reply['parent_username'] == 'alice'
+    assert reply['reactions'] == [{'emoji': '👍', 'count': 1, 'usernames': 'alice'}]
+
+
+def test_order_is_kept_and_deleted_messages_are_skipped(conn, room):
+    room_id, user_id = room
+    ids = [post(conn, room_id, user_id, f"message {i}") for i in range(4)]
+    message_hydrator.hydrate(conn, ids)
+
+    conn.execute("DELETE FROM messages WHERE id = ?", (ids[1],))
+    conn.commit()
+    message_hydrator.invalidate(ids[1])
+    requested = [ids[3], ids[1], ids[0], ids[2]]
+    assert [message['id'] for message in message_hydrator.hydrate(conn, requested)] == [ids[3], ids[0], ids[2]]
+
+
+def test_invalidate_reloads_the_row(conn, room):
+    room_id, user_id = room
+    message_id = post(conn, room_id, user_id, "épinglé")
+    assert message_hydrator.hydrate(conn, [message_id])[0]['is_pinned'] is False
+
+    conn.execute("UPDATE messages SET is_pinned = 1 WHERE id = ?", (message_id,))
+    conn.commit()
+    # Ligne en cache jusqu'à l'invalidation (ou l'expiration)
+    assert message_hydrator.hydrate(conn, [message_id])[0]['is_pinned'] is False
+    message_hydrator.invalidate(message_id)
+    assert message_hydrator.hydrate(conn, [message_id])[0]['is_pinned'] is True
+
+
+def test_format_timestamp():
+    assert message_hydrator.format_timestamp('2024-03-09 14:05:33') == '09/03/2024 14:05'
+    assert message_hydrator.format_timestamp(datetime(2024, 3, 9, 14, 5, 33)) == '09/03/2024 14:05'
+    assert message_hydrator.format_timestamp(None) is None
@@ -0,0 +1,194 @@
+"""Écriture différée: rejeu des journaux, verrous des segments, connexion de l'appelant."""
+import glob
+import json
+import os
+
+import pytest
+
+import db_pool
+import db_query
+import message_ingest
+import message_stats
+
+
+@pytest.fixture(autouse=True)
+def no_atexit(monkeypatch):
+    # close() à la sortie de l'interpréteur viserait une base de test déjà supprimée
+    monkeypatch.setattr(message_ingest.atexit, 'register', lambda function: None)
+
+
+def ingest_for(tmp_path, conn, **options):
+    ingest = message_ingest.MessageIngest(journal_dir=str(tmp_path / 'journal'), flush_interval=3600, **options)
+    ingest.start(lambda target: None, conn=conn)
+    return ingest
+
+
+def journals(tmp_path):
+    return sorted(glob.glob(str(tmp_path / 'journal' / '*.journal')))
+
+
+def counters(conn, room_id):
+    """(messages en base, compteur journalier, compteur horaire) du salon"""
+    messages = conn.execute("SELECT COUNT(*) FROM messages WHERE room_id = ?", (room_id,)).fetchone()[0]
+    daily = conn.execute("SELECT COALESCE(SUM(message_count), 0) FROM room_daily_stats WHERE room_id = ?",
+                         (room_id,)).fetchone()[0]
+    hourly = conn.execute("SELECT COALESCE(SUM(message_count), 0) FROM room_activity WHERE room_id = ?",
+                          (room_id,)).fetchone()[0]
+    return messages, daily, hourly
+
+
+@pytest.fixture
+def room(make_user, make_room):
+    user_id = make_user('alice')
+    return make_room('general', user_id), user_id
+
+
+def test_flush_inserts_with_reserved_ids_and_removes_segment(tmp_path, conn, room):
+    room_id, user_id = room
+    ingest = ingest_for(tmp_path, conn)
+    ids = [ingest.submit(conn, room_id, user_id, f"hello {i}", None, None, None, None)['id'] for i in range(3)]
+    assert ingest.is_pending(ids[0])
+    assert counters(conn, room_id) == (0, 0, 0)
+
+    assert ingest.flush(conn) == 3
+    assert not ingest.is_pending(ids[0])
+    assert [row['id'] for row in conn.execute("SELECT id FROM messages ORDER BY id").fetchall()] == ids
+    assert counters(conn, room_id) == (3, 3, 3)
+    # Seul le segment courant (vide) reste sur disque
+    assert len(journals(tmp_path)) == 1
+    ingest.close()
+    assert journals(tmp_path) == []
+
+
+def test_recover_replays_orphan_segment_once(tmp_path, conn, room):
+    room_id, user_id = room
+    crashed = ingest_for(tmp_path, conn)
+    for i in range(3):
+        crashed.submit(conn, room_id, user_id, f"pending {i}", None, None, None, None)
+    # Arrêt brutal: le fichier reste, son verrou disparaît avec le processus
+    crashed._journal.close()
+    orphan = crashed._journal_path
+
+    ingest_for(tmp_path, conn).close()
+    assert orphan not in journals(tmp_path)
+    assert counters(conn, room_id) == (3, 3, 3)
+
+
+def test_recover_skips_messages_already_inserted(tmp_path, conn, room):
+    room_id, user_id = room
+    ingest = ingest_for(tmp_path, conn)
+    records = [ingest.submit(conn, room_id, user_id, f"sent {i}", None, None, None, None) for i in range(2)]
+    ingest.flush(conn)
+    ingest.close()
+    assert counters(conn, room_id) == (2, 2, 2)
+
+    # Crash entre le commit du lot et la suppression du segment, ligne finale tronquée
+    with open(tmp_path / 'journal' / 'messages-1-1-1.journal', 'w', encoding='utf-8') as journal:
+        for record in records:
+            journal.write(json.dumps(record) + '\n')
+        journal.write('{"id": ')
+
+    ingest_for(tmp_path, conn).close()
+    assert journals(tmp_path) == []
+    assert counters(conn, room_id) == (2, 2, 2)
+
+
+def test_live_segment_is_not_replayed(tmp_path, conn, room):
+    room_id, user_id = room
+    live = ingest_for(tmp_path, conn)
+    live.submit(conn, room_id, user_id, "still buffered", None, None, None, None)
+
+    other = message_ingest.MessageIngest(journal_dir=str(tmp_path / 'journal'))
+    other.recover(conn)
+    assert counters(conn, room_id) == (0, 0, 0)
+
+    live.flush(conn)
+    live.close()
+    assert counters(conn, room_id) == (1, 1, 1)
+
+
+def test_failed_segment_stays_locked_until_retry_succeeds(tmp_path, conn, room, monkeypatch):
+    room_id, user_id = room
+    ingest = ingest_for(tmp_path, conn)
+    ingest.submit(conn, room_id, user_id, "first", None, None, None, None)
+
+    record = message_stats.record_room_messages
+
+    def failing(conn, messages):
+        raise RuntimeError("base indisponible")
+
+    monkeypatch.setattr(message_stats, 'record_room_messages', failing)
+    with pytest.raises(RuntimeError):
+        ingest.flush(conn)
+    # Lot annulé en entier, segment conservé et toujours verrouillé
+    assert counters(conn, room_id) == (0, 0, 0)
+    assert len(journals(tmp_path)) == 2
+    message_ingest.MessageIngest(journal_dir=str(tmp_path / 'journal')).recover(conn)
+    assert counters(conn, room_id) == (0, 0, 0)
+
+    monkeypatch.setattr(message_stats, 'record_room_messages', record)
+    ingest.submit(conn, room_id, user_id, "second", None, None, None, None)
+    assert ingest.flush(conn) == 2
+    assert counters(conn, room_id) == (2, 2, 2)
+    ingest.close()
+    assert journals(tmp_path) == []
+
+
+def test_submit_uses_the_caller_connection(tmp_path, pool, make_user, make_room, monkeypatch):
+    # Un seul emplacement, déjà pris par l'appelant: tout second emprunt expirerait
+    user_id = make_user('alice')
+    room_id = make_room('general', user_id)
+    pool.close_all()
+    single = db_pool.ConnectionPool(pool.database_url, max_size=1, timeout=0.2)
+    monkeypatch.setattr(db_pool, '_pool', single)
+
+    conn = db_query.connect(single.connection())
+    try:
+        ingest = ingest_for(tmp_path, conn, batch_size=2, id_block=2)
+        for i in range(5):
+            ingest.submit(conn, room_id, user_id, f"message {i}", None, None, None, None)
+        ingest.flush(conn)
+        assert counters(conn, room_id) == (5, 5, 5)
+        assert single.stats()['timeouts'] == 0
+    finally:
+        conn.close()
+    ingest.close()
+    assert os.listdir(tmp_path / 'journal') == []
+
+
+def test_caller_writes_are_never_committed_by_the_ingest(tmp_path, conn, room):
+    room_id, user_id = room
+    ingest = ingest_for(tmp_path, conn)
+    conn.execute("UPDATE rooms SET description = 'pas encore validé' WHERE id = ?", (room_id,))
+    with pytest.raises(RuntimeError):
+        ingest.submit(conn, room_id, user_id, "hello", None, None, None, None)
+    conn.rollback()
+    assert conn.execute("SELECT description FROM rooms WHERE id = ?", (room_id,)).fetchone()[0] != 'pas encore validé'
+
+    ingest.submit(conn, room_id, user_id, "hello", None, None, None, None)
+    conn.execute("UPDATE rooms SET description = 'pas encore validé' WHERE id = ?", (room_id,))
+    with pytest.raises(RuntimeError):
+        ingest.flush(conn)
+    conn.rollback()
+    assert ingest.flush(conn) == 1
+    ingest.close()
+
+
+def test_send_is_accepted_when_the_inline_flush_fails(tmp_path, conn, room, monkeypatch):
+    room_id, user_id = room
+    ingest = ingest_for(tmp_path, conn, batch_size=2)
+    record = message_stats.record_room_messages
+
+    def failing(conn, messages):
+        raise RuntimeError("base indisponible")
+
+    monkeypatch.setattr(message_stats, 'record_room_messages', failing)
+    ids = [ingest.submit(conn, room_id, user_id, f"message {i}", None, None, None, None)['id'] for i in range(2)]
+    assert all(ingest.is_pending(message_id) for message_id in ids)
+    assert ingest.failures == 1
+
+    # Tentative suivante (tâche périodique)
+    monkeypatch.setattr(message_stats, 'record_room_messages', record)
+    assert ingest.flush(conn) == 2
+    assert counters(conn, room_id) == (2, 2, 2)
+    ingest.close()
@@ -0,0 +1,97 @@
+"""Présence partagée entre processus: transitions notifiées une fois, lignes expirées, nouvelle tentative."""
+import pytest
+
+import presence
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, to=None):
+        self.emitted.append((event, data['user_id'], data['is_online']))
+
+
+@pytest.fixture
+def alice(conn, make_user):
+    alice, bob = make_user('alice'), make_user('bob')
+    # Bob suit le statut d'alice
+    conn.execute("INSERT INTO friends (user_id, friend_id) VALUES (?, ?)", (alice, bob))
+    conn.commit()
+    return alice
+
+
+def worker():
+    return presence.PresenceService(FakeSocketIO(), offline_grace=0, heartbeat=3600)
+
+
+def is_online(conn, user_id):
+    row = conn.execute("SELECT is_online FROM user_activity WHERE user_id = ?", (user_id,)).fetchone()
+    return bool(row['is_online'])
+
+
+def test_socket_left_on_another_worker_keeps_user_online(conn, alice):
+    a, b = worker(), worker()
+    a.connect(alice, 'sid-a')
+    a.flush()
+    b.connect(alice, 'sid-b')
+    b.flush()
+    assert a.socketio.emitted == [('user_status_changed', alice, True)]
+    assert b.socketio.emitted == []
+
+    a.disconnect(alice, 'sid-a')
+    a.flush()
+    assert a.socketio.emitted == [('user_status_changed', alice, True)]
+    assert is_online(conn, alice)
+
+    b.disconnect(alice, 'sid-b')
+    b.flush()
+    assert b.socketio.emitted == [('user_status_changed', alice, False)]
+    assert not is_online(conn, alice)
+
+
+def test_failed_write_is_retried(conn, alice, monkeypatch):
+    a = worker()
+    a.connect(alice, 'sid-a')
+    write = a._write
+
+    def failing(conn, changes, heartbeat):
+        raise RuntimeError("base indisponible")
+
+    monkeypatch.setattr(a, '_write', failing)
+    with pytest.raises(RuntimeError):
+        a.flush()
+    assert a.socketio.emitted == []
+
+    monkeypatch.setattr(a, '_write', write)
+    a.flush()
+    assert a.socketio.emitted == [('user_status_changed', alice, True)]
+    assert is_online(conn, alice)
+
+
+def test_sessions_of_a_dead_worker_expire(conn, alice):
+    crashed, alive = worker(), worker()
+    crashed.connect(alice, 'sid-a')
+    crashed.flush()
+    conn.execute("UPDATE presence_sessions SET updated_at = '2000-01-01 00:00:00'")
+    conn.commit()
+
+    # Battement de cœur du processus survivant: balayage des lignes expirées
+    alive.heartbeat = 0
+    alive.flush()
+    assert alive.socketio.emitted == [('user_status_changed', alice, False)]
+    assert not is_online(conn, alice)
+    assert conn.execute("SELECT COUNT(*) FROM presence_sessions").fetchone()[0] == 0
+
+
+def test_heartbeat_restores_a_session_removed_elsewhere(conn, alice):
+    a = worker()
+    a.connect(alice, 'sid-a')
+    a.flush()
+    conn.execute("DELETE FROM presence_sessions")
+    conn.commit()
+
+    a.heartbeat = 0
+    a.flush()
+    assert conn.execute("SELECT COUNT(*) FROM presence_sessions").fetchone()[0] == 1
+    assert is_online(conn, alice)
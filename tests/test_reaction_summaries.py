@@ -0,0 +1,127 @@
+"""Bascule des réactions: compteur, échantillon d'utilisateurs, recalcul complet."""
+import pytest
+
+import reaction_summaries
+
+
+@pytest.fixture
+def message(conn, make_user, make_room):
+    author = make_user('author')
+    room_id = make_room('general', author)
+    message_id = conn.execute("INSERT INTO messages (room_id, sender_id, content) VALUES (?, ?, 'hello')",
+                              (room_id, author)).lastrowid
+    conn.commit()
+    return message_id
+
+
+def stored(conn, message_id, is_private=False):
+    row = conn.execute(reaction_summaries._SELECT_SQL, (is_private, message_id)).fetchone()
+    return reaction_summaries._decode(row['summary']) if row else None
+
+
+def test_toggle_adds_then_removes(conn, make_user, message):
+    user_id = make_user('alice')
+    reactions = reaction_summaries.toggle(conn, user_id, message, '👍')
+    conn.commit()
+    assert reactions == [{'emoji': '👍', 'count': 1, 'usernames': 'alice'}]
+    assert stored(conn, message) == {'👍': [1, [user_id]]}
+
+    assert reaction_summaries.toggle(conn, user_id, message, '👍') == []
+    conn.commit()
+    assert stored(conn, message) == {}
+    assert conn.execute("SELECT COUNT(*) FROM reactions").fetchone()[0] == 0
+
+
+def test_sample_is_capped_and_rendered_with_remainder(conn, make_user, message):
+    user_ids = [make_user(f"user{i:02d}") for i in range(12)]
+    for user_id in user_ids:
+        reactions = reaction_summaries.toggle(conn, user_id, message, '🔥')
+    conn.commit()
+    count, sample = stored(conn, message)['🔥']
+    assert count == 12
+    assert sample == user_ids[:reaction_summaries.REACTION_SAMPLE_SIZE]
+    assert reactions[0]['count'] == 12
+    assert reactions[0]['usernames'].endswith(' et 2 autre(s)')
+
+
+def test_sample_is_refilled_when_a_sampled_user_leaves(conn, make_user, message):
+    user_ids = [make_user(f"user{i:02d}") for i in range(12)]
+    for user_id in user_ids:
+        reaction_summaries.toggle(conn, user_id, message, '🔥')
+    reaction_summaries.toggle(conn, user_ids[0], message, '🔥')
+    conn.commit()
+    count, sample = stored(conn, message)['🔥']
+    assert count == 11
+    assert len(sample) == reaction_summaries.REACTION_SAMPLE_SIZE
+    assert user_ids[0] not in sample
+    assert set(sample) <= set(user_ids[1:])
+
+
+def test_private_and_room_reactions_are_separate(conn, make_user, message):
+    alice, bob = make_user('alice'), make_user('bob')
+    private_id = conn.execute("INSERT INTO private_messages (sender_id, receiver_id, content) VALUES (?, ?, 'psst')",
+                              (alice, bob)).lastrowid
+    # Même id de part et d'autre: seules les clés is_private les distinguent
+    assert private_id == message
+    reaction_summaries.toggle(conn, alice, message, '👍')
+    reaction_summaries.toggle(conn, bob, private_id, '❤️', is_private=True)
+    conn.commit()
+
+    assert stored(conn, message) == {'👍': [1, [alice]]}
+    assert stored(conn, private_id, is_private=True) == {'❤️': [1, [bob]]}
+    assert reaction_summaries.reactions_for(conn, [private_id], is_private=True) == {
+        private_id: [{'emoji': '❤️', 'count': 1, 'usernames': 'bob'}]}
+
+
+def test_recount_matches_incremental_summaries(conn, make_user, message):
+    user_ids = [make_user(f"user{i:02d}") for i in range(14)]
+    for i, user_id in enumerate(user_ids):
+        reaction_summaries.toggle(conn, user_id, message, '🔥' if i % 2 else '👍')
+    for user_id in user_ids[:3]:
+        reaction_summaries.toggle(conn, user_id, message, '😂')
+    reaction_summaries.toggle(conn, user_ids[1], message, '🔥')
+    conn.commit()
+    incremental = stored(conn, message)
+
+    reaction_summaries.recount(conn)
+    conn.commit()
+    recounted = stored(conn, message)
+    assert {emoji: count for emoji, (count, _) in recounted.items()} == \
+        {emoji: count for emoji, (count, _) in incremental.items()}
+    for emoji, (count, sample) in recounted.items():
+        assert set(sample) == set(incremental[emoji][1])
+
+
+def test_cached_summary_follows_toggles_and_forget(conn, make_user, message):
+    user_id = make_user('alice')
+    assert reaction_summaries.reactions_for(conn, [message]) == {}
+    reaction_summaries.toggle(conn, user_id, message, '👍')
+    conn.commit()
+    assert reaction_summaries.reactions_for(conn, [message])[message][0]['count'] == 1
+
+    reaction_summaries.forget_message(conn, message)
+    conn.commit()
+    assert stored(conn, message) is None
+    assert reaction_summaries.reactions_for(conn, [message]) == {}
+
+
+def test_backfill_by_ranges_matches_toggles(conn, make_user, message, monkeypatch):
+    alice, bob = make_user('alice'), make_user('bob')
+    room_id = conn.execute("SELECT room_id FROM messages WHERE id = ?", (message,)).fetchone()[0]
+    other = conn.execute("INSERT INTO messages (room_id, sender_id, content) VALUES (?, ?, 'again')",
+                         (room_id, alice)).lastrowid
+    private_id = conn.execute("INSERT INTO private_messages (sender_id, receiver_id, content) VALUES (?, ?, 'psst')",
+                              (alice, bob)).lastrowid
+    for user_id in (alice, bob):
+        reaction_summaries.toggle(conn, user_id, message, '👍')
+        reaction_summaries.toggle(conn, user_id, other, '🔥')
+    reaction_summaries.toggle(conn, bob, private_id, '❤️', is_private=True)
+    conn.commit()
+    keys = [(False, message), (False, other), (True, private_id)]
+    incremental = {key: stored(conn, key[1], key[0]) for key in keys}
+
+    # Une plage par message: les résumés ne doivent pas dépendre du découpage
+    monkeypatch.setattr(reaction_summaries, 'BACKFILL_BLOCK', 1)
+    reaction_summaries.recount(conn)
+    conn.commit()
+    assert {key: stored(conn, key[1], key[0]) for key in keys} == incremental
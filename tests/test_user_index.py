@@ -0,0 +1,33 @@
+"""Recherche d'utilisateurs: amis d'amis au-delà du parcours alphabétique limité."""
+import user_index
+
+
+def test_friend_of_friend_past_the_candidate_cap_is_found(conn, make_user, monkeypatch):
+    monkeypatch.setattr(user_index, 'USER_SEARCH_MAX_CANDIDATES', 5)
+    me, friend = make_user('me'), make_user('friend')
+    for i in range(10):
+        make_user(f"sam{i:02d}")
+    # Dernier nom dans l'ordre alphabétique, ami d'un ami
+    target = make_user('samzz')
+    conn.execute("INSERT INTO friends (user_id, friend_id) VALUES (?, ?), (?, ?)",
+                 (me, friend, friend, target))
+    conn.commit()
+
+    index = user_index.UserIndex()
+    results = index.search(conn, me, 'sam', limit=3)
+    assert results[0] == (target, 1)
+    assert len(results) == 3
+    # Le cache des candidats alphabétiques n'est pas modifié par le graphe social
+    assert (user_index.PREFIX, target) not in index._candidates.get('sam')
+
+
+def test_substring_friend_of_friend_ranks_after_prefixes(conn, make_user):
+    me, friend = make_user('me'), make_user('friend')
+    stranger = make_user('samuel')
+    target = make_user('bigsam')
+    conn.execute("INSERT INTO friends (user_id, friend_id) VALUES (?, ?), (?, ?)",
+                 (me, friend, friend, target))
+    conn.commit()
+
+    results = user_index.UserIndex().search(conn, me, 'sam')
+    assert results == [(stranger, 0), (target, 1)]
@@ -0,0 +1,128 @@
+"""Indicateurs de saisie regroupés (événements typing et private_typing).
+
+Le gestionnaire Socket.IO ne fait qu'une mise à jour en mémoire, sans accès
+à la base. Toutes les TYPING_BROADCAST_INTERVAL secondes, chaque salon dont
+l'état a changé reçoit un seul événement avec la liste des personnes en
+train d'écrire (TYPING_MAX_NAMES noms au plus, plus le total). Une entrée
+non rafraîchie expire après TYPING_TTL secondes; les rafraîchissements plus
+rapprochés que TYPING_THROTTLE secondes sont ignorés.
+"""
+import os
+import threading
+import time
+
+import db_pool
+import db_query
+import user_cache
+
+TYPING_BROADCAST_INTERVAL = float(os.environ.get('TYPING_BROADCAST_INTERVAL', 0.5))
+TYPING_TTL = float(os.environ.get('TYPING_TTL', 6.0))
+TYPING_THROTTLE = float(os.environ.get('TYPING_THROTTLE', 1.0))
+TYPING_MAX_NAMES = int(os.environ.get('TYPING_MAX_NAMES', 3))
+
+
+class TypingAggregator:
+    """État de saisie par (événement, salon Socket.IO) et diffusion périodique"""
+
+    def __init__(self, socketio, interval=TYPING_BROADCAST_INTERVAL, ttl=TYPING_TTL,
+                 throttle=TYPING_THROTTLE, max_names=TYPING_MAX_NAMES):
+        self.socketio = socketio
+        self.interval = interval
+        self.ttl = ttl
+        self.throttle = throttle
+        self.max_names = max_names
+
+        self._lock = threading.Lock()
+        # {(événement, salon): {user_id: (début, rafraîchi_à, expire_à)}}
+        self._targets = {}
+        self._dirty = set()
+        self._started = False
+
+        # Métriques
+        self.events = 0
+        self.throttled = 0
+        self.broadcasts = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def update(self, event, room, user_id, is_typing):
+        """Enregistrer un début/fin de saisie (appelé par les gestionnaires Socket.IO)"""
+        key = (event, room)
+        now = time.monotonic()
+        with self._lock:
+            self.events += 1
+            typers = self._targets.get(key)
+            current = typers.get(user_id) if typers else None
+            if is_typing:
+                if current and now - current[1] < self.throttle:
+                    self.throttled += 1
+                    return
+                started = current[0] if current else now
+                self._targets.setdefault(key, {})[user_id] = (started, now, now + self.ttl)
+                if current is None:
+                    self._dirty.add(key)
+            elif current is not None:
+                del typers[user_id]
+                if not typers:
+                    del self._targets[key]
+                self._dirty.add(key)
+
+    def _collect(self):
+        now = time.monotonic()
+        with self._lock:
+            for key, typers in list(self._targets.items()):
+                expired = [user_id for user_id, (_, _, expires) in typers.items() if expires <= now]
+                for user_id in expired:
+                    del typers[user_id]
+                if expired:
+                    self._dirty.add(key)
+                if not typers:
+                    del self._targets[key]
+            batches = {}
+            for key in self._dirty:
+                # Les plus anciens d'abord: les noms affichés restent stables
+                typers = sorted(self._targets.get(key, {}).items(), key=lambda item: item[1][0])
+                batches[key] = [user_id for user_id, _ in typers]
+            self._dirty = set()
+        return batches
+
+    def flush(self):
+        """Envoyer un événement par salon dont l'état de saisie a changé"""
+        batches = self._collect()
+        if not batches:
+            return
+        # Un nom de plus que l'affichage: le client retire son propre nom
+        shown = {user_id for user_ids in batches.values() for user_id in user_ids[:self.max_names + 1]}
+        users = {}
+        if shown:
+            with db_query.connect(db_pool.get_pool().connection()) as conn:
+                users = user_cache.get_user_summaries(conn, shown)
+
+        for (event, room), user_ids in batches.items():
+            typing = [{'user_id': user_id, 'username': users[user_id]['username']}
+                      for user_id in user_ids[:self.max_names + 1] if user_id in users]
+            self.socketio.emit(event, {'typing': typing, 'count': len(user_ids)}, to=room)
+            self.broadcasts += 1
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Erreur indicateurs de saisie: {e}")
+
+    def stats(self):
+        with self._lock:
+            typing = sum(len(typers) for typers in self._targets.values())
+        return {
+            'typing': typing,
+            'events': self.events,
+            'throttled': self.throttled,
+            'broadcasts': self.broadcasts,
+        }
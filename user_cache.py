@@ -0,0 +1,119 @@
+"""Cache en mémoire des résumés d'utilisateurs (id, nom, photo de profil).
+
+Les événements Socket.IO (messages, indicateurs de saisie à chaque frappe)
+et les listes de messages n'ont besoin que du nom et de la photo de
+l'expéditeur: on évite une requête `users` par événement. LRU borné à
+USER_CACHE_SIZE entrées, chaque entrée expire après USER_CACHE_TTL secondes.
+
+profile() invalide l'entrée du processus courant; les autres workers voient
+le changement au plus tard après USER_CACHE_TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+
+
+class UserSummaryCache:
+    """LRU + TTL des résumés d'utilisateurs, indexé par id"""
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métriques
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, user_id, now):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < now:
+            return None
+        self._entries.move_to_end(user_id)
+        return entry[1]
+
+    def _store(self, user_id, summary, now):
+        self._entries[user_id] = (now + self.ttl, summary)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, conn, user_ids):
+        """Résumés {id: {'id', 'username', 'profile_picture_url'}}; une requête pour les absents"""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for user_id in set(user_ids):
+                summary = self._lookup(user_id, now)
+                if summary is None:
+                    missing.append(user_id)
+                else:
+                    found[user_id] = summary
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            rows = conn.execute(f"""
+                SELECT id, username, profile_picture_url FROM users
+                WHERE id IN ({','.join(['?'] * len(missing))})
+            """, missing).fetchall()
+            with self._lock:
+                for row in rows:
+                    summary = {'id': row['id'], 'username': row['username'],
+                               'profile_picture_url': row['profile_picture_url']}
+                    self._store(row['id'], summary, now)
+                    found[row['id']] = summary
+        return found
+
+    def get(self, conn, user_id):
+        """Résumé d'un utilisateur, ou None s'il n'existe pas"""
+        return self.get_many(conn, [user_id]).get(user_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+_cache = UserSummaryCache()
+
+
+def get_user_summary(conn, user_id):
+    return _cache.get(conn, user_id)
+
+
+def get_user_summaries(conn, user_ids):
+    return _cache.get_many(conn, user_ids)
+
+
+def invalidate(user_id):
+    _cache.invalidate(user_id)
+
+
+def stats():
+    return _cache.stats()
@@ -0,0 +1,261 @@
+"""Index en mémoire des noms d'utilisateurs pour la recherche à la frappe.
+
+/api/user_search faisait `username LIKE '%q%'` sur toute la table à chaque
+frappe. L'index garde les noms en minuscules triés (recherche par préfixe
+par bisection) et des n-grammes de 2 et 3 lettres (sous-chaîne: intersection
+des listes puis vérification). Il est chargé au premier appel, complété à
+l'inscription et au changement de nom dans le processus courant; les autres
+workers voient les nouveaux inscrits après USER_INDEX_REFRESH secondes au
+plus (lecture de `id > dernier id`) et les renommages après
+USER_INDEX_REBUILD secondes (rechargement complet).
+
+Classement: nom exact, puis début du nom, puis sous-chaîne; à égalité, les
+utilisateurs avec le plus d'amis en commun. Les amis d'amis dont le nom
+correspond sont toujours candidats; le parcours alphabétique, limité à
+USER_SEARCH_MAX_CANDIDATES noms, complète la liste. Les candidats d'une requête
+sont gardés USER_SEARCH_CACHE_TTL secondes (retour arrière, préfixes
+répétés), les amis d'amis d'un utilisateur aussi. Une rafale de frappes
+d'un même utilisateur n'est servie qu'une fois (begin / superseded).
+"""
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_INDEX_REFRESH = float(os.environ.get('USER_INDEX_REFRESH', 5))
+USER_INDEX_REBUILD = float(os.environ.get('USER_INDEX_REBUILD', 300))
+USER_SEARCH_CACHE_TTL = float(os.environ.get('USER_SEARCH_CACHE_TTL', 30))
+USER_SEARCH_CACHE_SIZE = 2000
+# Requêtes d'un même utilisateur plus rapprochées que ce délai (s): seule la
+# dernière est servie, les précédentes reçoivent 204
+USER_SEARCH_DEBOUNCE = float(os.environ.get('USER_SEARCH_DEBOUNCE', 0.15))
+# Candidats du parcours alphabétique par requête (les amis d'amis s'y ajoutent)
+USER_SEARCH_MAX_CANDIDATES = 200
+
+EXACT, PREFIX, SUBSTRING = 0, 1, 2
+
+
+def _grams(text):
+    if len(text) < 3:
+        return {text} if len(text) == 2 else set()
+    return ({text[i:i + 2] for i in range(len(text) - 1)}
+            | {text[i:i + 3] for i in range(len(text) - 2)})
+
+
+class _TTLCache:
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UserIndex:
+    """Noms d'utilisateurs indexés par préfixe et par n-grammes"""
+
+    def __init__(self, refresh=USER_INDEX_REFRESH, rebuild=USER_INDEX_REBUILD,
+                 cache_ttl=USER_SEARCH_CACHE_TTL):
+        self.refresh = refresh
+        self.rebuild = rebuild
+        self._lock = threading.Lock()
+        self._names = {}
+        self._sorted = []
+        self._grams = {}
+        self._max_id = 0
+        self._loaded_at = None
+        self._refreshed_at = None
+        self._candidates = _TTLCache(cache_ttl, USER_SEARCH_CACHE_SIZE)
+        self._affinity = _TTLCache(cache_ttl, USER_SEARCH_CACHE_SIZE)
+        # Dernière requête de chaque utilisateur: (numéro, instant)
+        self._latest = _TTLCache(60, USER_SEARCH_CACHE_SIZE)
+
+        # Métriques
+        self.searches = 0
+        self.cache_hits = 0
+        self.loads = 0
+        self.debounced = 0
+
+    def _add(self, user_id, username, keep_sorted=True):
+        name = username.lower()
+        self._names[user_id] = name
+        if keep_sorted:
+            bisect.insort(self._sorted, (name, user_id))
+        else:
+            self._sorted.append((name, user_id))
+        for gram in _grams(name):
+            self._grams.setdefault(gram, set()).add(user_id)
+        self._max_id = max(self._max_id, user_id)
+
+    def _remove(self, user_id):
+        name = self._names.pop(user_id, None)
+        if name is None:
+            return
+        position = bisect.bisect_left(self._sorted, (name, user_id))
+        if position < len(self._sorted) and self._sorted[position] == (name, user_id):
+            del self._sorted[position]
+        for gram in _grams(name):
+            ids = self._grams.get(gram)
+            if ids:
+                ids.discard(user_id)
+                if not ids:
+                    del self._grams[gram]
+
+    def _ensure(self, conn):
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at >= self.rebuild:
+            rows = conn.execute("SELECT id, username FROM users").fetchall()
+            with self._lock:
+                self._names, self._sorted, self._grams, self._max_id = {}, [], {}, 0
+                for row in rows:
+                    self._add(row['id'], row['username'], keep_sorted=False)
+                self._sorted.sort()
+                self._candidates.clear()
+                self._loaded_at = self._refreshed_at = now
+                self.loads += 1
+        elif now - self._refreshed_at >= self.refresh:
+            # Inscriptions reçues par les autres workers
+            rows = conn.execute("SELECT id, username FROM users WHERE id > ?", (self._max_id,)).fetchall()
+            with self._lock:
+                for row in rows:
+                    self._remove(row['id'])
+                    self._add(row['id'], row['username'])
+                if rows:
+                    self._candidates.clear()
+                self._refreshed_at = now
+
+    def upsert(self, user_id, username):
+        """Inscription ou changement de nom dans ce processus"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._remove(user_id)
+            self._add(user_id, username)
+            self._candidates.clear()
+
+    def _classify(self, user_id, query):
+        """Classe du nom de l'utilisateur pour la requête, None s'il ne la contient pas"""
+        name = self._names.get(user_id)
+        if name is None or query not in name:
+            return None
+        return EXACT if name == query else PREFIX if name.startswith(query) else SUBSTRING
+
+    def _match(self, query):
+        """[(classe, id)] des noms qui contiennent la requête, préfixes d'abord"""
+        matches = []
+        seen = set()
+        position = bisect.bisect_left(self._sorted, (query,))
+        while position < len(self._sorted) and len(matches) < USER_SEARCH_MAX_CANDIDATES:
+            name, user_id = self._sorted[position]
+            if not name.startswith(query):
+                break
+            matches.append((EXACT if name == query else PREFIX, user_id))
+            seen.add(user_id)
+            position += 1
+
+        grams = sorted((self._grams.get(gram, set()) for gram in _grams(query)), key=len)
+        if grams and len(matches) < USER_SEARCH_MAX_CANDIDATES:
+            ids = set(grams[0]).intersection(*grams[1:])
+            for user_id in sorted(ids - seen, key=lambda user_id: self._names[user_id]):
+                if query in self._names[user_id]:
+                    matches.append((SUBSTRING, user_id))
+                    if len(matches) >= USER_SEARCH_MAX_CANDIDATES:
+                        break
+        return matches
+
+    def begin(self, user_id):
+        """(numéro de la requête, True si elle suit la précédente de moins de USER_SEARCH_DEBOUNCE)"""
+        now = time.monotonic()
+        with self._lock:
+            number, previous = self._latest.get(user_id) or (0, 0.0)
+            self._latest.put(user_id, (number + 1, now))
+        return number + 1, now - previous < USER_SEARCH_DEBOUNCE
+
+    def superseded(self, user_id, number):
+        """Une requête plus récente du même utilisateur est arrivée entre-temps"""
+        with self._lock:
+            latest = self._latest.get(user_id)
+            if latest is not None and latest[0] != number:
+                self.debounced += 1
+                return True
+        return False
+
+    def mutual_friends(self, conn, user_id):
+        """{id: nombre d'amis en commun} des amis d'amis de l'utilisateur"""
+        with self._lock:
+            cached = self._affinity.get(user_id)
+        if cached is not None:
+            return cached
+        rows = conn.execute("""
+            SELECT f2.friend_id AS id, COUNT(*) AS mutual
+            FROM friends f1
+            JOIN friends f2 ON f2.user_id = f1.friend_id
+            WHERE f1.user_id = ? AND f2.friend_id != ?
+            GROUP BY f2.friend_id
+        """, (user_id, user_id)).fetchall()
+        mutual = {row['id']: row['mutual'] for row in rows}
+        with self._lock:
+            self._affinity.put(user_id, mutual)
+        return mutual
+
+    def search(self, conn, user_id, query, limit=10):
+        """[(id, amis en commun)] classés pour la requête"""
+        query = query.strip().lower()
+        self._ensure(conn)
+        with self._lock:
+            self.searches += 1
+            matches = self._candidates.get(query)
+            if matches is None:
+                matches = self._match(query)
+                self._candidates.put(query, matches)
+            else:
+                self.cache_hits += 1
+        mutual = self.mutual_friends(conn, user_id)
+        with self._lock:
+            # Amis d'amis pris dans le graphe social: un nom au-delà du parcours
+            # alphabétique limité reste candidat
+            social = []
+            for friend_id in mutual:
+                match_class = self._classify(friend_id, query)
+                if match_class is not None:
+                    social.append((match_class, friend_id))
+            seen = {friend_id for _, friend_id in social}
+            matches = social + [match for match in matches if match[1] not in seen]
+            names = {match_user: self._names.get(match_user, '') for _, match_user in matches}
+        ranked = sorted((match for match in matches if match[1] != user_id),
+                        key=lambda match: (match[0], -mutual.get(match[1], 0),
+                                           len(names[match[1]]), names[match[1]]))
+        return [(match_user, mutual.get(match_user, 0)) for _, match_user in ranked[:limit]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._names),
+                'grams': len(self._grams),
+                'cached_queries': len(self._candidates),
+                'searches': self.searches,
+                'cache_hits': self.cache_hits,
+                'loads': self.loads,
+                'debounced': self.debounced,
+            }
+
+
+directory = UserIndex()
@@ -0,0 +1,184 @@
+"""Messages vocaux convertis en Ogg/Opus, avec durée et forme d'onde.
+
+upload_voice() rangeait chaque enregistrement tel quel ({uuid}.wav dans
+static/voice_messages), environ dix fois plus lourd qu'en Opus. Après
+l'envoi, le fichier est converti hors de la requête par ffmpeg (un processus
+par conversion, au plus VOICE_TRANSCODE_WORKERS à la fois), qui produit en
+une passe le fichier .ogg et un flux PCM réduit d'où sont tirées la durée et
+la forme d'onde (VOICE_WAVEFORM_BARS barres de 0 à 100) affichées par le
+lecteur.
+
+voice_notes associe l'URL d'origine au résultat: les messages déjà envoyés
+sont réécrits (voice_message_url), ceux envoyés pendant la conversion sont
+traduits par current_url() puis réécrits à nouveau avant la suppression du
+fichier d'origine, VOICE_ORIGINAL_GRACE secondes plus tard (lecteurs déjà
+ouverts). Sans ffmpeg (FFMPEG_PATH ou PATH), les enregistrements restent
+servis tels quels.
+"""
+import json
+import os
+import shutil
+import subprocess
+import threading
+from array import array
+
+import db_pool
+import db_query
+
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH') or shutil.which('ffmpeg')
+VOICE_TRANSCODE_WORKERS = int(os.environ.get('VOICE_TRANSCODE_WORKERS', 2))
+VOICE_OPUS_BITRATE = os.environ.get('VOICE_OPUS_BITRATE', '24k')
+VOICE_ORIGINAL_GRACE = float(os.environ.get('VOICE_ORIGINAL_GRACE', 300))
+VOICE_WAVEFORM_BARS = 48
+VOICE_TRANSCODE_TIMEOUT = 120
+# Flux PCM (mono, 16 bits) utilisé pour la durée et la forme d'onde
+ANALYSIS_RATE = 8000
+
+
+def available():
+    return bool(FFMPEG_PATH)
+
+
+def waveform(samples, bars=VOICE_WAVEFORM_BARS):
+    """Amplitude crête de chaque tranche, de 0 à 100 (relative au maximum)"""
+    if not samples:
+        return []
+    step = len(samples) / bars
+    peaks = []
+    for index in range(bars):
+        chunk = samples[int(index * step):max(int((index + 1) * step), int(index * step) + 1)]
+        peaks.append(max(max(chunk), -min(chunk)) if chunk else 0)
+    loudest = max(peaks) or 1
+    return [round(peak * 100 / loudest) for peak in peaks]
+
+
+def transcode(source_path, target_path, bitrate=VOICE_OPUS_BITRATE):
+    """Convertir en Ogg/Opus. Retourne {'duration_ms', 'waveform'}; lève une exception si ffmpeg échoue."""
+    temporary = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    command = [FFMPEG_PATH, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-i', source_path,
+               '-vn', '-map_metadata', '-1', '-c:a', 'libopus', '-b:a', bitrate, '-application', 'voip',
+               '-f', 'ogg', temporary,
+               '-vn', '-ac', '1', '-ar', str(ANALYSIS_RATE), '-f', 's16le', 'pipe:1']
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                timeout=VOICE_TRANSCODE_TIMEOUT)
+        if result.returncode != 0:
+            errors = result.stderr.decode('utf-8', 'replace').strip().splitlines()
+            raise RuntimeError(errors[-1] if errors else 'ffmpeg a échoué')
+        samples = array('h')
+        samples.frombytes(result.stdout[:len(result.stdout) // 2 * 2])
+        if not samples:
+            raise RuntimeError('enregistrement vide')
+        os.replace(temporary, target_path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return {'duration_ms': len(samples) * 1000 // ANALYSIS_RATE, 'waveform': waveform(samples)}
+
+
+def notes_for(conn, urls):
+    """{URL d'origine ou convertie: ligne voice_notes} pour les URL données"""
+    urls = list({url for url in urls if url})
+    if not urls:
+        return {}
+    placeholders = ','.join(['?'] * len(urls))
+    rows = conn.execute(f"""
+        SELECT source, url, duration_ms, waveform
+        FROM voice_notes
+        WHERE source IN ({placeholders}) OR url IN ({placeholders})
+    """, urls + urls).fetchall()
+    notes = {}
+    for row in rows:
+        note = dict(row)
+        note['waveform'] = json.loads(note['waveform'] or '[]')
+        notes[note['source']] = notes[note['url']] = note
+    return notes
+
+
+def current_url(conn, url):
+    """URL convertie d'un message vocal envoyé après la fin de la conversion"""
+    note = notes_for(conn, [url]).get(url) if url else None
+    return note['url'] if note else url
+
+
+def rewrite_messages(conn, source, url):
+    """Messages de salon et privés qui désignent encore l'original. Retourne leur nombre."""
+    updated = 0
+    for table in ('messages', 'private_messages'):
+        updated += conn.execute(f"UPDATE {table} SET voice_message_url = ? WHERE voice_message_url = ?",
+                                (url, source)).rowcount
+    return updated
+
+
+class VoiceTranscoder:
+    """File de conversion des messages vocaux, exécutée hors des requêtes"""
+
+    def __init__(self, socketio, workers=VOICE_TRANSCODE_WORKERS, original_grace=VOICE_ORIGINAL_GRACE):
+        self.socketio = socketio
+        self.workers = workers
+        self.original_grace = original_grace
+        self._slots = threading.BoundedSemaphore(workers)
+
+        # Métriques
+        self.submitted = 0
+        self.transcoded = 0
+        self.failures = 0
+        self.rewritten = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def submit(self, source, source_path, target_path, url):
+        """Convertir en arrière-plan le message vocal `source` (URL), servi ensuite à `url`"""
+        if not available():
+            return False
+        self.submitted += 1
+        self.socketio.start_background_task(self._process, source, source_path, target_path, url)
+        return True
+
+    def _process(self, source, source_path, target_path, url):
+        try:
+            with self._slots:
+                # ffmpeg tourne dans son propre processus: la boucle gevent n'attend que ses tubes
+                result = transcode(source_path, target_path)
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Message vocal {source} non converti: {e}")
+            return
+
+        conn = db_query.connect(db_pool.get_pool().connection())
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO voice_notes (source, url, duration_ms, waveform)
+                VALUES (?, ?, ?, ?)
+            """, (source, url, result['duration_ms'], json.dumps(result['waveform'])))
+            self.rewritten += rewrite_messages(conn, source, url)
+            conn.commit()
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Message vocal {source} converti mais non enregistré: {e}")
+            os.remove(target_path)
+            return
+        finally:
+            conn.close()
+        self.transcoded += 1
+        self.bytes_in += os.path.getsize(source_path)
+        self.bytes_out += os.path.getsize(target_path)
+
+        # Lecteurs déjà ouverts sur l'original et messages encore en vol (écriture différée)
+        self.socketio.sleep(self.original_grace)
+        conn = db_query.connect(db_pool.get_pool().connection())
+        try:
+            self.rewritten += rewrite_messages(conn, source, url)
+            conn.commit()
+            os.remove(source_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Original du message vocal {source} conservé: {e}")
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {'available': available(), 'workers': self.workers, 'submitted': self.submitted,
+                'transcoded': self.transcoded, 'failures': self.failures, 'rewritten': self.rewritten,
+                'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
@@ -1,3 +1,6 @@
+# Le patch gevent doit précéder tout autre import (sockets, verrous, psycopg2)
+import gevent_patch
+gevent_patch.patch()
 
 import os
 from main import app, socketio
@@ -11,12 +14,22 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROFILE_PICS_FOLDER, exist_ok=True)
 os.makedirs(VOICE_FOLDER, exist_ok=True)
 
+# Fichiers de chat: stockage hors de static/ (déplacé une fois depuis l'ancien emplacement)
+import media_store
+media_store.move_legacy_store()
+
 # Initialiser la base de données
+import db_pool
 import init_and_migrate
 init_and_migrate.init_db_schema()
 
-# Point d'entrée pour les serveurs WSGI
-application = socketio
+# Avec preload_app le module est chargé dans le processus maître: ne pas
+# transmettre ses connexions ouvertes aux workers forkés
+db_pool.get_pool().close_all()
+
+# Point d'entrée pour les serveurs WSGI: Flask-SocketIO a déjà enveloppé
+# app.wsgi_app, l'objet SocketIO lui-même n'est pas appelable
+application = app
 
 if __name__ == "__main__":
     # Pour le développement local